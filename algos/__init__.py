@@ -1,7 +1,12 @@
 from .utils import (
     get_pixel_aligned_extent,
     get_extent_layer,
+    get_reprojected_raster_layer,
     get_reprojected_vector_layer,
 )
 from .interpolate import clip_and_interpolate_dem
-from .sampling import get_utm_fire_layers, get_sampling_point_grid_layer
+from .sampling import (
+    get_utm_fire_layers,
+    get_sampling_point_grid_layer,
+    set_sampling_layer_fire_bc,
+)
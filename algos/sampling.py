@@ -100,25 +100,13 @@ def get_sampling_point_grid_layer(
         )
         if utm_fire_layer:
             # Set fire
-            _load_fire_layer_bc(
+            set_sampling_layer_fire_bc(
                 context,
                 feedback,
                 sampling_layer=tmp["OUTPUT"],
-                fire_layer=utm_b_fire_layer,
-                bc_field="bc_out",
-                bc_default=landuse_type.bc_out_default,
-            )
-
-            if feedback.isCanceled():
-                return {}
-
-            _load_fire_layer_bc(
-                context,
-                feedback,
-                sampling_layer=tmp["OUTPUT"],
-                fire_layer=utm_fire_layer,
-                bc_field="bc_in",
-                bc_default=landuse_type.bc_in_default,
+                landuse_type=landuse_type,
+                utm_fire_layer=utm_fire_layer,
+                utm_b_fire_layer=utm_b_fire_layer,
             )
 
             if feedback.isCanceled():
@@ -140,6 +128,48 @@ def get_sampling_point_grid_layer(
     return tmp
 
 
+def set_sampling_layer_fire_bc(
+    context,
+    feedback,
+    sampling_layer,
+    landuse_type,
+    utm_fire_layer,
+    utm_b_fire_layer,
+):
+    text = f"Set fire layer bcs in sampling layer..."
+    feedback.pushInfo(text)
+
+    # Reset previous fire layer bcs, if any
+    layer = context.getMapLayer(sampling_layer)
+    bc_idx = layer.dataProvider().fieldNameIndex("bc")
+    if bc_idx != -1:
+        layer.dataProvider().deleteAttributes([bc_idx])
+        layer.updateFields()
+
+    # External (fire front)
+    _load_fire_layer_bc(
+        context,
+        feedback,
+        sampling_layer=sampling_layer,
+        fire_layer=utm_b_fire_layer,
+        bc_field="bc_out",
+        bc_default=landuse_type.bc_out_default,
+    )
+
+    if feedback.isCanceled():
+        return
+
+    # Internal (burned area)
+    _load_fire_layer_bc(
+        context,
+        feedback,
+        sampling_layer=sampling_layer,
+        fire_layer=utm_fire_layer,
+        bc_field="bc_in",
+        bc_default=landuse_type.bc_in_default,
+    )
+
+
 def _load_fire_layer_bc(
     context,
     feedback,
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+
+"""qgis2fds"""
+
+__author__ = "Emanuele Gissi"
+__date__ = "2020-05-04"
+__copyright__ = "(C) 2020 by Emanuele Gissi"
+__revision__ = "$Format:%H$"  # replaced with git SHA1
+
+# End-to-end benchmark of the qgis2fds algorithm, without display.
+#
+# Usage:
+#   QT_QPA_PLATFORM=offscreen python3 benchmarks/bench_pipeline.py \
+#     [-s 1000 2000] [-p 10 5] [-o results.json]
+#
+# A temporary QGIS project is built with generated GeoTIFF DEM and landuse
+# rasters and a fire polygon layer, then the algorithm is run
+# for each domain size and pixel size, like the batch runner does.
+# The elapsed time of each child processing algorithm
+# (eg. native:creategrid, native:setzfromraster, qgis:tininterpolation, ...)
+# and of the terrain, domain, texture, and write steps is saved to JSON.
+# The write steps run concurrently, so their times overlap.
+# Needs QGIS and GDAL.
+
+import os, argparse, contextlib, importlib.util, json, platform, tempfile, threading, time
+import numpy as np
+
+from bench_terrain import _plugin_path, get_commit, get_landuses
+
+utm_crs = "EPSG:32632"
+utm_center = (500000.0, 5000000.0)
+
+
+def import_batch():
+    """Import the batch runner, it inits QGIS and runs the jobs."""
+    spec = importlib.util.spec_from_file_location(
+        "qgis2fds_batch", os.path.join(_plugin_path, "qgis2fds_batch.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# Synthetic project
+
+
+def write_geotiff(filepath, array, res, gdal_type):
+    """Write a single band GeoTIFF in UTM, centered on utm_center."""
+    from osgeo import gdal, osr
+
+    nrows, ncols = array.shape
+    ds = gdal.GetDriverByName("GTiff").Create(filepath, ncols, nrows, 1, gdal_type)
+    ds.SetGeoTransform(
+        (
+            utm_center[0] - ncols * res / 2.0,
+            res,
+            0.0,
+            utm_center[1] + nrows * res / 2.0,
+            0.0,
+            -res,
+        )
+    )
+    srs = osr.SpatialReference()
+    srs.SetFromUserInput(utm_crs)
+    ds.SetProjection(srs.ExportToWkt())
+    ds.GetRasterBand(1).WriteArray(array)
+    ds.FlushCache()
+    ds = None
+
+
+def write_fire_layer(filepath, side):
+    """Write the fire polygon layer, a square in the domain center."""
+    from osgeo import ogr, osr
+
+    srs = osr.SpatialReference()
+    srs.SetFromUserInput(utm_crs)
+    ds = ogr.GetDriverByName("GPKG").CreateDataSource(filepath)
+    layer = ds.CreateLayer("fire", srs, ogr.wkbPolygon)
+    x, y, d = utm_center[0], utm_center[1], side / 20.0
+    feature = ogr.Feature(layer.GetLayerDefn())
+    feature.SetGeometry(
+        ogr.CreateGeometryFromWkt(
+            f"POLYGON(({x-d} {y-d},{x+d} {y-d},{x+d} {y+d},{x-d} {y+d},{x-d} {y-d}))"
+        )
+    )
+    layer.CreateFeature(feature)
+    ds = None
+
+
+def get_synthetic_project(path, side, res, seed=0):
+    """!
+    Build a QGIS project with DEM, landuse and fire layers, and the job.
+    @param path: destination folder
+    @param side: domain side in meters
+    @param res: raster resolution in meters
+    @param seed: random seed
+    @return the job dict of algorithm parameters.
+    """
+    from osgeo import gdal
+    from qgis.core import (
+        QgsProject,
+        QgsRasterLayer,
+        QgsVectorLayer,
+        QgsCoordinateReferenceSystem,
+    )
+
+    # Rasters, larger than the domain
+    margin = 100.0
+    n = int((side + 2.0 * margin) / res)
+    rng = np.random.default_rng(seed)
+    ys, xs = np.mgrid[0:n, 0:n] * res
+    dem = (
+        500.0
+        + 200.0 * np.sin(xs / side * 4.0 * np.pi) * np.cos(ys / side * 2.0 * np.pi)
+        + rng.normal(0.0, 1.0, xs.shape)
+    )
+    landuses = get_landuses()
+    patches = (xs // (res * 50)) * 7 + ys // (res * 50)
+    landuse = np.array(landuses[1:-2])[patches.astype(int) % (len(landuses) - 3)]
+    dem_filepath = os.path.join(path, "dem.tif")
+    landuse_filepath = os.path.join(path, "landuse.tif")
+    fire_filepath = os.path.join(path, "fire.gpkg")
+    write_geotiff(dem_filepath, dem.astype("float32"), res, gdal.GDT_Float32)
+    write_geotiff(landuse_filepath, landuse.astype("int16"), res, gdal.GDT_Int16)
+    write_fire_layer(fire_filepath, side)
+
+    # Project
+    project = QgsProject()
+    project.setCrs(QgsCoordinateReferenceSystem(utm_crs))
+    project.addMapLayers(
+        (
+            QgsRasterLayer(dem_filepath, "dem"),
+            QgsRasterLayer(landuse_filepath, "landuse"),
+            QgsVectorLayer(fire_filepath, "fire", "ogr"),
+        )
+    )
+    project_filepath = os.path.join(path, "bench.qgz")
+    project.write(project_filepath)
+
+    x0, y0, d = utm_center[0], utm_center[1], side / 2.0
+    return {
+        "project": project_filepath,
+        "chid": "bench",
+        "fds_path": os.path.join(path, "fds"),
+        "extent": f"{x0-d},{x0+d},{y0-d},{y0+d} [{utm_crs}]",
+        "dem_layer": dem_filepath,
+        "landuse_layer": landuse_filepath,
+        "landuse_type_filepath": os.path.join(
+            _plugin_path, "landuse_types", "Landfire.gov_F13.csv"
+        ),
+        "fire_layer": fire_filepath,
+        "export_obst": False,
+    }
+
+
+# Timings
+
+
+class Timings:
+    """Sum elapsed times and calls by step name."""
+
+    def __init__(self) -> None:
+        self.steps = dict()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            dt = time.perf_counter() - t0
+            with self._lock:  # measured from worker threads too
+                step = self.steps.setdefault(name, {"calls": 0, "time_s": 0.0})
+                step["calls"] += 1
+                step["time_s"] += dt
+
+
+@contextlib.contextmanager
+def timed_pipeline(timings, alg_id):
+    """Time the child processing algorithms and the qgis2fds steps."""
+    import processing
+    from qgis2fds.types import GEOMTerrain, OBSTTerrain, Domain, Texture, FDSCase
+
+    run = processing.run
+
+    def timed_run(algOrName, *args, **kwargs):
+        if algOrName == alg_id:  # the algorithm itself
+            return run(algOrName, *args, **kwargs)
+        with timings.measure(str(algOrName)):
+            return run(algOrName, *args, **kwargs)
+
+    def get_wrapped(func, name):
+        def wrapped(*args, **kwargs):
+            with timings.measure(name):
+                return func(*args, **kwargs)
+
+        return wrapped
+
+    methods = (
+        (GEOMTerrain, "__init__", "qgis2fds:terrain"),
+        (OBSTTerrain, "__init__", "qgis2fds:terrain"),
+        (Domain, "__init__", "qgis2fds:domain"),
+        (Texture, "__init__", "qgis2fds:texture"),
+        (GEOMTerrain, "save", "qgis2fds:write terrain"),
+        (OBSTTerrain, "save", "qgis2fds:write terrain"),
+        (Texture, "save", "qgis2fds:write texture"),
+        (FDSCase, "save", "qgis2fds:write"),
+    )
+    originals = [(c, attr, c.__dict__[attr]) for c, attr, _ in methods]
+    processing.run = timed_run
+    for c, attr, name in methods:
+        setattr(c, attr, get_wrapped(c.__dict__[attr], name))
+    try:
+        yield
+    finally:
+        processing.run = run
+        for c, attr, func in originals:
+            setattr(c, attr, func)
+
+
+# Run
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the qgis2fds algorithm end-to-end."
+    )
+    parser.add_argument(
+        "-s",
+        "--sizes",
+        type=float,
+        nargs="+",
+        default=(1000.0, 2000.0, 4000.0),
+        help="domain sides in meters",
+    )
+    parser.add_argument(
+        "-p",
+        "--pixel-sizes",
+        type=float,
+        nargs="+",
+        default=(20.0, 10.0, 5.0),
+        help="algorithm pixel sizes in meters",
+    )
+    parser.add_argument(
+        "--dem-res", type=float, default=5.0, help="DEM and landuse resolution in meters"
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="print feedback")
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=f"bench_pipeline_{time.strftime('%Y%m%d_%H%M%S')}.json",
+        help="results *.json filepath",
+    )
+    args = parser.parse_args(argv)
+
+    batch = import_batch()
+    t0 = time.perf_counter()
+    app, alg_id = batch.init_qgis()
+    print(f"QGIS and processing ready in {time.perf_counter() - t0:.1f} s", flush=True)
+
+    from qgis.core import Qgis
+
+    results = {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": get_commit(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "qgis": Qgis.QGIS_VERSION,
+        "dem_res": args.dem_res,
+        "runs": list(),
+    }
+    for side in args.sizes:
+        with tempfile.TemporaryDirectory() as path:
+            job = get_synthetic_project(path, side=side, res=args.dem_res)
+            for pixel_size in args.pixel_sizes:
+                timings, status = Timings(), "ok"
+                t0 = time.perf_counter()
+                with timed_pipeline(timings, alg_id):
+                    try:
+                        batch.run_job(
+                            alg_id=alg_id,
+                            job={**job, "pixel_size": pixel_size},
+                            base_path=path,
+                            verbose=args.verbose,
+                        )
+                    except Exception as err:
+                        status = f"error: {err}"
+                total = time.perf_counter() - t0
+                results["runs"].append(
+                    {
+                        "side": side,
+                        "pixel_size": pixel_size,
+                        "npoints": int(side / pixel_size) ** 2,
+                        "status": status,
+                        "time_s": total,
+                        "steps": timings.steps,
+                    }
+                )
+                print(f"{side:.0f}m at {pixel_size:.1f}m: {status} in {total:.2f} s")
+                for name, step in sorted(
+                    timings.steps.items(), key=lambda item: -item[1]["time_s"]
+                ):
+                    print(
+                        f"  {name:40s} {step['calls']:3d} calls {step['time_s']:9.3f} s {step['time_s'] / total * 100.:5.1f}%",
+                        flush=True,
+                    )
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved: <{args.output}>")
+    app.exitQgis()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,484 @@
+# -*- coding: utf-8 -*-
+
+"""qgis2fds"""
+
+__author__ = "Emanuele Gissi"
+__date__ = "2020-05-04"
+__copyright__ = "(C) 2020 by Emanuele Gissi"
+__revision__ = "$Format:%H$"  # replaced with git SHA1
+
+# Benchmark of the terrain, OBST, bingeom and domain code
+# on synthetic DEM, landuse, and fire grids, without display.
+#
+# Usage:
+#   python3 benchmarks/bench_terrain.py [-s 100 250 500] [-r 3] [-m 512] [-t 0.5] [-o results.json]
+#
+# The QGIS-free core functions are always benchmarked.
+# When QGIS is available, the plugin classes are benchmarked too,
+# with a memory sampling layer of up to --max-qgis-size points per side:
+#   GEOMTerrain._init_matrix, ._inject_ghost_centers, ._save_bingeom,
+#   OBSTTerrain._init_obsts, Domain, and FDSCase.get_fds.
+# With --max-memory, the terrain is processed in the compact
+# float32 layout by row chunks, when over the memory budget.
+# With --tolerance, the GEOM terrain is also simplified.
+#
+# For each step, the best elapsed time and the largest peak of
+# the memory allocated during the step (by tracemalloc) are saved to JSON,
+# so that runs can be compared over time.
+
+import os, sys
+
+# The plugin folder contains the types package,
+# that would shadow the types module of the Python standard library
+_plugin_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path = [p for p in sys.path if os.path.abspath(p or ".") != _plugin_path]
+
+import argparse, contextlib, csv, gc, importlib, importlib.util, json
+import platform, subprocess, tempfile, time, tracemalloc
+import numpy as np
+
+pixel_size = 10.0  # synthetic grid spacing
+cell_size = 10.0  # MESH cell size
+nmesh = 4
+landuse_type_filepath = os.path.join(
+    _plugin_path, "landuse_types", "Landfire.gov_F13.csv"
+)
+
+
+def import_plugin():
+    """!
+    Import the plugin package as qgis2fds, whatever its folder name.
+    @return the plugin package.
+    """
+    if "qgis2fds" in sys.modules:
+        return sys.modules["qgis2fds"]
+    spec = importlib.util.spec_from_file_location(
+        "qgis2fds",
+        os.path.join(_plugin_path, "__init__.py"),
+        submodule_search_locations=[_plugin_path],
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["qgis2fds"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+# Synthetic grids
+
+
+def get_landuses():
+    """Get the landuse indexes of the landuse type file."""
+    with open(landuse_type_filepath) as f:
+        reader = csv.reader(f)
+        next(reader)  # skip header line
+        return [int(r[0]) for r in reader]
+
+
+def get_synthetic_points(n, seed=0):
+    """!
+    Get synthetic sampling points, ordered by column from the top, like the sampling layer.
+    Hills and noise for z, square patches of landuse, and a burned square in the center.
+    @param n: number of points per side
+    @param seed: random seed
+    @return np.array of shape (n * n, 4) of (x, y, z, landuse), centered on the origin.
+    """
+    rng = np.random.default_rng(seed)
+    landuses = get_landuses()
+    side = n * pixel_size
+    x = (np.arange(n) - n / 2.0) * pixel_size
+    y = (n / 2.0 - np.arange(n)) * pixel_size
+    xs, ys = np.meshgrid(x, y, indexing="ij")  # by column
+    zs = (
+        500.0
+        + 200.0 * np.sin(xs / side * 4.0 * np.pi) * np.cos(ys / side * 2.0 * np.pi)
+        + rng.normal(0.0, 1.0, xs.shape)
+    )
+    patches = (xs // (pixel_size * 50)) * 7 + ys // (pixel_size * 50)
+    lus = np.array(landuses[1:-2])[patches.astype(int) % (len(landuses) - 3)]
+    fire = (np.abs(xs) < side / 20.0) & (np.abs(ys) < side / 20.0)
+    lus[fire] = landuses[-1]  # eg. Burned
+    return np.stack((xs, ys, zs, lus), axis=-1).reshape(-1, 4)
+
+
+# Measures
+
+
+class Recorder:
+    """Record elapsed time and allocated memory peak of nested steps."""
+
+    def __init__(self) -> None:
+        self.steps = dict()
+        self._peaks = list()  # max absolute peak of the nested steps
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        gc.collect()
+        start, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        self._peaks.append(start)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            dt = time.perf_counter() - t0
+            _, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, self._peaks.pop())
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], peak)
+            step = self.steps.setdefault(name, {"time_s": dt, "peak_mb": 0.0})
+            step["time_s"] = min(step["time_s"], dt)
+            step["peak_mb"] = max(step["peak_mb"], (peak - start) / 1e6)
+
+
+@contextlib.contextmanager
+def measured_methods(recorder, methods):
+    """Measure the calls of the (class, method name) pairs, then restore them."""
+    originals = [(c, name, c.__dict__[name]) for c, name in methods]
+
+    def get_wrapped(func, name):
+        def wrapped(self, *args, **kwargs):
+            with recorder.measure(f"{type(self).__name__}.{name}"):
+                return func(self, *args, **kwargs)
+
+        return wrapped
+
+    for c, name, func in originals:
+        setattr(c, name, get_wrapped(func, name))
+    try:
+        yield
+    finally:
+        for c, name, func in originals:
+            setattr(c, name, func)
+
+
+# Core benchmark, QGIS-free
+
+
+def bench_core(recorder, points, path, max_memory=None, tolerance=None):
+    core = importlib.import_module("qgis2fds.core")
+    n = int(np.sqrt(len(points)))
+
+    # Over the memory budget, use float32 z and row chunks, like GEOMTerrain
+    z_dtype, chunk_bytes = np.float64, None
+    max_bytes = max_memory and max_memory * 2**20 or None
+    if max_bytes and core.terrain.get_footprint(len(points)) > max_bytes:
+        z_dtype = np.float32
+        chunk_bytes = max(
+            max_bytes - core.terrain.get_grid_footprint(len(points), 4), 1
+        )
+
+    with recorder.measure("core.get_grid"):
+        # Find the first column end point by point, like GEOMTerrain
+        p0, p1 = tuple(points[0, :2].tolist()), tuple(points[1, :2].tolist())
+        column_len = len(points)
+        for i in range(2, len(points)):
+            if core.terrain.is_column_end(p0, p1, tuple(points[i, :2].tolist())):
+                column_len = i
+                break
+        (x0, y0), (x1, y1) = p0, p1
+        x2, y2 = points[column_len, :2]
+        grid = core.terrain.get_grid(
+            x0=x0,
+            y0=y0,
+            dx=(x2 - x0, y2 - y0),
+            dy=(x1 - x0, y1 - y0),
+            z=points[:, 2].astype(z_dtype),
+            landuse=points[:, 3].astype(np.int16),
+            column_len=column_len,
+        )
+    with recorder.measure("core.inject_ghost_centers"):
+        g = core.terrain.inject_ghost_centers(grid)
+    with recorder.measure("core.write_bingeom"):
+        nrows, ncols = grid.shape
+        surf_keys = get_landuses()
+        chunks = core.terrain.get_row_chunks(nrows, ncols, chunk_bytes)
+        vchunks = core.terrain.get_row_chunks(nrows + 1, ncols + 1, chunk_bytes)
+        core.bingeom.write_bingeom_chunks(
+            filepath=os.path.join(path, f"core_{n}.bingeom"),
+            geom_type=2,
+            n_surf_id=len(surf_keys),
+            n_verts=core.terrain.get_nverts(g),
+            n_faces=core.terrain.get_nfaces(g),
+            verts_chunks=(core.terrain.get_verts(g, i0, i1) for i0, i1 in vchunks),
+            faces_chunks=(
+                core.terrain.get_faces(nrows, ncols, i0, i1) for i0, i1 in chunks
+            ),
+            surfs_chunks=(
+                core.terrain.get_surf_indexes(
+                    core.terrain.get_face_landuses(g, i0, i1), surf_keys
+                )[0]
+                for i0, i1 in chunks
+            ),
+        )
+    with recorder.measure("core.check_bingeom"):  # round trip
+        stats = core.bingeom.check_bingeom(
+            core.bingeom.read_bingeom(os.path.join(path, f"core_{n}.bingeom"))
+        )
+        assert stats["n_faces"] == core.terrain.get_nfaces(g)
+    if tolerance is not None:
+        with recorder.measure("core.get_simplified"):
+            _, faces, _ = core.terrain.get_simplified(g, tolerance=tolerance)
+        recorder.steps["core.get_simplified"]["nfaces"] = len(faces)
+    with recorder.measure("core.get_obsts"):
+        core.terrain.get_obsts(g, min_z=float(g.z.min()))
+    with recorder.measure("core.domain"):
+        half = n * pixel_size / 2.0 - 1.0
+        dom_xb = (-half, half, -half, half, float(g.z.min()), float(g.z.max()))
+        meshes, _, j_unsnapped, _ = core.domain.get_uniform_meshes(
+            dom_xb=dom_xb, cell_size=cell_size, nmesh=nmesh, fft_snap=True
+        )
+        meshes = core.domain.fit_meshes_to_terrain(
+            meshes=meshes, grid=g, min_z=dom_xb[4], max_z=dom_xb[5]
+        )
+        core.domain.snap_meshes_to_fft(meshes=meshes, j_unsnapped=j_unsnapped)
+
+
+# Plugin benchmark, with QGIS
+
+
+def init_qgis():
+    """Init QGIS without the GUI, if available."""
+    try:
+        from qgis.core import QgsApplication
+    except ImportError:
+        return None
+    app = QgsApplication([], False)
+    app.initQgis()
+    import_plugin()
+    return app
+
+
+def get_sampling_layer(points):
+    """Get a memory sampling layer of the points, like algos.get_sampling_point_grid_layer."""
+    from qgis.core import QgsVectorLayer, QgsFeature, QgsGeometry, QgsPoint, QgsField
+    from qgis.PyQt.QtCore import QVariant
+
+    layer = QgsVectorLayer("PointZ?crs=EPSG:32632", "sampling_layer", "memory")
+    provider = layer.dataProvider()
+    provider.addAttributes(
+        (QgsField("landuse1", QVariant.Int), QgsField("bc", QVariant.Int))
+    )
+    layer.updateFields()
+    features = list()
+    for x, y, z, lu in points:
+        f = QgsFeature(layer.fields())
+        f.setGeometry(QgsGeometry(QgsPoint(x, y, z)))
+        f.setAttributes([int(lu), None])
+        features.append(f)
+    provider.addFeatures(features)
+    return layer
+
+
+def bench_qgis(recorder, points, path, max_memory=None, tolerance=None):
+    from qgis.core import (
+        QgsProcessingFeedback,
+        QgsCoordinateReferenceSystem,
+        QgsRectangle,
+        QgsPoint,
+    )
+    from qgis2fds.types import (
+        GEOMTerrain,
+        OBSTTerrain,
+        Domain,
+        FDSCase,
+        LanduseType,
+        Texture,
+        Wind,
+    )
+
+    n = int(np.sqrt(len(points)))
+    feedback = QgsProcessingFeedback()
+    sampling_layer = get_sampling_layer(points)
+    landuse_type = LanduseType(
+        feedback, project_path=_plugin_path, filepath=landuse_type_filepath
+    )
+    utm_crs = QgsCoordinateReferenceSystem("EPSG:32632")
+    utm_origin, wgs84_origin = QgsPoint(0.0, 0.0), QgsPoint(9.0, 45.0)
+    half = n * pixel_size / 2.0
+    utm_extent = QgsRectangle(-half, -half, half, half)
+
+    methods = [
+        (GEOMTerrain, name)
+        for name in (
+            "_init_matrix",
+            "_inject_ghost_centers",
+            "_save_bingeom",
+        )
+    ] + [(OBSTTerrain, "_init_obsts")]
+    with measured_methods(recorder, methods):
+        terrain = GEOMTerrain(
+            feedback=feedback,
+            sampling_layer=sampling_layer,
+            utm_origin=utm_origin,
+            landuse_layer=sampling_layer,
+            landuse_type=landuse_type,
+            fire_layer=None,
+            path=path,
+            name=f"qgis_{n}",
+            max_memory=max_memory,
+            tolerance=tolerance,
+        )
+        OBSTTerrain(
+            feedback=feedback,
+            sampling_layer=sampling_layer,
+            utm_origin=utm_origin,
+            landuse_layer=sampling_layer,
+            landuse_type=landuse_type,
+            fire_layer=None,
+        )
+        with recorder.measure("Domain"):
+            domain = Domain(
+                feedback=feedback,
+                utm_crs=utm_crs,
+                utm_extent=utm_extent,
+                utm_origin=utm_origin,
+                wgs84_origin=wgs84_origin,
+                min_z=terrain.min_z,
+                max_z=terrain.max_z,
+                cell_size=cell_size,
+                nmesh=nmesh,
+                terrain_following=True,
+                grid=terrain.grid,
+                fft_snap=True,
+            )
+        texture = Texture(  # no texture layer and no iface, no render
+            feedback=feedback,
+            path=path,
+            name=f"qgis_{n}",
+            image_type="png",
+            pixel_size=pixel_size,
+            tex_layer=None,
+            utm_extent=utm_extent,
+            utm_crs=utm_crs,
+        )
+        fds_case = FDSCase(
+            feedback=feedback,
+            path=path,
+            name=f"qgis_{n}",
+            utm_crs=utm_crs,
+            wgs84_origin=wgs84_origin,
+            pixel_size=pixel_size,
+            dem_layer=sampling_layer,
+            domain=domain,
+            terrain=terrain,
+            texture=texture,
+            wind=Wind(feedback, project_path=_plugin_path, filepath=""),
+        )
+        with recorder.measure("FDSCase.get_fds"):  # also saves the bingeom
+            fds_case.get_fds()
+
+
+# Run
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ("git", "rev-parse", "--short", "HEAD"),
+            cwd=_plugin_path,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark qgis2fds terrain, OBST, bingeom and domain code."
+    )
+    parser.add_argument(
+        "-s",
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=(100, 250, 500, 1000, 2000, 4000),
+        help="synthetic grid points per side",
+    )
+    parser.add_argument("-r", "--repeat", type=int, default=1, help="repetitions")
+    parser.add_argument(
+        "--max-qgis-size",
+        type=int,
+        default=1000,
+        help="max grid points per side for the QGIS benchmark",
+    )
+    parser.add_argument(
+        "-m",
+        "--max-memory",
+        type=int,
+        default=None,
+        help="terrain peak memory budget in MB",
+    )
+    parser.add_argument(
+        "-t",
+        "--tolerance",
+        type=float,
+        default=None,
+        help="GEOM terrain simplification vertical tolerance in meters",
+    )
+    parser.add_argument("--no-qgis", action="store_true", help="skip the QGIS benchmark")
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=f"bench_terrain_{time.strftime('%Y%m%d_%H%M%S')}.json",
+        help="results *.json filepath",
+    )
+    args = parser.parse_args(argv)
+
+    import_plugin()
+    app = not args.no_qgis and init_qgis() or None
+    if not args.no_qgis and not app:
+        print("QGIS not available, QGIS benchmark skipped.", flush=True)
+
+    results = {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": get_commit(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "qgis": None,
+        "max_memory": args.max_memory,
+        "tolerance": args.tolerance,
+        "runs": list(),
+    }
+    if app:
+        from qgis.core import Qgis
+
+        results["qgis"] = Qgis.QGIS_VERSION
+
+    tracemalloc.start()
+    with tempfile.TemporaryDirectory() as path:
+        for n in args.sizes:
+            points = get_synthetic_points(n)
+            benches = [("core", bench_core)]
+            if app and n <= args.max_qgis_size:
+                benches.append(("qgis", bench_qgis))
+            for kind, bench in benches:
+                recorder = Recorder()
+                for _ in range(args.repeat):
+                    bench(
+                        recorder,
+                        points,
+                        path,
+                        max_memory=args.max_memory,
+                        tolerance=args.tolerance,
+                    )
+                results["runs"].append(
+                    {"kind": kind, "size": n, "npoints": n * n, "steps": recorder.steps}
+                )
+                for name, step in recorder.steps.items():
+                    print(
+                        f"{n:5d}² {name:40s} {step['time_s']:9.3f} s {step['peak_mb']:9.1f} MB",
+                        flush=True,
+                    )
+    tracemalloc.stop()
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved: <{args.output}>")
+    if app:
+        app.exitQgis()
+
+
+if __name__ == "__main__":
+    main()
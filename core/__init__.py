@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+
+"""qgis2fds core
+
+Terrain, bingeom, MESH, and wind RAMP math on plain NumPy arrays and tuples,
+without QGIS, so that it can be profiled, benchmarked, and run
+in worker processes. Only relative imports are used here.
+Errors are raised as ValueError and OSError,
+the QGIS adapters in types translate them.
+"""
+
+__author__ = "Emanuele Gissi"
+__date__ = "2020-05-04"
+__copyright__ = "(C) 2020 by Emanuele Gissi"
+__revision__ = "$Format:%H$"  # replaced with git SHA1
+
+from . import bingeom, domain, matrix, terrain, wind
@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+
+"""qgis2fds core"""
+
+__author__ = "Emanuele Gissi"
+__date__ = "2020-05-04"
+__copyright__ = "(C) 2020 by Emanuele Gissi"
+__revision__ = "$Format:%H$"  # replaced with git SHA1
+
+import os, struct, hashlib
+import numpy as np
+
+# FDS bingeom file format:
+#      WRITE(731) INTEGER_ONE
+#      WRITE(731) N_VERTS,N_FACES,N_SURF_ID,N_VOLUS
+#      WRITE(731) VERTS(1:3*N_VERTS)
+#      WRITE(731) FACES(1:3*N_FACES)
+#      WRITE(731) SURFS(1:N_FACES)
+#      WRITE(731) VOLUS(1:4*N_VOLUS)
+
+
+class _HashedFile:
+    """Binary file that also hashes the written bytes."""
+
+    def __init__(self, f, digest) -> None:
+        self.f, self.digest = f, digest
+
+    def write(self, data):
+        self.digest.update(data)
+        return self.f.write(data)
+
+
+def write_record(f, data):
+    """!
+    Write a record to a binary unformatted sequential Fortran90 file.
+    @param f: open Python file object in 'wb' mode.
+    @param data: np.array() of data.
+    """
+    write_record_chunks(f, (data,), len(data), data.dtype)
+
+
+def write_record_chunks(f, chunks, length, dtype):
+    """!
+    Write a record from chunks of data, never held in memory all together.
+    @param f: open Python file object in 'wb' mode.
+    @param chunks: iterable of np.array() of data.
+    @param length: total length of data.
+    @param dtype: data type.
+    """
+    dtype = np.dtype(dtype)
+    # Calc start and end record tag
+    tag = struct.pack("i", length * dtype.itemsize)
+    # Write start tag, data, and end tag
+    f.write(tag)
+    n = 0
+    for chunk in chunks:
+        chunk = np.ascontiguousarray(chunk, dtype=dtype).ravel()
+        f.write(memoryview(chunk).cast("B"))
+        n += len(chunk)
+    if n != length:
+        raise ValueError(f"Record length <{n}> differs from its tag <{length}>.")
+    f.write(tag)
+
+
+def write_bingeom(
+    filepath,
+    geom_type,
+    n_surf_id,
+    fds_verts,
+    fds_faces,
+    fds_surfs,
+    fds_volus,
+    hashed=False,
+):
+    """!
+    Write FDS bingeom file.
+    @param filepath: destination filepath
+    @param geom_type: GEOM type (eg. 1 is manifold, 2 is terrain)
+    @param n_surf_id: number of referred boundary conditions
+    @param fds_verts: vertices coordinates in FDS flat format, eg. (x0, y0, z0, x1, y1, ...)
+    @param fds_faces: faces connectivity in FDS flat format, eg. (i0, j0, k0, i1, ...)
+    @param fds_surfs: boundary condition indexes, eg. (i0, i1, ...)
+    @param fds_volus: volumes connectivity in FDS flat format, eg. (i0, j0, k0, w0, i1, ...)
+    @param hashed: if True, return the sha256 hex digest of the file
+    @return the hex digest, or None.
+    """
+    fds_verts = np.asarray(fds_verts, dtype="float64").ravel()
+    fds_faces = np.asarray(fds_faces, dtype="int32").ravel()
+    fds_surfs = np.asarray(fds_surfs, dtype="int32").ravel()
+    fds_volus = np.asarray(fds_volus, dtype="int32").ravel()
+    return write_bingeom_chunks(
+        filepath=filepath,
+        geom_type=geom_type,
+        n_surf_id=n_surf_id,
+        n_verts=len(fds_verts) // 3,
+        n_faces=len(fds_faces) // 3,
+        verts_chunks=(fds_verts,),
+        faces_chunks=(fds_faces,),
+        surfs_chunks=(fds_surfs,),
+        n_volus=len(fds_volus) // 4,
+        volus_chunks=(fds_volus,),
+        hashed=hashed,
+    )
+
+
+def write_bingeom_chunks(
+    filepath,
+    geom_type,
+    n_surf_id,
+    n_verts,
+    n_faces,
+    verts_chunks,
+    faces_chunks,
+    surfs_chunks,
+    n_volus=0,
+    volus_chunks=(),
+    hashed=False,
+):
+    """!
+    Write FDS bingeom file from chunks of data, eg. generators of rows.
+    @param filepath: destination filepath
+    @param geom_type: GEOM type (eg. 1 is manifold, 2 is terrain)
+    @param n_surf_id: number of referred boundary conditions
+    @param n_verts: number of vertices
+    @param n_faces: number of faces
+    @param verts_chunks: iterable of vertices coordinates arrays
+    @param faces_chunks: iterable of faces connectivity arrays
+    @param surfs_chunks: iterable of boundary condition indexes arrays
+    @param n_volus: number of volumes
+    @param volus_chunks: iterable of volumes connectivity arrays
+    @param hashed: if True, return the sha256 hex digest of the file
+    @return the hex digest, or None.
+    """
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    with open(filepath, "wb") as f:
+        digest = hashed and hashlib.sha256() or None
+        if digest:
+            f = _HashedFile(f, digest)
+        write_record(f, np.array((geom_type,), dtype="int32"))  # was 1 only
+        write_record(f, np.array((n_verts, n_faces, n_surf_id, n_volus), dtype="int32"))
+        write_record_chunks(f, verts_chunks, n_verts * 3, "float64")
+        write_record_chunks(f, faces_chunks, n_faces * 3, "int32")
+        write_record_chunks(f, surfs_chunks, n_faces, "int32")
+        write_record_chunks(f, volus_chunks, n_volus * 4, "int32")
+    return digest and digest.hexdigest()
+
+
+# FDS bingeom file reader, memory-mapped.
+# Verts, faces, surfs, and volus are zero-copy views of the file,
+# so large files are inspected without loading them.
+
+
+class BinGeom:
+    """!
+    FDS bingeom file content, as read-only views of the memory-mapped file.
+    """
+
+    def __init__(self, filepath, geom_type, verts, faces, surfs, volus) -> None:
+        """!
+        @param filepath: bingeom filepath
+        @param geom_type: GEOM type (eg. 1 is manifold, 2 is terrain)
+        @param verts: np.array of shape (n_verts, 3) of vertices coordinates
+        @param faces: np.array of shape (n_faces, 3) of vert indexes, starting from 1
+        @param surfs: np.array of shape (n_faces,) of boundary condition indexes, starting from 1
+        @param volus: np.array of shape (n_volus, 4) of vert indexes, starting from 1
+        """
+        self.filepath = filepath
+        self.geom_type = geom_type
+        self.verts, self.faces, self.surfs, self.volus = verts, faces, surfs, volus
+        self.n_surf_id = 0
+
+    @property
+    def n_verts(self) -> int:
+        return len(self.verts)
+
+    @property
+    def n_faces(self) -> int:
+        return len(self.faces)
+
+    @property
+    def n_volus(self) -> int:
+        return len(self.volus)
+
+
+def read_records(filepath):
+    """!
+    Read the records of a binary unformatted sequential Fortran90 file.
+    @param filepath: the file
+    @return list of np.array() of bytes, zero-copy views of the memory-mapped file.
+    """
+    if not os.path.getsize(filepath):
+        raise ValueError(f"Empty file <{filepath}>.")
+    data = np.memmap(filepath, dtype=np.uint8, mode="r")
+    records, start, size = list(), 0, len(data)
+    while start < size:
+        if start + 4 > size:
+            raise ValueError(f"Truncated record tag at byte <{start}>.")
+        (length,) = struct.unpack("i", data[start : start + 4])
+        end = start + 4 + length
+        if length < 0 or end + 4 > size:
+            raise ValueError(f"Truncated record at byte <{start}>, length <{length}>.")
+        (end_length,) = struct.unpack("i", data[end : end + 4])
+        if end_length != length:
+            raise ValueError(
+                f"Record tags differ at byte <{start}>: <{length}> and <{end_length}>."
+            )
+        records.append(data[start + 4 : end])
+        start = end + 4
+    return records
+
+
+def _get_view(record, dtype, ncols, name):
+    """Get the record as an array view of dtype with ncols columns."""
+    dtype = np.dtype(dtype)
+    if len(record) % (dtype.itemsize * ncols):
+        raise ValueError(
+            f"Record <{name}> length <{len(record)}> is not a multiple of <{dtype.itemsize * ncols}>."
+        )
+    shape = (len(record) // (dtype.itemsize * ncols), ncols)
+    view = np.ndarray(shape=shape, dtype=dtype, buffer=record)  # also unaligned
+    if ncols == 1:
+        return view.ravel()
+    return view
+
+
+def read_bingeom(filepath):
+    """!
+    Read FDS bingeom file, without loading it.
+    @param filepath: the file
+    @return the BinGeom.
+    """
+    records = read_records(filepath)
+    if len(records) != 6:
+        raise ValueError(f"Bingeom file has <{len(records)}> records, not <6>.")
+    (geom_type,) = _get_view(records[0], "int32", 1, "geom_type")
+    counts = _get_view(records[1], "int32", 1, "counts")
+    if len(counts) != 4:
+        raise ValueError(
+            f"Bingeom file counts record has <{len(counts)}> values, not <4>."
+        )
+    n_verts, n_faces, n_surf_id, n_volus = (int(c) for c in counts)
+    bingeom = BinGeom(
+        filepath=filepath,
+        geom_type=int(geom_type),
+        verts=_get_view(records[2], "float64", 3, "verts"),
+        faces=_get_view(records[3], "int32", 3, "faces"),
+        surfs=_get_view(records[4], "int32", 1, "surfs"),
+        volus=_get_view(records[5], "int32", 4, "volus"),
+    )
+    bingeom.n_surf_id = n_surf_id
+    for name, n, n_read in (
+        ("verts", n_verts, bingeom.n_verts),
+        ("faces", n_faces, bingeom.n_faces),
+        ("surfs", n_faces, len(bingeom.surfs)),
+        ("volus", n_volus, bingeom.n_volus),
+    ):
+        if n != n_read:
+            raise ValueError(f"Bingeom file has <{n_read}> {name}, expected <{n}>.")
+    return bingeom
+
+
+def check_bingeom(bingeom, chunk_size=2**20):
+    """!
+    Check the consistency of a BinGeom, by chunks of faces.
+    Face indexes shall refer to existing verts, and surf indexes to existing SURFs.
+    Terrain faces (geom_type 2) shall point upwards, as written by qgis2fds.
+    @param bingeom: the BinGeom
+    @param chunk_size: number of faces in each chunk
+    @return dict of the file stats: counts, surf index histogram, z range, and faces by orientation.
+    """
+    verts, faces, surfs = bingeom.verts, bingeom.faces, bingeom.surfs
+    stats = {
+        "geom_type": bingeom.geom_type,
+        "n_verts": bingeom.n_verts,
+        "n_faces": bingeom.n_faces,
+        "n_surf_id": bingeom.n_surf_id,
+        "n_volus": bingeom.n_volus,
+        "z_range": None,
+        "surfs": dict(),
+        "faces_up": 0,
+        "faces_down": 0,
+        "faces_degenerate": 0,
+    }
+    if bingeom.n_verts:
+        z = verts[:, 2]
+        stats["z_range"] = (float(z.min()), float(z.max()))
+    hist = np.zeros(bingeom.n_surf_id + 2, dtype=np.int64)  # + 0 and overflow
+    for i0 in range(0, bingeom.n_faces, chunk_size):
+        f = faces[i0 : i0 + chunk_size]
+        if f.min() < 1 or f.max() > bingeom.n_verts:
+            raise ValueError(
+                f"Face vert indexes out of <1..{bingeom.n_verts}> in faces <{i0}..{i0 + len(f)}>."
+            )
+        s = surfs[i0 : i0 + chunk_size]
+        hist += np.bincount(np.clip(s, 0, bingeom.n_surf_id + 1), minlength=len(hist))
+        # Face normal z, positive upwards
+        a, b, c = verts[f[:, 0] - 1], verts[f[:, 1] - 1], verts[f[:, 2] - 1]
+        nz = (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (
+            c[:, 0] - a[:, 0]
+        )
+        stats["faces_up"] += int(np.count_nonzero(nz > 0.0))
+        stats["faces_down"] += int(np.count_nonzero(nz < 0.0))
+        stats["faces_degenerate"] += int(np.count_nonzero(nz == 0.0))
+    stats["surfs"] = {i: int(n) for i, n in enumerate(hist) if n}
+    if hist[0] or hist[-1]:
+        raise ValueError(
+            f"Face surf indexes out of <1..{bingeom.n_surf_id}>: {hist[0] + hist[-1]} faces."
+        )
+    if bingeom.geom_type == 2 and (stats["faces_down"] or stats["faces_degenerate"]):
+        raise ValueError(
+            f"Terrain faces not pointing upwards: {stats['faces_down']} down, {stats['faces_degenerate']} degenerate."
+        )
+    if bingeom.n_volus and (
+        bingeom.volus.min() < 1 or bingeom.volus.max() > bingeom.n_verts
+    ):
+        raise ValueError(f"Volu vert indexes out of <1..{bingeom.n_verts}>.")
+    return stats
+
+
+# Inspect bingeom files from the command line:
+#   python3 core/bingeom.py terrain.bingeom [...]
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Check FDS bingeom files.")
+    parser.add_argument("filepaths", nargs="+", help="*.bingeom filepaths")
+    args = parser.parse_args(argv)
+
+    nerrors = 0
+    for filepath in args.filepaths:
+        try:
+            stats = check_bingeom(read_bingeom(filepath))
+        except (OSError, ValueError) as err:
+            print(f"{filepath}: ERROR {err}")
+            nerrors += 1
+            continue
+        print(f"{filepath}: OK")
+        for key, value in stats.items():
+            print(f"  {key}: {value}")
+    return nerrors and 1 or 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,400 @@
+# -*- coding: utf-8 -*-
+
+"""qgis2fds core"""
+
+__author__ = "Emanuele Gissi"
+__date__ = "2020-05-04"
+__copyright__ = "(C) 2020 by Emanuele Gissi"
+__revision__ = "$Format:%H$"  # replaced with git SHA1
+
+from math import floor, ceil
+import numpy as np
+
+# MESHes are lists of (ijk, xb), xb relative to the domain origin
+
+
+def get_ncell(meshes):
+    """!
+    Get the total number of cells.
+    @param meshes: list of (ijk, xb)
+    @return the number of cells.
+    """
+    return sum(ijk[0] * ijk[1] * ijk[2] for ijk, _ in meshes)
+
+
+# MESH decomposition
+
+
+def get_decomposition(ncell_x, ncell_y, ncell_z, nmesh):
+    """!
+    Get the MESH decomposition for nmesh MPI ranks.
+    Search all the decompositions with exactly nmesh MESHes and
+    equal integer cell numbers, and choose the one with the least halo surface.
+    @param ncell_x: domain cell number along x
+    @param ncell_y: domain cell number along y
+    @param ncell_z: domain cell number along z
+    @param nmesh: number of MPI ranks
+    @return number of MESHes along x and y, and the halo surface in cell faces.
+    """
+    best, best_key = None, None
+    for nmesh_x in range(1, nmesh + 1):
+        if nmesh % nmesh_x:
+            continue
+        nmesh_y = nmesh // nmesh_x
+        i, j = ncell_x // nmesh_x, ncell_y // nmesh_y
+        if i < 1 or j < 1:
+            continue
+        # Halo surface as the number of cell faces shared between MESHes
+        halo = ((nmesh_x - 1) * j * nmesh_y + (nmesh_y - 1) * i * nmesh_x) * ncell_z
+        lost = ncell_x * ncell_y - i * j * nmesh  # cells lost to truncation
+        key = (halo, lost)
+        if best_key is None or key < best_key:
+            best, best_key = (nmesh_x, nmesh_y), key
+    if not best:
+        raise ValueError(
+            f"Cannot decompose the domain of {ncell_x:d} · {ncell_y:d} cells in {nmesh:d} MESHes."
+        )
+    return best[0], best[1], best_key[0]
+
+
+# FFT friendly MESH sizes
+
+
+def get_prime_factors(n):
+    """Get the prime factors of n."""
+    factors, p = list(), 2
+    while p * p <= n:
+        while n % p == 0:
+            factors.append(p)
+            n //= p
+        p += 1
+    if n > 1:
+        factors.append(n)
+    return factors
+
+
+def get_fft_cost(n):
+    """Get the relative FFT cost per cell for n cells."""
+    return sum(get_prime_factors(n)) or 1
+
+
+def get_fft_size(n, larger=False, tolerance=0.1):
+    """!
+    Get the FFT friendly size, a 2^a·3^b·5^c number, nearest to n.
+    @param n: number of cells
+    @param larger: if True, search larger sizes, else smaller
+    @param tolerance: max relative change of n
+    @return the FFT friendly size, or n if none within tolerance.
+    """
+    step = larger and 1 or -1
+    limit = larger and int(n * (1.0 + tolerance)) or ceil(n * (1.0 - tolerance))
+    m = n
+    while m >= 1 and (m <= limit if larger else m >= limit):
+        if max(get_prime_factors(m) or (1,)) <= 5:
+            return m
+        m += step
+    return n
+
+
+# Uniform MESH layout, as a MULT of equal MESHes
+
+
+def get_uniform_meshes(dom_xb, cell_size, nmesh, fft_snap=False, fft_tolerance=0.05):
+    """!
+    Get the uniform MESH layout, as a MULT of equal MESHes with cubic cells.
+    @param dom_xb: domain xb
+    @param cell_size: cell size
+    @param nmesh: number of MPI ranks
+    @param fft_snap: snap MESH J to an FFT friendly number, larger if it fits in the domain
+    @param fft_tolerance: max relative change of MESH J
+    @return list of (ijk, xb), MULT as (nmesh_x, nmesh_y, dx, dy), J before the snap, and the halo surface.
+    """
+    # Calc domain cell numbers
+    ncell_x = int((dom_xb[1] - dom_xb[0]) / cell_size)
+    ncell_y = int((dom_xb[3] - dom_xb[2]) / cell_size)
+    ncell_z = ceil((dom_xb[5] - dom_xb[4]) / cell_size)
+
+    # Calc number of MESH along x and y,
+    # with equal integer cell numbers for each MESH
+    nmesh_x, nmesh_y, halo = get_decomposition(
+        ncell_x=ncell_x, ncell_y=ncell_y, ncell_z=ncell_z, nmesh=nmesh
+    )
+
+    # Calc MESH IJK, snap J to an FFT friendly number,
+    # larger when it fits in the domain, else smaller. K is snapped later
+    m_ijk = (ncell_x // nmesh_x, ncell_y // nmesh_y, ncell_z)
+    j_unsnapped = None
+    if fft_snap:
+        j_unsnapped = m_ijk[1]
+        j = get_fft_size(j_unsnapped, larger=True, tolerance=fft_tolerance)
+        if j * nmesh_y > ncell_y:
+            j = get_fft_size(j_unsnapped, tolerance=fft_tolerance)
+        m_ijk = (m_ijk[0], j, ncell_z)
+
+    # Calc MESH XB, cells are cubes of cell_size
+    m_xb = (
+        dom_xb[0],
+        dom_xb[0] + m_ijk[0] * cell_size,
+        dom_xb[2],
+        dom_xb[2] + m_ijk[1] * cell_size,
+        dom_xb[4],
+        dom_xb[4] + m_ijk[2] * cell_size,
+    )
+
+    # Calc MESH MULT DX DY
+    mult_dx, mult_dy = m_xb[1] - m_xb[0], m_xb[3] - m_xb[2]
+
+    meshes = list(
+        (
+            m_ijk,
+            (
+                m_xb[0] + mult_dx * i,
+                m_xb[1] + mult_dx * i,
+                m_xb[2] + mult_dy * j,
+                m_xb[3] + mult_dy * j,
+                m_xb[4],
+                m_xb[5],
+            ),
+        )
+        for i in range(nmesh_x)
+        for j in range(nmesh_y)
+    )
+    return meshes, (nmesh_x, nmesh_y, mult_dx, mult_dy), j_unsnapped, halo
+
+
+# Fire focused multi-resolution MESH layout.
+# The fine region around the fire and its downwind corridor
+# is covered by fine MESHes, the rest of the domain by coarse MESHes,
+# with double cell size, split in up to 4 strips.
+# All boundaries are aligned to the coarse cells, for the FDS 2:1 rule.
+# All MESHes advance with the same time step, so the MPI load is
+# their cell number: the nmesh MESHes are shared between the fine region
+# and the coarse strips, so that the largest MESH is the smallest.
+
+#   +-----------------+
+#   |  c    |    c    |
+#   +-----+---+---+---+
+#   |  c  | f | f | c |
+#   |     +---+---+   |
+#   |     | f | f |   |
+#   +-----+---+---+---+
+#   |   c    |   c    |
+#   +-----------------+
+
+
+def get_downwind_xb(xb, directions, length):
+    """!
+    Extend the xb along the downwind directions.
+    @param xb: xb, along x and y
+    @param directions: wind directions in degrees, where the wind comes from
+    @param length: downwind corridor length
+    @return the extended xb, along x and y.
+    """
+    a = np.radians(np.asarray(directions, dtype=np.float64))
+    if not length or not a.size:
+        return tuple(xb[:4])
+    dx, dy = -np.sin(a) * length, -np.cos(a) * length  # downwind
+    return (
+        xb[0] + min(float(dx.min()), 0.0),
+        xb[1] + max(float(dx.max()), 0.0),
+        xb[2] + min(float(dy.min()), 0.0),
+        xb[3] + max(float(dy.max()), 0.0),
+    )
+
+
+def _get_breaks(n0, n1, n):
+    """Get n + 1 near equal integer breaks from n0 to n1."""
+    return [n0 + (n1 - n0) * k // n for k in range(n + 1)]
+
+
+def _split_region(ia, ib, ja, jb, ncell_z, nmesh):
+    """Split a region of cells in nmesh MESHes with the least halo, as (ia, ib, ja, jb)."""
+    nmesh_x, nmesh_y, _ = get_decomposition(
+        ncell_x=ib - ia, ncell_y=jb - ja, ncell_z=ncell_z, nmesh=nmesh
+    )
+    # At least one cell for each MESH, as checked by get_decomposition
+    ibs, jbs = _get_breaks(ia, ib, nmesh_x), _get_breaks(ja, jb, nmesh_y)
+    return [
+        (ibs[n], ibs[n + 1], jbs[m], jbs[m + 1])
+        for n, m in np.ndindex(nmesh_x, nmesh_y)
+    ]
+
+
+def get_multires_meshes(dom_xb, fine_xb, cell_size, nmesh):
+    """!
+    Get the fire focused multi-resolution MESH layout.
+    @param dom_xb: domain xb
+    @param fine_xb: fine region xb, along x and y
+    @param cell_size: fine cell size
+    @param nmesh: number of MPI ranks, as the total number of MESHes
+    @return list of (ijk, xb), the number of fine MESHes, and the cells of the uniform fine layout.
+    """
+    ccs = cell_size * 2.0  # coarse cell size
+
+    # Calc domain coarse cell numbers, even fine cells along z
+    ncell_x = int((dom_xb[1] - dom_xb[0]) / ccs)
+    ncell_y = int((dom_xb[3] - dom_xb[2]) / ccs)
+    ncell_z = ceil((dom_xb[5] - dom_xb[4]) / ccs)
+
+    # Snap the fine region to the coarse cells, inside the domain
+    i0 = min(max(floor((fine_xb[0] - dom_xb[0]) / ccs), 0), ncell_x)
+    i1 = min(max(ceil((fine_xb[1] - dom_xb[0]) / ccs), 0), ncell_x)
+    j0 = min(max(floor((fine_xb[2] - dom_xb[2]) / ccs), 0), ncell_y)
+    j1 = min(max(ceil((fine_xb[3] - dom_xb[2]) / ccs), 0), ncell_y)
+    if i1 <= i0 or j1 <= j0:
+        raise ValueError("The fire refinement region is outside the domain.")
+
+    # Coarse strips around the fine region, as (ia, ib, ja, jb) in coarse cells
+    strips = [
+        s
+        for s in (
+            (0, ncell_x, 0, j0),
+            (0, ncell_x, j1, ncell_y),
+            (0, i0, j0, j1),
+            (i1, ncell_x, j0, j1),
+        )
+        if s[1] > s[0] and s[3] > s[2]
+    ]
+    nstrip = len(strips)
+    if nmesh < nstrip + 1:
+        raise ValueError(
+            f"The multi-resolution MESH layout needs at least {nstrip + 1:d} MESHes (MPI processes), {nmesh:d} requested."
+        )
+    strip_ncells = [(ib - ia) * (jb - ja) * ncell_z for ia, ib, ja, jb in strips]
+
+    def get_ijk_xb(region, r):
+        ia, ib, ja, jb = region
+        return (
+            ((ib - ia) * r, (jb - ja) * r, ncell_z * r),
+            (
+                dom_xb[0] + ia * ccs,
+                dom_xb[0] + ib * ccs,
+                dom_xb[2] + ja * ccs,
+                dom_xb[2] + jb * ccs,
+                dom_xb[4],
+                dom_xb[4] + ncell_z * ccs,
+            ),
+        )
+
+    # Search the number of fine MESHes with the least max MESH cells.
+    # The fine region is decomposed in coarse cells, so that no fine MESH is empty.
+    # The coarse MESHes go one at a time to the strip with the largest ones
+    best, best_key = None, None
+    for nfine in range(1, nmesh - nstrip + 1):
+        ncoarses = [1] * nstrip
+        for _ in range(nmesh - nfine - nstrip):
+            k = max(range(nstrip), key=lambda k: strip_ncells[k] / ncoarses[k])
+            ncoarses[k] += 1
+        try:
+            meshes = [
+                get_ijk_xb(region, 2)
+                for region in _split_region(i0, i1, j0, j1, ncell_z * 2, nfine)
+            ]
+            for strip, ncoarse in zip(strips, ncoarses):
+                meshes.extend(
+                    get_ijk_xb(region, 1)
+                    for region in _split_region(*strip, ncell_z, ncoarse)
+                )
+        except ValueError:
+            continue  # too many MESHes for the region cells
+        key = max(ijk[0] * ijk[1] * ijk[2] for ijk, _ in meshes)
+        if best_key is None or key < best_key:
+            best, best_key = (meshes, nfine), key
+    if not best:
+        raise ValueError(
+            f"Cannot decompose the multi-resolution domain in {nmesh:d} MESHes."
+        )
+    return best[0], best[1], ncell_x * ncell_y * ncell_z * 8
+
+
+# Terrain following MESH columns, each one spanning
+# from its local min z to its local max z + 10 cells,
+# snapped to the vertical grid of the coarsest MESH,
+# so that fine and coarse MESHes stay aligned.
+
+#   +---+           ZMAX
+#   |   o---+
+#   |  /|   |---+
+#   | / |    \  |
+#   +---+---+-\-+  ZMIN
+#   +---+    \
+#             +---+
+
+
+def get_dz(meshes):
+    """Get the vertical grid step of the layout, the largest MESH vertical cell size."""
+    return max((xb[5] - xb[4]) / ijk[2] for ijk, xb in meshes)
+
+
+def fit_meshes_to_terrain(meshes, grid, min_z, max_z):
+    """!
+    Fit each MESH column to the terrain below it.
+    @param meshes: list of (ijk, xb)
+    @param grid: terrain Grid by row, relative to origin, see core.terrain
+    @param min_z: terrain min z, when no terrain is below
+    @param max_z: terrain max z, when no terrain is below
+    @return list of (ijk, xb).
+    """
+    xs, ys, zs = grid.xs, grid.ys, grid.z
+    dz = get_dz(meshes)
+    fitted = list()
+    for ijk, xb in meshes:
+        cs = (xb[5] - xb[4]) / ijk[2]  # MESH vertical cell size
+        r = round(dz / cs)  # MESH cells for each vertical grid step
+        # Use the terrain below the MESH, one cell larger
+        col_mask = (xs >= xb[0] - cs) & (xs <= xb[1] + cs)
+        row_mask = (ys >= xb[2] - cs) & (ys <= xb[3] + cs)
+        local_zs = zs[np.ix_(row_mask, col_mask)]
+        if not local_zs.size:  # no terrain below, keep uniform
+            local_min_z, local_max_z = min_z, max_z
+        else:
+            local_min_z, local_max_z = local_zs.min(), local_zs.max()
+        k0 = floor((local_min_z - xb[4]) / dz)
+        k1 = ceil((local_max_z + 10 * cs - xb[4]) / dz)  # 10 cells over max z
+        k0, k1 = max(k0, 0), min(k1, ijk[2] // r)
+        fitted.append(
+            (
+                (ijk[0], ijk[1], (k1 - k0) * r),
+                (xb[0], xb[1], xb[2], xb[3], xb[4] + k0 * dz, xb[4] + k1 * dz),
+            )
+        )
+    return fitted
+
+
+# FDS pressure solver is based on FFTs along the MESH J and K,
+# that are faster when the numbers factor into 2, 3, and 5.
+# The FFT cost for n cells is estimated as n times the sum of its prime factors,
+# so the cost per cell of a MESH is the sum for J and for K.
+
+
+def get_mesh_fft_cost(j, k):
+    """Get the relative pressure solver cost per cell of a MESH."""
+    return get_fft_cost(j) + get_fft_cost(k)
+
+
+def snap_meshes_to_fft(meshes, j_unsnapped=None, tolerance=0.05):
+    """!
+    Snap the MESH K to the next FFT friendly number, on the vertical grid of the layout.
+    Each MESH height, in vertical grid steps, is snapped once for the whole layout,
+    so that MESHes of equal height, eg. fine and coarse, stay aligned.
+    @param meshes: list of (ijk, xb)
+    @param j_unsnapped: MESH J before its snap, if any
+    @param tolerance: max relative change of MESH K
+    @return list of (ijk, xb), and the expected pressure solver speedup per cell.
+    """
+    dz = get_dz(meshes)
+    snapped_steps = dict()  # MESH height in vertical grid steps, before and after
+    snapped, cost, cost_unsnapped = list(), 0.0, 0.0
+    for ijk, xb in meshes:
+        r = round(dz * ijk[2] / (xb[5] - xb[4]))  # MESH cells for each step
+        n = ijk[2] // r
+        if n not in snapped_steps:
+            snapped_steps[n] = get_fft_size(n, larger=True, tolerance=tolerance)
+        k = snapped_steps[n] * r  # friendly, as r is 1 or 2
+        snapped.append(((ijk[0], ijk[1], k), (*xb[:5], xb[4] + snapped_steps[n] * dz)))
+        # Costs per cell, weighted by the same cells,
+        # so that added or removed cells are not counted as a gain
+        ncell = ijk[0] * ijk[1] * k
+        cost_unsnapped += ncell * get_mesh_fft_cost(j_unsnapped or ijk[1], ijk[2])
+        cost += ncell * get_mesh_fft_cost(ijk[1], k)
+    return snapped, cost_unsnapped / cost
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+"""qgis2fds core"""
+
+__author__ = "Emanuele Gissi"
+__date__ = "2020-05-04"
+__copyright__ = "(C) 2020 by Emanuele Gissi"
+__revision__ = "$Format:%H$"  # replaced with git SHA1
+
+# Terrain matrix files, for downstream post-processing without QGIS.
+#
+# The .npz file is an uncompressed zip of .npy arrays:
+#   z, landuse, bc: arrays of shape (nrows, ncols), by row, without ghost centers
+#   x0, y0, dx, dy: the Grid, x and y relative to origin (see terrain.Grid)
+#   origin: the (x, y) of the origin in UTM
+#   crs: the WKT of the UTM crs
+# The arrays are stored, not deflated, so that read_matrix can memory-map them.
+
+import os, struct, zipfile
+import numpy as np
+
+if __package__:
+    from .terrain import Grid
+else:  # run as a script
+    from terrain import Grid
+
+
+def write_matrix(filepath, grid, bc, origin, crs="") -> None:
+    """!
+    Write the terrain matrix .npz file, atomically.
+    @param filepath: destination filepath
+    @param grid: the Grid, without ghost centers
+    @param bc: np.array of shape (nrows, ncols) of the fire layer bcs, 0 if none
+    @param origin: the (x, y) of the origin in UTM
+    @param crs: the WKT of the UTM crs
+    """
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    tmp_filepath = f"{filepath}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_filepath, "wb") as f:
+            np.savez(
+                f,
+                z=grid.z,
+                landuse=grid.landuse,
+                bc=bc,
+                x0=grid.x0,
+                y0=grid.y0,
+                dx=grid.dx,
+                dy=grid.dy,
+                origin=np.asarray(origin, dtype=np.float64),
+                crs=np.str_(crs),
+            )
+        os.replace(tmp_filepath, filepath)
+    finally:
+        if os.path.exists(tmp_filepath):
+            os.remove(tmp_filepath)
+
+
+def _read_member(f, filepath, info, mmap_mode):
+    """Read or memory-map a stored .npy member of the zip file."""
+    # The local file header is 30 bytes, then filename and extra field
+    f.seek(info.header_offset)
+    header = f.read(30)
+    if header[:4] != b"PK\x03\x04":
+        raise ValueError(f"Bad zip member <{info.filename}>.")
+    n, m = struct.unpack("<HH", header[26:30])
+    f.seek(info.header_offset + 30 + n + m)
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    if not mmap_mode or not shape or dtype.hasobject:  # small or not mappable
+        f.seek(info.header_offset + 30 + n + m)
+        return np.lib.format.read_array(f)
+    return np.memmap(
+        filepath,
+        dtype=dtype,
+        mode=mmap_mode,
+        offset=f.tell(),
+        shape=shape,
+        order=fortran_order and "F" or "C",
+    )
+
+
+def read_matrix(filepath, mmap_mode="r"):
+    """!
+    Read the terrain matrix .npz file, memory-mapping its arrays.
+    @param filepath: the .npz filepath
+    @param mmap_mode: np.memmap mode, or None to load the arrays in memory
+    @return the Grid, bc, origin, and crs.
+    """
+    with open(filepath, "rb") as f, zipfile.ZipFile(f) as zf:
+        arrays = dict()
+        for info in zf.infolist():
+            name = info.filename[:-4]  # remove .npy
+            if info.compress_type == zipfile.ZIP_STORED:
+                arrays[name] = _read_member(f, filepath, info, mmap_mode)
+            else:  # deflated by others, load it
+                with zf.open(info) as fm:
+                    arrays[name] = np.lib.format.read_array(fm)
+    try:
+        grid = Grid(
+            x0=arrays["x0"],
+            y0=arrays["y0"],
+            dx=arrays["dx"],
+            dy=arrays["dy"],
+            z=arrays["z"],
+            landuse=arrays["landuse"],
+        )
+        return grid, arrays["bc"], tuple(arrays["origin"].tolist()), str(arrays["crs"])
+    except KeyError as err:
+        raise ValueError(f"Not a terrain matrix file, missing {err}.")
+
+
+def get_geotransform(grid, origin):
+    """!
+    Get the GDAL geotransform of the grid cells, in UTM.
+    @param grid: the Grid
+    @param origin: the (x, y) of the origin in UTM
+    @return the geotransform tuple.
+    """
+    (dxx, dxy), (dyx, dyy) = grid.dx, grid.dy
+    # From the first center to the corner of its cell
+    x = origin[0] + grid.x0 - (dxx + dyx) / 2.0
+    y = origin[1] + grid.y0 - (dxy + dyy) / 2.0
+    return x, dxx, dyx, y, dxy, dyy
+
+
+def write_geotiff(filepath, grid, bc, origin, crs="") -> None:
+    """!
+    Write the terrain matrix GeoTIFF file, with z, landuse, and bc bands.
+    Needs GDAL.
+    @param filepath: destination filepath
+    @param grid: the Grid, without ghost centers
+    @param bc: np.array of shape (nrows, ncols) of the fire layer bcs, 0 if none
+    @param origin: the (x, y) of the origin in UTM
+    @param crs: the WKT of the UTM crs
+    """
+    from osgeo import gdal
+
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    nrows, ncols = grid.shape
+    gdal_type = grid.z.dtype == np.float32 and gdal.GDT_Float32 or gdal.GDT_Float64
+    ds = gdal.GetDriverByName("GTiff").Create(
+        filepath, ncols, nrows, 3, gdal_type, options=("COMPRESS=DEFLATE", "TILED=YES")
+    )
+    if ds is None:
+        raise OSError(f"GeoTIFF file not writable: <{filepath}>")
+    ds.SetGeoTransform(get_geotransform(grid, origin))
+    if crs:
+        ds.SetProjection(crs)
+    ds.SetMetadata({"ORIGIN_X": str(origin[0]), "ORIGIN_Y": str(origin[1])})
+    for iband, (name, array) in enumerate(
+        (("z", grid.z), ("landuse", grid.landuse), ("bc", bc))
+    ):
+        band = ds.GetRasterBand(iband + 1)
+        band.SetDescription(name)
+        band.WriteArray(np.ascontiguousarray(array))
+    ds.FlushCache()
+    ds = None
+
+
+# Inspect terrain matrix files from the command line:
+#   python3 core/matrix.py terrain.npz [...]
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect terrain matrix files.")
+    parser.add_argument("filepaths", nargs="+", help="*.npz filepaths")
+    args = parser.parse_args(argv)
+
+    nerrors = 0
+    for filepath in args.filepaths:
+        try:
+            grid, bc, origin, crs = read_matrix(filepath)
+        except (OSError, ValueError) as err:
+            print(f"{filepath}: ERROR {err}")
+            nerrors += 1
+            continue
+        print(f"{filepath}: OK")
+        print(f"  shape: {grid.shape}")
+        print(f"  origin: {origin}")
+        print(f"  dx, dy: {grid.dx}, {grid.dy}")
+        print(f"  z_range: ({float(grid.z.min())}, {float(grid.z.max())})")
+        print(f"  landuses: {np.unique(grid.landuse).tolist()}")
+        print(f"  bcs: {np.unique(bc).tolist()}")
+    return nerrors and 1 or 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
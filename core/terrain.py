@@ -0,0 +1,615 @@
+# -*- coding: utf-8 -*-
+
+"""qgis2fds core"""
+
+__author__ = "Emanuele Gissi"
+__date__ = "2020-05-04"
+__copyright__ = "(C) 2020 by Emanuele Gissi"
+__revision__ = "$Format:%H$"  # replaced with git SHA1
+
+import numpy as np
+
+# The sampling points are a flat list of quad faces center points (x, y, z, landuse)
+# ordered by column. The flat list is cut in columns, when three points
+# form an angle < 180°.
+# The grid is a topological 2D representation of them by row (when transposed).
+
+# Same column:  following column:
+#      first ·            first · · current
+#            |                  | ^
+#            |                  | |
+#       prev ·                  | |
+#            |                  |/
+#    current ·             prev ·
+
+# grid:      j
+#      o   o   o   o   o
+#        ·   ·   ·   ·
+#      o   *---*   o   o
+# row    · | · | ·   ·   i
+#      o   *---*   o   o
+#        ·   ·   ·   ·
+#      o   o   o   o   o
+#
+# · center points of quad faces
+# o verts
+
+
+def is_column_end(p0, p1, p2):
+    """!
+    Check if the sampling point p2 starts a new column.
+    @param p0: first point (x, y) of the first column
+    @param p1: second point (x, y) of the first column
+    @param p2: current point (x, y)
+    @return True if p2 is not aligned with the first column.
+    """
+    v0 = (p1[0] - p0[0], p1[1] - p0[1])
+    v1 = (p2[0] - p1[0], p2[1] - p1[1])
+    norms = np.hypot(*v0) * np.hypot(*v1)
+    return bool(norms) and abs(v0[0] * v1[0] + v0[1] * v1[1]) / norms < 0.9
+
+
+class Grid:
+    """!
+    Compact terrain grid of the quad face centers by row.
+    x and y are implicit from the first center and the displacements
+    along the rows and the columns, z and landuse are 2D arrays.
+    """
+
+    def __init__(self, x0, y0, dx, dy, z, landuse) -> None:
+        """!
+        @param x0: x of the first center, relative to origin
+        @param y0: y of the first center, relative to origin
+        @param dx: (x, y) displacement to the next center along the row (j)
+        @param dy: (x, y) displacement to the next center along the column (i)
+        @param z: np.array of shape (nrows, ncols) of absolute z, float32 or float64
+        @param landuse: np.array of shape (nrows, ncols) of landuse, small integers
+        """
+        self.x0, self.y0 = float(x0), float(y0)
+        self.dx, self.dy = tuple(map(float, dx)), tuple(map(float, dy))
+        self.z, self.landuse = z, landuse
+
+    @property
+    def shape(self):
+        return self.z.shape
+
+    @property
+    def nbytes(self) -> int:
+        return self.z.nbytes + self.landuse.nbytes
+
+    @property
+    def xs(self):
+        """The x of the centers along the first row."""
+        return self.x0 + np.arange(self.shape[1]) * self.dx[0]
+
+    @property
+    def ys(self):
+        """The y of the centers along the first column."""
+        return self.y0 + np.arange(self.shape[0]) * self.dy[1]
+
+    def get_xy(self, i, j):
+        """!
+        Get the center coordinates.
+        @param i: row indexes, np.array
+        @param j: col indexes, np.array
+        @return x and y np.arrays, relative to origin.
+        """
+        return (
+            self.x0 + j * self.dx[0] + i * self.dy[0],
+            self.y0 + j * self.dx[1] + i * self.dy[1],
+        )
+
+
+def get_grid(x0, y0, dx, dy, z, landuse, column_len):
+    """!
+    Get the grid by row from the sampling points ordered by column.
+    @param x0: x of the first point, relative to origin
+    @param y0: y of the first point, relative to origin
+    @param dx: (x, y) displacement to the next column
+    @param dy: (x, y) displacement to the next point in the column
+    @param z: np.array of shape (npoints,) of z
+    @param landuse: np.array of shape (npoints,) of landuse
+    @param column_len: the number of points in each column
+    @return the Grid, with z and landuse views.
+    """
+    npoints = len(z)
+    if npoints % column_len:
+        raise ValueError(
+            f"Sampling points <{npoints}> are not in columns of <{column_len}>."
+        )
+    z = z.reshape(-1, column_len).T
+    landuse = landuse.reshape(-1, column_len).T
+    if z.shape[0] < 3 or z.shape[1] < 3:
+        raise ValueError(f"Sampling matrix is too small: {z.shape[0]}x{z.shape[1]}")
+    return Grid(x0=x0, y0=y0, dx=dx, dy=dy, z=z, landuse=landuse)
+
+
+def inject_ghost_centers(grid):
+    """!
+    Inject the ghost centers all around the grid.
+    Ghost centers are displaced by one cell, and copy z and landuse of their neighbours.
+    @param grid: the Grid
+    @return the Grid, two rows and two cols larger.
+    """
+    return Grid(
+        x0=grid.x0 - grid.dx[0] - grid.dy[0],
+        y0=grid.y0 - grid.dx[1] - grid.dy[1],
+        dx=grid.dx,
+        dy=grid.dy,
+        z=np.pad(grid.z, 1, mode="edge"),
+        landuse=np.pad(grid.landuse, 1, mode="edge"),
+    )
+
+
+def update_ghost_landuses(g):
+    """!
+    Copy the landuse of the neighbours to the ghost centers, in place.
+    @param g: the Grid, with ghost centers
+    """
+    lu = g.landuse
+    lu[0, :], lu[-1, :] = lu[1, :], lu[-2, :]
+    lu[:, 0], lu[:, -1] = lu[:, 1], lu[:, -2]
+
+
+# Memory footprint and row chunks
+
+# Bytes of the GEOM arrays for each grid center:
+# verts (3 float64), two faces (3 int64 and 3 int32 each), and their surfs (int64 and int32)
+geom_bytes_per_center = 3 * 8 + 2 * 3 * (8 + 4) + 2 * (8 + 4)
+
+
+def get_footprint(npoints, z_itemsize=8, landuse_itemsize=2):
+    """!
+    Get the estimated peak memory footprint of the terrain processing in one chunk.
+    @param npoints: number of sampling points
+    @param z_itemsize: bytes of each z
+    @param landuse_itemsize: bytes of each landuse
+    @return the footprint in bytes.
+    """
+    return get_grid_footprint(npoints, z_itemsize, landuse_itemsize) + (
+        npoints * geom_bytes_per_center
+    )
+
+
+def get_grid_footprint(npoints, z_itemsize=8, landuse_itemsize=2):
+    """!
+    Get the estimated memory footprint of the Grid, while injecting the ghost centers.
+    @param npoints: number of sampling points
+    @param z_itemsize: bytes of each z
+    @param landuse_itemsize: bytes of each landuse
+    @return the footprint in bytes.
+    """
+    return 2 * npoints * (z_itemsize + landuse_itemsize)
+
+
+def get_row_chunks(nrows, ncols, max_bytes=None):
+    """!
+    Get the row chunks of the grid, for processing within a memory budget.
+    @param nrows: number of center rows
+    @param ncols: number of center cols
+    @param max_bytes: memory budget for each chunk, if None a single chunk
+    @return list of (first row, last row + 1).
+    """
+    if not max_bytes:
+        return [(0, nrows)]
+    step = max(int(max_bytes // ((ncols + 1) * geom_bytes_per_center)), 1)
+    return [(i0, min(i0 + step, nrows)) for i0 in range(0, nrows, step)]
+
+
+# The verts are extracted by averaging the neighbour centers z
+
+# · centers of quad faces  + ghost centers
+# o verts  * cs  x vert
+#
+#           dx       j
+#          + > +   +   +   +   +  first ghost row
+#       dy v o---o---o---o---o
+#          + | · | · | · | · | +  i center
+#            o---o---x---o---o    i vert
+#          + | · | · | · | · | +  i+1 center
+#            o---o---o---o---o
+#          +   +   +   +   +   +  last ghost row
+
+
+def get_nverts(g):
+    """Get the number of GEOM verts of the Grid with ghost centers."""
+    return (g.shape[0] - 1) * (g.shape[1] - 1)
+
+
+def get_vert_z(g, i0=0, i1=None):
+    """!
+    Get the GEOM vert z by row, as average of the surrounding centers.
+    @param g: the Grid, with ghost centers
+    @param i0: first vert row
+    @param i1: last vert row + 1, if None the last
+    @return np.array of shape (i1 - i0, ncols + 1) of z.
+    """
+    i1 = g.shape[0] - 1 if i1 is None else i1
+    z = g.z[i0 : i1 + 1].astype(np.float64)
+    return (z[:-1, :-1] + z[1:, :-1] + z[:-1, 1:] + z[1:, 1:]) / 4.0
+
+
+def get_verts(g, i0=0, i1=None):
+    """!
+    Get the GEOM verts by row, z as average of the surrounding centers.
+    @param g: the Grid, with ghost centers
+    @param i0: first vert row
+    @param i1: last vert row + 1, if None the last
+    @return np.array of shape ((i1 - i0) * (ncols + 1), 3) of (x, y, z).
+    """
+    i1 = g.shape[0] - 1 if i1 is None else i1
+    i, j = np.meshgrid(
+        np.arange(i0, i1) + 0.5, np.arange(g.shape[1] - 1) + 0.5, indexing="ij"
+    )
+    verts = np.empty(i.shape + (3,))
+    verts[:, :, 0], verts[:, :, 1] = g.get_xy(i, j)
+    verts[:, :, 2] = get_vert_z(g, i0, i1)
+    return verts.reshape(-1, 3)
+
+
+#        j   j  j+1
+#        *<------* i
+#        | f1 // |
+# faces  |  /·/  | i
+#        | // f2 |
+#        *------>* i+1
+
+
+def get_nfaces(g):
+    """Get the number of GEOM faces of the Grid with ghost centers."""
+    return (g.shape[0] - 2) * (g.shape[1] - 2) * 2
+
+
+def get_faces(nrows, ncols, i0=0, i1=None):
+    """!
+    Get the GEOM faces, two for each center by row, in FDS notation.
+    @param nrows: number of center rows, without ghosts
+    @param ncols: number of center cols, without ghosts
+    @param i0: first center row
+    @param i1: last center row + 1, if None the last
+    @return np.array of shape ((i1 - i0) * ncols * 2, 3) of vert indexes, starting from 1.
+    """
+    i1 = nrows if i1 is None else i1
+    len_vcol = ncols + 1  # vert grid is larger
+    i, j = np.meshgrid(
+        np.arange(i0, i1, dtype=np.int64),
+        np.arange(ncols, dtype=np.int64),
+        indexing="ij",
+    )
+    v00 = i * len_vcol + j + 1  # F90 indexes start from 1
+    v01, v10 = v00 + 1, v00 + len_vcol
+    v11 = v10 + 1
+    faces = np.stack(
+        (np.stack((v00, v10, v01), axis=-1), np.stack((v11, v01, v10), axis=-1)),
+        axis=2,
+    )
+    return faces.reshape(-1, 3)
+
+
+def get_face_landuses(g, i0=0, i1=None):
+    """!
+    Get the GEOM face landuses, two for each center by row.
+    @param g: the Grid, with ghost centers
+    @param i0: first center row
+    @param i1: last center row + 1, if None the last
+    @return np.array of shape ((i1 - i0) * ncols * 2,) of landuses.
+    """
+    i1 = g.shape[0] - 2 if i1 is None else i1
+    return np.repeat(g.landuse[i0 + 1 : i1 + 1, 1:-1].ravel(), 2)
+
+
+def get_landuse_counts(landuses):
+    """!
+    Get the histogram of the landuses, by bincount.
+    @param landuses: np.array of landuses, small integers
+    @return np.array of the present landuses, and np.array of their counts.
+    """
+    landuses = np.asarray(landuses).ravel()
+    if not landuses.size:
+        return landuses[:0], np.zeros(0, dtype=np.intp)
+    lu_min = int(landuses.min())
+    counts = np.bincount((landuses - lu_min).astype(np.intp))
+    present = np.flatnonzero(counts)
+    return present + lu_min, counts[present]
+
+
+# The landuses are translated to FDS SURF indexes by a lookup table
+# over the landuse range, in O(1) for each landuse.
+
+
+def get_surf_lut(surf_keys):
+    """!
+    Get the lookup table of the FDS SURF indexes by landuse.
+    @param surf_keys: the landuses of the FDS SURFs, in SURF_ID order
+    @return np.array of SURF indexes starting from 1, 0 if unknown, and the landuse of its first item.
+    """
+    surf_keys = np.asarray(surf_keys, dtype=np.int64)
+    lu_min = int(surf_keys.min())
+    lut = np.zeros(int(surf_keys.max()) - lu_min + 1, dtype=np.int32)
+    lut[surf_keys - lu_min] = np.arange(1, len(surf_keys) + 1, dtype=np.int32)
+    return lut, lu_min
+
+
+def get_surf_indexes(landuses, surf_keys):
+    """!
+    Get the FDS SURF indexes of the landuses.
+    @param landuses: np.array of landuses
+    @param surf_keys: the landuses of the FDS SURFs, in SURF_ID order
+    @return np.array of SURF indexes starting from 1, and the unknown landuses set to 1.
+    """
+    lut, lu_min = get_surf_lut(surf_keys)
+    pos = landuses.astype(np.intp) - lu_min
+    inside = (pos >= 0) & (pos < len(lut))
+    idxs = np.zeros(landuses.shape, dtype=np.int32)
+    idxs[inside] = lut[pos[inside]]
+    unknown = idxs == 0
+    idxs[unknown] = 1
+    return idxs, set(np.unique(landuses[unknown]).tolist())
+
+
+def get_obsts(g, min_z):
+    """!
+    Get the OBSTs, one for each center by row.
+    @param g: the Grid, with ghost centers
+    @param min_z: OBST bottom
+    @return np.array of shape (nrows * ncols, 6) of XBs, and np.array of landuses.
+    """
+    i, j = np.meshgrid(
+        np.arange(1, g.shape[0] - 1), np.arange(1, g.shape[1] - 1), indexing="ij"
+    )
+    x, y = g.get_xy(i, j)
+    hx = (g.dx[0] - g.dy[0]) / 2.0
+    hy = (g.dx[1] - g.dy[1]) / 2.0
+    xbs = np.empty(i.shape + (6,))
+    xbs[:, :, 0], xbs[:, :, 1] = x - hx, x + hx
+    xbs[:, :, 2], xbs[:, :, 3] = y - hy, y + hy
+    xbs[:, :, 4], xbs[:, :, 5] = min_z, g.z[1:-1, 1:-1]
+    return xbs.reshape(-1, 6), g.landuse[1:-1, 1:-1].ravel()
+
+
+# Point lookup in the grid, by inverting its affine transformation:
+# (x, y) = (x0, y0) + j * dx + i * dy
+
+
+def get_point_ij(g, x, y):
+    """!
+    Get the grid indexes of the nearest center of each point.
+    @param g: the Grid
+    @param x: np.array of x, relative to origin
+    @param y: np.array of y, relative to origin
+    @return np.arrays of row and col indexes, and np.array of inside flags.
+    """
+    (dxx, dxy), (dyx, dyy) = g.dx, g.dy
+    det = dxx * dyy - dyx * dxy
+    px, py = np.asarray(x) - g.x0, np.asarray(y) - g.y0
+    i = np.rint((dxx * py - dxy * px) / det).astype(np.intp)
+    j = np.rint((dyy * px - dyx * py) / det).astype(np.intp)
+    nrows, ncols = g.shape
+    inside = (i >= 0) & (i < nrows) & (j >= 0) & (j < ncols)
+    return i, j, inside
+
+
+def get_point_z(g, x, y):
+    """!
+    Get the terrain z at each point, from the grid cell containing it.
+    @param g: the Grid
+    @param x: np.array of x, relative to origin
+    @param y: np.array of y, relative to origin
+    @return np.array of z, nan for the points outside the grid.
+    """
+    i, j, inside = get_point_ij(g, x, y)
+    z = np.full(inside.shape, np.nan)
+    z[inside] = g.z[i[inside], j[inside]]
+    return z
+
+
+# Adaptive simplification of the GEOM terrain.
+# The vert grid is split in a quadtree of square blocks of 2^level cells.
+# A block is merged when its centers share the same landuse, and its verts
+# are within the vertical tolerance from the fan of four faces
+# around the block center vert:
+
+#   C0 *-------* C3     i (rows)
+#      | \   / |        |
+#      |   c   |        v
+#      | /   \ |
+#   C1 *-------* C2     j (cols) ->
+
+# Each merged block is then triangulated as a fan around its center vert,
+# through all the corner verts of the neighbour blocks on its sides,
+# so that there are no hanging verts and the terrain stays watertight.
+# Single cells keep their two faces.
+
+
+def _get_fan_weights(s):
+    """!
+    Get the linear interpolation weights of the verts of a block
+    from its fan of four faces.
+    @param s: block side, in cells
+    @return dict of (a, b) offset: ((corner, weight), ...), corner is c, 0, 1, 2, 3.
+    """
+    h = s / 2.0
+    corners = ((0, 0), (s, 0), (s, s), (0, s))
+    weights = dict()
+    for a in range(s + 1):
+        for b in range(s + 1):
+            p, q = a - h, b - h
+            if q <= -abs(p):
+                k = 0  # side C0-C1
+            elif p >= abs(q):
+                k = 1  # side C1-C2
+            elif q >= abs(p):
+                k = 2  # side C2-C3
+            else:
+                k = 3  # side C3-C0
+            (a0, b0), (a1, b1) = corners[k], corners[(k + 1) % 4]
+            m = np.array(((h, a0, a1), (h, b0, b1), (1.0, 1.0, 1.0)))
+            w = np.linalg.solve(m, np.array((a, b, 1.0)))
+            weights[(a, b)] = (("c", w[0]), (k, w[1]), ((k + 1) % 4, w[2]))
+    return weights
+
+
+def _get_boundary_offsets(s):
+    """!
+    Get the vert offsets along the block sides, walking C0, C1, C2, C3
+    (same orientation of the faces of single cells, pointing upwards).
+    @param s: block side, in cells
+    @return np.arrays of the row and col offsets.
+    """
+    k = np.arange(s)
+    a = np.concatenate((k, np.full(s, s), s - k, np.zeros(s, dtype=int)))
+    b = np.concatenate((np.zeros(s, dtype=int), k, np.full(s, s), s - k))
+    return a, b
+
+
+def get_simplified(g, tolerance, max_level=6):
+    """!
+    Get the simplified GEOM verts, faces, and face landuses.
+    @param g: the Grid, with ghost centers
+    @param tolerance: max vertical error of the merged blocks, in meters
+    @param max_level: max block side is 2^max_level cells
+    @return np.array of (x, y, z) verts, np.array of vert indexes faces starting from 1,
+            and np.array of face landuses.
+    """
+    nrows, ncols = g.shape[0] - 2, g.shape[1] - 2
+    landuse = g.landuse[1:-1, 1:-1]
+    smax = 2**max_level
+    nrows_p, ncols_p = -(-nrows // smax) * smax, -(-ncols // smax) * smax
+
+    # Pad the vert z with nan and the landuse, so that blocks
+    # larger than the terrain are never merged
+    z = np.full((nrows_p + 1, ncols_p + 1), np.nan)
+    z[: nrows + 1, : ncols + 1] = get_vert_z(g)
+    lu = np.pad(landuse, ((0, nrows_p - nrows), (0, ncols_p - ncols)), mode="edge")
+
+    # Find the merged blocks, from the largest
+    leaves = dict()  # level: (block rows, block cols)
+    taken = np.zeros((nrows_p // smax, ncols_p // smax), dtype=bool)
+    for level in range(max_level, 0, -1):
+        s, h = 2**level, 2 ** (level - 1)
+        nbr, nbc = nrows_p // s, ncols_p // s
+        # Same landuse
+        blocks = lu.reshape(nbr, s, nbc, s)
+        mergeable = blocks.min(axis=(1, 3)) == blocks.max(axis=(1, 3))
+        # Within tolerance
+        zs = {
+            "c": z[h:nrows_p:s, h:ncols_p:s],
+            0: z[0:nrows_p:s, 0:ncols_p:s],
+            1: z[s::s, 0:ncols_p:s],
+            2: z[s::s, s::s],
+            3: z[0:nrows_p:s, s::s],
+        }
+        err = np.zeros((nbr, nbc))
+        for (a, b), weights in _get_fan_weights(s).items():
+            approx = sum(w * zs[k] for k, w in weights)
+            err = np.maximum(err, np.abs(z[a : a + nrows_p : s, b : b + ncols_p : s] - approx))
+        mergeable &= err <= tolerance  # nan is never mergeable
+        mergeable &= ~taken
+        leaves[level] = np.nonzero(mergeable)
+        taken = np.repeat(np.repeat(taken | mergeable, 2, axis=0), 2, axis=1)
+    leaves[0] = np.nonzero(~taken[:nrows, :ncols])
+
+    # Mark and number the used verts
+    used = np.zeros((nrows + 1, ncols + 1), dtype=bool)
+    for level, (bi, bj) in leaves.items():
+        s = 2**level
+        i, j = bi * s, bj * s
+        used[i, j] = used[i + s, j] = used[i, j + s] = used[i + s, j + s] = True
+        if level:
+            used[i + s // 2, j + s // 2] = True
+    ids = np.cumsum(used.ravel()).reshape(used.shape)  # F90 indexes start from 1
+
+    # Single cells, two faces each
+    i, j = leaves[0]
+    v00, v10, v01, v11 = ids[i, j], ids[i + 1, j], ids[i, j + 1], ids[i + 1, j + 1]
+    faces = [
+        np.stack(
+            (np.stack((v00, v10, v01), axis=-1), np.stack((v11, v01, v10), axis=-1)),
+            axis=1,
+        ).reshape(-1, 3)
+    ]
+    face_landuses = [np.repeat(landuse[i, j], 2)]
+
+    # Merged blocks, fan of faces around their center
+    for level in range(1, max_level + 1):
+        bi, bj = leaves[level]
+        if not len(bi):
+            continue
+        s, h = 2**level, 2 ** (level - 1)
+        a, b = _get_boundary_offsets(s)
+        vi, vj = bi[:, None] * s + a, bj[:, None] * s + b
+        mask = used[vi, vj]
+        block = np.nonzero(mask)[0]  # sorted by block, then along the sides
+        bverts = ids[vi, vj][mask]
+        # Next boundary vert, back to the first at the end of each block
+        starts = np.flatnonzero(np.r_[True, block[1:] != block[:-1]])
+        ends = np.r_[starts[1:], len(block)] - 1
+        nexts = np.arange(1, len(block) + 1)
+        nexts[ends] = starts
+        centers = ids[bi * s + h, bj * s + h][block]
+        faces.append(np.stack((centers, bverts, bverts[nexts]), axis=-1))
+        face_landuses.append(landuse[bi * s, bj * s][block])
+
+    # Used verts
+    i, j = np.nonzero(used)
+    verts = np.empty((len(i), 3))
+    verts[:, 0], verts[:, 1] = g.get_xy(i + 0.5, j + 0.5)
+    verts[:, 2] = z[i, j]
+    return verts, np.concatenate(faces), np.concatenate(face_landuses)
+
+
+# Split of the GEOM terrain by MESH.
+# Each face (or OBST) is assigned to the MESH containing its center in plan view,
+# so that the pieces share their seam verts, but never their faces.
+
+
+def get_point_meshes(x, y, mesh_xbs):
+    """!
+    Get the MESH index of each point in plan view.
+    Points outside all MESHes are assigned to the nearest one.
+    @param x: np.array of x
+    @param y: np.array of y
+    @param mesh_xbs: list of MESH XBs
+    @return np.array of MESH indexes.
+    """
+    mesh_idxs = np.full(len(x), -1, dtype=np.int32)
+    for im, xb in enumerate(mesh_xbs):
+        inside = (x >= xb[0]) & (x < xb[1]) & (y >= xb[2]) & (y < xb[3])
+        mesh_idxs[inside & (mesh_idxs == -1)] = im
+    outside = np.flatnonzero(mesh_idxs == -1)
+    if outside.size:
+        dist = np.full(outside.size, np.inf)
+        for im, xb in enumerate(mesh_xbs):
+            dx = np.maximum(np.maximum(xb[0] - x[outside], x[outside] - xb[1]), 0.0)
+            dy = np.maximum(np.maximum(xb[2] - y[outside], y[outside] - xb[3]), 0.0)
+            d = np.hypot(dx, dy)
+            nearer = d < dist
+            mesh_idxs[outside[nearer]], dist[nearer] = im, d[nearer]
+    return mesh_idxs
+
+
+def get_face_meshes(verts, faces, mesh_xbs):
+    """!
+    Get the MESH index of each GEOM face, from its center in plan view.
+    @param verts: np.array of shape (nverts, 3) of (x, y, z)
+    @param faces: np.array of shape (nfaces, 3) of vert indexes, starting from 1
+    @param mesh_xbs: list of MESH XBs
+    @return np.array of shape (nfaces,) of MESH indexes.
+    """
+    return get_point_meshes(
+        x=verts[faces - 1, 0].mean(axis=1),
+        y=verts[faces - 1, 1].mean(axis=1),
+        mesh_xbs=mesh_xbs,
+    )
+
+
+def get_piece(verts, faces, face_idxs):
+    """!
+    Get a piece of the GEOM terrain, with its own verts.
+    @param verts: np.array of shape (nverts, 3) of (x, y, z)
+    @param faces: np.array of shape (nfaces, 3) of vert indexes, starting from 1
+    @param face_idxs: np.array of the piece face indexes
+    @return np.array of the piece verts, and np.array of the piece faces, starting from 1.
+    """
+    used, inverse = np.unique(faces[face_idxs], return_inverse=True)
+    return verts[used - 1], inverse.reshape(-1, 3) + 1
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+"""qgis2fds core"""
+
+__author__ = "Emanuele Gissi"
+__date__ = "2020-05-04"
+__copyright__ = "(C) 2020 by Emanuele Gissi"
+__revision__ = "$Format:%H$"  # replaced with git SHA1
+
+import warnings
+import numpy as np
+
+# The wind csv file has an header line and three columns:
+# time in seconds, wind speed in m/s, and direction in degrees.
+# Long met-station series are simplified before becoming FDS RAMPs,
+# as FDS looks up the RAMPs at each time step.
+
+
+def read_wind_csv(filepath):
+    """!
+    Read the wind csv file.
+    @param filepath: the wind csv filepath
+    @return np.arrays of times, speeds, and directions.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # empty file, no rows
+        data = np.loadtxt(
+            filepath, delimiter=",", skiprows=1, usecols=(0, 1, 2), ndmin=2
+        )
+    return data[:, 0], data[:, 1], data[:, 2]
+
+
+def unwrap_directions(wd):
+    """!
+    Unwrap the directions, so that each step is the shortest turn.
+    FDS interpolates the RAMP values linearly,
+    so a 350 to 10 degrees step would turn through 180.
+    @param wd: np.array of directions in degrees
+    @return np.array of unwrapped directions in degrees, eg. 350 to 370.
+    """
+    if not len(wd):
+        return wd
+    steps = np.diff(wd)
+    steps = (steps + 180.0) % 360.0 - 180.0  # shortest turn, in [-180, 180)
+    return np.concatenate(((wd[0],), wd[0] + np.cumsum(steps)))
+
+
+def get_simplified_ramp(t, f, tolerance):
+    """!
+    Simplify a RAMP by Douglas-Peucker, on the vertical distance,
+    so that the linear interpolation of the kept points is within tolerance
+    from each original value.
+    @param t: np.array of times, increasing
+    @param f: np.array of values
+    @param tolerance: max error of the values, or None for no simplification
+    @return np.array of the kept indexes.
+    """
+    n = len(t)
+    if tolerance is None or n < 3:
+        return np.arange(n)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i0, i1 = stack.pop()
+        if i1 - i0 < 2:
+            continue
+        dt = t[i1] - t[i0]
+        if dt > 0.0:
+            fi = f[i0] + (f[i1] - f[i0]) * (t[i0 + 1 : i1] - t[i0]) / dt
+        else:  # repeated times
+            fi = np.full(i1 - i0 - 1, f[i0])
+        err = np.abs(f[i0 + 1 : i1] - fi)
+        k = int(np.argmax(err))
+        if err[k] > tolerance:
+            im = i0 + 1 + k
+            keep[im] = True
+            stack.append((i0, im))
+            stack.append((im, i1))
+    return np.flatnonzero(keep)
+
+
+# Gridded initial wind field, from U and V rasters in UTM,
+# resampled by bilinear interpolation onto the staggered MESH grid.
+# The field is uniform along z, so that the flow starts close to equilibrium.
+
+
+def read_raster(filepath):
+    """!
+    Read the first band of a north-up raster file. Needs GDAL.
+    @param filepath: the raster filepath
+    @return np.array of values, nan for nodata, and the geotransform.
+    """
+    from osgeo import gdal
+
+    ds = gdal.Open(filepath)
+    if ds is None:
+        raise OSError(f"Raster file not readable: <{filepath}>")
+    gt = ds.GetGeoTransform()
+    if gt[2] or gt[4]:
+        raise ValueError(f"Raster is not north-up: <{filepath}>")
+    band = ds.GetRasterBand(1)
+    values = band.ReadAsArray().astype(np.float64)
+    nodata = band.GetNoDataValue()
+    if nodata is not None:
+        values[values == nodata] = np.nan
+    ds = None
+    return values, gt
+
+
+def get_raster_values(values, geotransform, x, y):
+    """!
+    Get the raster values at the points, by bilinear interpolation
+    of the pixel centers, clamped at the raster borders.
+    @param values: np.array of shape (nrows, ncols)
+    @param geotransform: the north-up geotransform
+    @param x: np.array of x, in the raster crs
+    @param y: np.array of y, broadcastable to x
+    @return np.array of values, nan where interpolated from nodata.
+    """
+    gt = geotransform
+    nrows, ncols = values.shape
+    x, y = np.broadcast_arrays(x, y)
+    c = np.clip((x - gt[0]) / gt[1] - 0.5, 0.0, ncols - 1)
+    r = np.clip((y - gt[3]) / gt[5] - 0.5, 0.0, nrows - 1)
+    c0 = np.clip(np.floor(c), 0, max(ncols - 2, 0)).astype(np.intp)
+    r0 = np.clip(np.floor(r), 0, max(nrows - 2, 0)).astype(np.intp)
+    c1, r1 = np.minimum(c0 + 1, ncols - 1), np.minimum(r0 + 1, nrows - 1)
+    fc, fr = c - c0, r - r0
+    return (1.0 - fr) * ((1.0 - fc) * values[r0, c0] + fc * values[r0, c1]) + fr * (
+        (1.0 - fc) * values[r1, c0] + fc * values[r1, c1]
+    )
+
+
+def get_mesh_uv(ijk, xb, origin, u, v, geotransform):
+    """!
+    Get the U and V of a MESH, on its staggered grid.
+    U is at the x faces, V at the y faces, both at the cell centers otherwise.
+    Index 0 is the face at the MESH min, or the first cell center.
+    @param ijk: MESH IJK
+    @param xb: MESH XB, relative to origin
+    @param origin: the (x, y) of the origin, in the raster crs
+    @param u: np.array of the U raster values
+    @param v: np.array of the V raster values
+    @param geotransform: the north-up geotransform of the rasters
+    @return np.arrays of U and V of shape (IBAR + 1, JBAR + 1).
+    """
+    dx, dy = (xb[1] - xb[0]) / ijk[0], (xb[3] - xb[2]) / ijk[1]
+    i, j = np.arange(ijk[0] + 1), np.arange(ijk[1] + 1)
+    x_faces, x_centers = xb[0] + i * dx, xb[0] + (np.maximum(i, 1) - 0.5) * dx
+    y_faces, y_centers = xb[2] + j * dy, xb[2] + (np.maximum(j, 1) - 0.5) * dy
+    x0, y0 = origin
+    mesh_u = get_raster_values(
+        u, geotransform, x0 + x_faces[:, None], y0 + y_centers[None, :]
+    )
+    mesh_v = get_raster_values(
+        v, geotransform, x0 + x_centers[:, None], y0 + y_faces[None, :]
+    )
+    return mesh_u, mesh_v
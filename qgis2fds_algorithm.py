@@ -16,6 +16,7 @@ from qgis.core import (
     QgsCoordinateTransform,
     QgsProcessingException,
     QgsProcessingAlgorithm,
+    QgsProcessingUtils,
     QgsProcessingParameterRasterLayer,
     QgsProcessingParameterVectorLayer,
     QgsProcessingParameterPoint,
@@ -32,19 +33,10 @@ from qgis.core import (
     QgsRasterProjector
 )
 
-import os, sys
-from .types import (
-    utils,
-    FDSCase,
-    Domain,
-    OBSTTerrain,
-    GEOMTerrain,
-    LanduseType,
-    Texture,
-    Wind,
-)
-from . import algos
-import processing
+import os, sys, concurrent.futures
+
+# The heavy types, algos, processing, and numpy modules
+# are imported on first execution, not at QGIS startup
 
 DEFAULTS = {
     "chid": "terrain",
@@ -56,16 +48,75 @@ DEFAULTS = {
     "landuse_layer": None,
     "landuse_type_filepath": "",
     "fire_layer": None,
+    "devc_layer": None,
     "wind_filepath": "",
+    "sweep_filepath": "",
     "tex_layer": None,
     "tex_pixel_size": 5.0,
     "nmesh": 1,
     "cell_size": None,
     "export_obst": True,
+    "terrain_following": False,
+    "refine_buffer": None,
+    "refine_downwind": None,
+    "fft_snap": False,
+    "max_ncell": None,
+    "store_path": "",
+    "store_link": False,
+    "max_memory": None,
+    "terrain_tolerance": None,
+    "geom_split": False,
+    "export_matrix": False,
+    "wind_speed_tolerance": None,
+    "wind_direction_tolerance": None,
+    "wind_u_layer": None,
+    "wind_v_layer": None,
     "debug": False,
 }
 
 
+# Default layers, the first layer with a keyword in its name.
+# Discovered in a single pass over the project layers,
+# cached until layers are added or removed.
+
+LAYER_KEYWORDS = {
+    "dem_layer": ("DEM", "dem"),
+    "fire_layer": ("Fire", "fire"),
+    "devc_layer": ("DEVC", "devc"),
+}
+
+_layer_defaults = None
+_layer_defaults_connected = False
+
+
+def _reset_layer_defaults(*args):
+    global _layer_defaults
+    _layer_defaults = None
+
+
+def get_layer_defaults():
+    """!
+    Get the default layer names of the current project.
+    @return dict of layer names by parameter name.
+    """
+    global _layer_defaults, _layer_defaults_connected
+    if _layer_defaults is not None:
+        return _layer_defaults
+    project = QgsProject.instance()
+    if not _layer_defaults_connected:
+        project.layersAdded.connect(_reset_layer_defaults)
+        project.layersRemoved.connect(_reset_layer_defaults)
+        project.cleared.connect(_reset_layer_defaults)
+        _layer_defaults_connected = True
+    _layer_defaults = dict()
+    for layer in project.mapLayers().values():
+        name = layer.name()
+        for key, keywords in LAYER_KEYWORDS.items():
+            if key not in _layer_defaults and any(k in name for k in keywords):
+                _layer_defaults[key] = name
+    return _layer_defaults
+
+
 class qgis2fdsAlgorithm(QgsProcessingAlgorithm):
     """
     qgis2fds algorithm.
@@ -159,15 +210,8 @@ class qgis2fdsAlgorithm(QgsProcessingAlgorithm):
         defaultValue, _ = project.readEntry(
             "qgis2fds", "dem_layer", DEFAULTS["dem_layer"]
         )
-        if not defaultValue:
-            try:  # first layer name containing "dem"
-                defaultValue = [
-                    layer.name()
-                    for layer in QgsProject.instance().mapLayers().values()
-                    if "DEM" in layer.name() or "dem" in layer.name()
-                ][0]
-            except IndexError:
-                pass
+        if not defaultValue:  # first layer name containing "dem"
+            defaultValue = get_layer_defaults().get("dem_layer")
         self.addParameter(
             QgsProcessingParameterRasterLayer(
                 "dem_layer",
@@ -211,15 +255,8 @@ class qgis2fdsAlgorithm(QgsProcessingAlgorithm):
         defaultValue, _ = project.readEntry(
             "qgis2fds", "fire_layer", DEFAULTS["fire_layer"]
         )
-        if not defaultValue:
-            try:  # first layer name containing "fire"
-                defaultValue = [
-                    layer.name()
-                    for layer in QgsProject.instance().mapLayers().values()
-                    if "Fire" in layer.name() or "fire" in layer.name()
-                ][0]
-            except IndexError:
-                pass
+        if not defaultValue:  # first layer name containing "fire"
+            defaultValue = get_layer_defaults().get("fire_layer")
         self.addParameter(
             QgsProcessingParameterVectorLayer(
                 "fire_layer",
@@ -229,26 +266,21 @@ class qgis2fdsAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
-        # Define parameters: devc_layer  # FIXME implement
-        #
-        # defaultValue, _ = project.readEntry("qgis2fds", "devc_layer", None)
-        # if not defaultValue:
-        #     try:  # first layer name containing "devc"
-        #         defaultValue = [
-        #             layer.name()
-        #             for layer in QgsProject.instance().mapLayers().values()
-        #             if "DEVC" in layer.name() or "devc" in layer.name()
-        #         ][0]
-        #     except IndexError:
-        #         pass
-        # self.addParameter(
-        #     QgsProcessingParameterVectorLayer(
-        #         "devc_layer",
-        #         "FDS DEVCs layer",
-        #         optional=True,
-        #         defaultValue=defaultValue,
-        #     )
-        # )
+        # Define parameters: devc_layer [optional]
+
+        defaultValue, _ = project.readEntry(
+            "qgis2fds", "devc_layer", DEFAULTS["devc_layer"]
+        )
+        if not defaultValue:  # first layer name containing "devc"
+            defaultValue = get_layer_defaults().get("devc_layer")
+        self.addParameter(
+            QgsProcessingParameterVectorLayer(
+                "devc_layer",
+                "FDS DEVCs layer",
+                optional=True,
+                defaultValue=defaultValue,
+            )
+        )
 
         # Define parameters: wind_filepath [optional]
 
@@ -266,6 +298,22 @@ class qgis2fdsAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        # Define parameters: sweep_filepath [optional]
+
+        defaultValue, _ = project.readEntry(
+            "qgis2fds", "sweep_filepath", DEFAULTS["sweep_filepath"]
+        )
+        param = QgsProcessingParameterFile(
+            "sweep_filepath",
+            "Scenario sweep *.csv file (if not set, export a single case)",
+            behavior=QgsProcessingParameterFile.File,
+            fileFilter="CSV files (*.csv)",
+            optional=True,
+            defaultValue=defaultValue,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
         # Define parameter: tex_layer [optional]
 
         defaultValue, _ = project.readEntry(
@@ -300,7 +348,7 @@ class qgis2fdsAlgorithm(QgsProcessingAlgorithm):
         defaultValue, _ = project.readNumEntry("qgis2fds", "nmesh", DEFAULTS["nmesh"])
         param = QgsProcessingParameterNumber(
             "nmesh",
-            "Max number of FDS MESHes",
+            "Number of FDS MESHes (MPI processes)",
             type=QgsProcessingParameterNumber.Integer,
             defaultValue=defaultValue,
             minValue=1,
@@ -335,6 +383,205 @@ class qgis2fdsAlgorithm(QgsProcessingAlgorithm):
         self.addParameter(param)
         param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
 
+        # Define parameter: terrain_following
+
+        defaultValue, _ = project.readBoolEntry(
+            "qgis2fds", "terrain_following", DEFAULTS["terrain_following"]
+        )
+        param = QgsProcessingParameterBoolean(
+            "terrain_following",
+            "Fit FDS MESH columns to the terrain",
+            defaultValue=defaultValue,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        # Define parameter: refine_buffer [optional]
+
+        defaultValue, _ = project.readDoubleEntry("qgis2fds", "refine_buffer")
+        param = QgsProcessingParameterNumber(
+            "refine_buffer",
+            "Fire refinement buffer (in meters; if not set, uniform MESH resolution)",
+            type=QgsProcessingParameterNumber.Double,
+            optional=True,
+            defaultValue=defaultValue or None,  # protect
+            minValue=0.0,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        # Define parameter: refine_downwind [optional]
+
+        defaultValue, _ = project.readDoubleEntry("qgis2fds", "refine_downwind")
+        param = QgsProcessingParameterNumber(
+            "refine_downwind",
+            "Fire refinement downwind corridor (in meters; if not set, no corridor)",
+            type=QgsProcessingParameterNumber.Double,
+            optional=True,
+            defaultValue=defaultValue or None,  # protect
+            minValue=0.0,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        # Define parameter: fft_snap
+
+        defaultValue, _ = project.readBoolEntry(
+            "qgis2fds", "fft_snap", DEFAULTS["fft_snap"]
+        )
+        param = QgsProcessingParameterBoolean(
+            "fft_snap",
+            "Snap FDS MESH J and K to FFT friendly numbers",
+            defaultValue=defaultValue,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        # Define parameter: max_ncell [optional]
+
+        defaultValue, _ = project.readNumEntry("qgis2fds", "max_ncell")
+        param = QgsProcessingParameterNumber(
+            "max_ncell",
+            "Max number of FDS cells (if not set, no cell budget)",
+            type=QgsProcessingParameterNumber.Integer,
+            optional=True,
+            defaultValue=defaultValue or None,  # protect
+            minValue=1,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        # Define parameter: store_path [optional]
+
+        defaultValue, _ = project.readEntry(
+            "qgis2fds", "store_path", DEFAULTS["store_path"]
+        )
+        param = QgsProcessingParameterFile(
+            "store_path",
+            "Shared terrain store folder (if not set, no shared store)",
+            behavior=QgsProcessingParameterFile.Folder,
+            fileFilter="All files (*.*)",
+            optional=True,
+            defaultValue=defaultValue or None,  # protect
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        # Define parameter: store_link
+
+        defaultValue, _ = project.readBoolEntry(
+            "qgis2fds", "store_link", DEFAULTS["store_link"]
+        )
+        param = QgsProcessingParameterBoolean(
+            "store_link",
+            "Hard link the stored files (if not set, use relative paths)",
+            defaultValue=defaultValue,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        # Define parameter: max_memory [optional]
+
+        defaultValue, _ = project.readNumEntry("qgis2fds", "max_memory")
+        param = QgsProcessingParameterNumber(
+            "max_memory",
+            "Peak memory budget for the terrain (in MB; if not set, no memory budget)",
+            type=QgsProcessingParameterNumber.Integer,
+            optional=True,
+            defaultValue=defaultValue or None,  # protect
+            minValue=1,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        # Define parameter: terrain_tolerance [optional]
+
+        defaultValue, _ = project.readDoubleEntry("qgis2fds", "terrain_tolerance")
+        param = QgsProcessingParameterNumber(
+            "terrain_tolerance",
+            "GEOM terrain simplification vertical tolerance (in meters; if not set, no simplification)",
+            type=QgsProcessingParameterNumber.Double,
+            optional=True,
+            defaultValue=defaultValue or None,  # protect
+            minValue=0.0,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        # Define parameter: geom_split
+
+        defaultValue, _ = project.readBoolEntry(
+            "qgis2fds", "geom_split", DEFAULTS["geom_split"]
+        )
+        param = QgsProcessingParameterBoolean(
+            "geom_split",
+            "Split the GEOM terrain by FDS MESH",
+            defaultValue=defaultValue,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        # Define parameter: export_matrix
+
+        defaultValue, _ = project.readBoolEntry(
+            "qgis2fds", "export_matrix", DEFAULTS["export_matrix"]
+        )
+        param = QgsProcessingParameterBoolean(
+            "export_matrix",
+            "Export the terrain matrix (NPZ and GeoTIFF) for post-processing",
+            defaultValue=defaultValue,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        # Define parameter: wind_speed_tolerance [optional]
+
+        defaultValue, _ = project.readDoubleEntry("qgis2fds", "wind_speed_tolerance")
+        param = QgsProcessingParameterNumber(
+            "wind_speed_tolerance",
+            "Wind speed ramp simplification tolerance (in m/s; if not set, no simplification)",
+            type=QgsProcessingParameterNumber.Double,
+            optional=True,
+            defaultValue=defaultValue or None,  # protect
+            minValue=0.0,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        # Define parameter: wind_direction_tolerance [optional]
+
+        defaultValue, _ = project.readDoubleEntry(
+            "qgis2fds", "wind_direction_tolerance"
+        )
+        param = QgsProcessingParameterNumber(
+            "wind_direction_tolerance",
+            "Wind direction ramp simplification tolerance (in degrees; if not set, no simplification)",
+            type=QgsProcessingParameterNumber.Double,
+            optional=True,
+            defaultValue=defaultValue or None,  # protect
+            minValue=0.0,
+        )
+        self.addParameter(param)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        # Define parameters: wind_u_layer and wind_v_layer [optional]
+
+        for name, desc in (
+            ("wind_u_layer", "Initial wind field U raster layer (in m/s, eastward)"),
+            ("wind_v_layer", "Initial wind field V raster layer (in m/s, northward)"),
+        ):
+            defaultValue, _ = project.readEntry("qgis2fds", name, DEFAULTS[name])
+            param = QgsProcessingParameterRasterLayer(
+                name,
+                desc,
+                optional=True,
+                defaultValue=defaultValue,
+            )
+            self.addParameter(param)
+            param.setFlags(
+                param.flags() | QgsProcessingParameterDefinition.FlagAdvanced
+            )
+
         # Define parameter: debug
         defaultValue, _ = project.readBoolEntry(
             "qgis2fds", "debug", DEFAULTS["debug"]
@@ -366,8 +613,27 @@ class qgis2fdsAlgorithm(QgsProcessingAlgorithm):
         """
         Process algorithm.
         """
+        import processing
+        from . import algos
+        from .types import (
+            utils,
+            CostEstimate,
+            DEVCs,
+            FDSCase,
+            Domain,
+            OBSTTerrain,
+            GEOMTerrain,
+            LanduseType,
+            Sweep,
+            Texture,
+            Wind,
+            WindField,
+        )
 
-        results, outputs, project = {}, {}, QgsProject.instance()
+        # The context project is the current project in QGIS,
+        # or a throw away project when running headless
+        results, outputs = {}, {}
+        project = context.project() or QgsProject.instance()
 
         # Check project crs and save it
 
@@ -531,23 +797,90 @@ class qgis2fdsAlgorithm(QgsProcessingAlgorithm):
                 "qgis2fds", "fire_layer", parameters.get("fire_layer")
             )  # as str
 
-        # Get devc_layer (optional)
-        # devc_layer = None
-        # if parameters["devc_layer"]:
-        #     devc_layer = self.parameterAsVectorLayer(parameters, "devc_layer", context)
-        #     if not devc_layer.crs().isValid():
-        #         raise QgsProcessingException(
-        #             f"DEVCs layer CRS <{devc_layer.crs().description()}> is not valid, cannot proceed."
-        #         )
-        # project.writeEntry("qgis2fds", "devc_layer", parameters["devc_layer"])
+        # Get parameter: devc_layer (optional)
+
+        devc_layer, utm_devc_layer = None, None
+        if "devc_layer" in parameters:
+            devc_layer = self.parameterAsVectorLayer(parameters, "devc_layer", context)
+            if devc_layer:
+                if not devc_layer.crs().isValid():
+                    raise QgsProcessingException(
+                        f"DEVCs layer CRS <{devc_layer.crs().description()}> is not valid, cannot proceed."
+                    )
+                # All the DEVC points are reprojected at once
+                outputs["utm_devc_layer"] = algos.get_reprojected_vector_layer(
+                    context,
+                    feedback,
+                    vector_layer=devc_layer,
+                    destination_crs=utm_crs,
+                )
+                utm_devc_layer = context.getMapLayer(
+                    outputs["utm_devc_layer"]["OUTPUT"]
+                )
+                utm_devc_layer.setName(devc_layer.name())
+            project.writeEntry(
+                "qgis2fds", "devc_layer", parameters.get("devc_layer")
+            )  # as str
 
         # Get parameter: wind_filepath (optional)
 
         wind_filepath = self.parameterAsFile(parameters, "wind_filepath", context)
         project.writeEntry("qgis2fds", "wind_filepath", wind_filepath)
 
+        # Get parameters: wind_speed_tolerance and wind_direction_tolerance (optional)
+
+        wind_tolerances = dict()
+        for name in ("wind_speed_tolerance", "wind_direction_tolerance"):
+            wind_tolerances[name] = None
+            if parameters.get(name) is None:
+                project.writeEntry("qgis2fds", name, "")
+            else:
+                wind_tolerances[name] = self.parameterAsDouble(
+                    parameters, name, context
+                )
+                project.writeEntryDouble("qgis2fds", name, wind_tolerances[name])
+
         wind = Wind(
-            feedback=feedback, project_path=project_path, filepath=wind_filepath
+            feedback=feedback,
+            project_path=project_path,
+            filepath=wind_filepath,
+            speed_tolerance=wind_tolerances["wind_speed_tolerance"],
+            direction_tolerance=wind_tolerances["wind_direction_tolerance"],
+        )
+
+        # Get parameters: wind_u_layer and wind_v_layer (optional)
+
+        utm_wind_filepaths = dict()
+        for name in ("wind_u_layer", "wind_v_layer"):
+            layer = self.parameterAsRasterLayer(parameters, name, context)
+            if layer:
+                if not layer.crs().isValid():
+                    raise QgsProcessingException(
+                        f"Wind raster layer CRS <{layer.crs().description()}> is not valid, cannot proceed."
+                    )
+                outputs[f"utm_{name}"] = algos.get_reprojected_raster_layer(
+                    context,
+                    feedback,
+                    raster_layer=layer,
+                    destination_crs=utm_crs,
+                )
+                utm_wind_filepaths[name] = outputs[f"utm_{name}"]["OUTPUT"]
+            project.writeEntry("qgis2fds", name, parameters.get(name))  # as str
+        if len(utm_wind_filepaths) == 1:
+            raise QgsProcessingException(
+                "Both U and V wind raster layers are needed, cannot proceed."
+            )
+
+        if feedback.isCanceled():
+            return {}
+
+        # Get parameter: sweep_filepath (optional)
+
+        sweep_filepath = self.parameterAsFile(parameters, "sweep_filepath", context)
+        project.writeEntry("qgis2fds", "sweep_filepath", sweep_filepath)
+
+        sweep = Sweep(
+            feedback=feedback, project_path=project_path, filepath=sweep_filepath
         )
 
         # Get parameter: tex_layer (optional)
@@ -571,30 +904,97 @@ class qgis2fdsAlgorithm(QgsProcessingAlgorithm):
                 self.invalidSourceError(parameters, "tex_pixel_size")
             )
         project.writeEntryDouble("qgis2fds", "tex_pixel_size", tex_pixel_size)
+        tex_extent = utm_extent
 
-        texture = Texture(
-            feedback=feedback,
-            path=fds_path,
-            name=chid,
-            image_type="png",
-            pixel_size=tex_pixel_size,
-            tex_layer=tex_layer,
-            utm_extent=utm_extent,
-            utm_crs=utm_crs,
+        # Get parameter: export_obst
+
+        export_obst = self.parameterAsBool(parameters, "export_obst", context)
+        project.writeEntryBool("qgis2fds", "export_obst", export_obst)
+
+        # Get parameter: terrain_following
+
+        terrain_following = self.parameterAsBool(
+            parameters, "terrain_following", context
         )
+        project.writeEntryBool("qgis2fds", "terrain_following", terrain_following)
 
-        # Get DEVCs layer  # FIXME implement
-        # utm_devc_layer = None
-        # if devc_layer:
-        #     pass
+        # Get parameter: refine_buffer (optional)
 
-        #     if feedback.isCanceled():
-        #         return {}
+        refine_buffer = None
+        if parameters.get("refine_buffer") is None:
+            project.writeEntry("qgis2fds", "refine_buffer", "")
+        else:
+            refine_buffer = self.parameterAsDouble(parameters, "refine_buffer", context)
+            project.writeEntryDouble("qgis2fds", "refine_buffer", refine_buffer)
 
-        # Get parameter: export_obst
+        # Get parameter: refine_downwind (optional)
 
-        export_obst = self.parameterAsBool(parameters, "export_obst", context)
-        project.writeEntryBool("qgis2fds", "export_obst", export_obst)
+        refine_downwind = None
+        if parameters.get("refine_downwind") is None:
+            project.writeEntry("qgis2fds", "refine_downwind", "")
+        else:
+            refine_downwind = self.parameterAsDouble(
+                parameters, "refine_downwind", context
+            )
+            project.writeEntryDouble("qgis2fds", "refine_downwind", refine_downwind)
+
+        # Get parameter: fft_snap
+
+        fft_snap = self.parameterAsBool(parameters, "fft_snap", context)
+        project.writeEntryBool("qgis2fds", "fft_snap", fft_snap)
+
+        # Get parameter: max_ncell (optional)
+
+        max_ncell = None
+        if parameters.get("max_ncell") is None:
+            project.writeEntry("qgis2fds", "max_ncell", "")
+        else:
+            max_ncell = self.parameterAsInt(parameters, "max_ncell", context)
+            project.writeEntry("qgis2fds", "max_ncell", max_ncell)
+
+        # Get parameter: store_path (optional)
+
+        store_path = self.parameterAsFile(parameters, "store_path", context)
+        project.writeEntry("qgis2fds", "store_path", store_path or "")
+        if store_path:
+            store_path = os.path.join(project_path, store_path)  # make abs
+
+        # Get parameter: store_link
+
+        store_link = self.parameterAsBool(parameters, "store_link", context)
+        project.writeEntryBool("qgis2fds", "store_link", store_link)
+
+        # Get parameter: max_memory (optional)
+
+        max_memory = None
+        if parameters.get("max_memory") is None:
+            project.writeEntry("qgis2fds", "max_memory", "")
+        else:
+            max_memory = self.parameterAsInt(parameters, "max_memory", context)
+            project.writeEntry("qgis2fds", "max_memory", max_memory)
+
+        # Get parameter: terrain_tolerance (optional)
+
+        terrain_tolerance = None
+        if parameters.get("terrain_tolerance") is None:
+            project.writeEntry("qgis2fds", "terrain_tolerance", "")
+        else:
+            terrain_tolerance = self.parameterAsDouble(
+                parameters, "terrain_tolerance", context
+            )
+            project.writeEntryDouble(
+                "qgis2fds", "terrain_tolerance", terrain_tolerance
+            )
+
+        # Get parameter: geom_split
+
+        geom_split = self.parameterAsBool(parameters, "geom_split", context)
+        project.writeEntryBool("qgis2fds", "geom_split", geom_split)
+
+        # Get parameter: export_matrix
+
+        export_matrix = self.parameterAsBool(parameters, "export_matrix", context)
+        project.writeEntryBool("qgis2fds", "export_matrix", export_matrix)
 
         # Get parameter: dem_layer
 
@@ -627,7 +1027,10 @@ class qgis2fdsAlgorithm(QgsProcessingAlgorithm):
         # results["utm_dem_layer"] = outputs["utm_dem_layer"]["OUTPUT"] # DEBUG
         utm_dem_layer = QgsRasterLayer(outputs["utm_dem_layer"]["OUTPUT"])
 
-        # Get the sampling grid
+        # Get the sampling grid,
+        # the scenario sweep fire layers are set later
+        if sweep.scenarios:
+            fire_layer, utm_fire_layer, utm_b_fire_layer = None, None, None
         outputs["sampling_layer"] = algos.get_sampling_point_grid_layer(
             context,
             feedback,
@@ -694,7 +1097,7 @@ class qgis2fdsAlgorithm(QgsProcessingAlgorithm):
                     processing.run("native:savefeatures", alg_params, context=context)
                 feedback.pushInfo("Saving %s"%(outname))
 
-        # Prepare terrain, domain, and fds_case
+        # Prepare terrain, shared by all scenarios
         if export_obst:
             Terrain = OBSTTerrain
         else:
@@ -708,40 +1111,259 @@ class qgis2fdsAlgorithm(QgsProcessingAlgorithm):
             fire_layer=fire_layer,
             path=fds_path,
             name=chid,
+            store_path=store_path,
+            store_link=store_link,
+            max_memory=max_memory,
+            tolerance=terrain_tolerance,
+            split=geom_split,
+            matrix=export_matrix,
         )
 
         if feedback.isCanceled():
             return {}
 
-        domain = Domain(
-            feedback=feedback,
-            utm_crs=utm_crs,
-            utm_extent=utm_extent,
-            utm_origin=utm_origin,
-            wgs84_origin=wgs84_origin,
-            min_z=terrain.min_z,
-            max_z=terrain.max_z,
-            cell_size=cell_size,
-            nmesh=nmesh,
-        )
+        # Prepare the initial wind field, shared by all scenarios
+        wind_field = None
+        if utm_wind_filepaths:
+            wind_field = WindField(
+                feedback=feedback,
+                path=fds_path,
+                name=chid,
+                u_filepath=utm_wind_filepaths["wind_u_layer"],
+                v_filepath=utm_wind_filepaths["wind_v_layer"],
+                utm_origin=utm_origin,
+            )
 
-        fds_case = FDSCase(
-            feedback=feedback,
-            path=fds_path,
-            name=chid,
-            utm_crs=utm_crs,
-            wgs84_origin=wgs84_origin,
-            pixel_size=pixel_size,
-            dem_layer=dem_layer,
-            domain=domain,
-            terrain=terrain,
-            texture=texture,
-            wind=wind,
-        )
-        fds_case.save()
+        # Prepare DEVCs over the terrain, shared by all scenarios
+        devcs = None
+        if utm_devc_layer:
+            devcs = DEVCs(
+                feedback=feedback,
+                utm_devc_layer=utm_devc_layer,
+                utm_origin=utm_origin,
+                grid=terrain.grid,
+            )
+
+        # Prepare the scenarios, as (chid, fire_layer, utm_fire_layers, wind)
+        if not sweep.scenarios:
+            utm_fire_layers = fire_layer and (utm_fire_layer, utm_b_fire_layer)
+            scenarios = ((chid, fire_layer, utm_fire_layers, wind),)
+        else:
+            scenarios = self._get_sweep_scenarios(
+                context,
+                feedback,
+                sweep=sweep,
+                fire_layer=self.parameterAsVectorLayer(
+                    parameters, "fire_layer", context
+                ),
+                wind_filepath=wind_filepath,
+                wind_tolerances=wind_tolerances,
+                project_path=project_path,
+                utm_crs=utm_crs,
+                pixel_size=pixel_size,
+            )
+
+        # Prepare domain and fds_case for each scenario
+        texture = None
+        for nscenario, (
+            case_chid,
+            case_fire_layer,
+            case_utm_fire_layers,
+            case_wind,
+        ) in enumerate(scenarios):
+            if sweep.scenarios:
+                feedback.setProgressText(
+                    f"\nScenario {nscenario + 1}/{len(scenarios)} <{case_chid}>..."
+                )
+                self._set_sweep_fire_layer(
+                    context,
+                    feedback,
+                    terrain=terrain,
+                    sampling_layer=sampling_layer,
+                    landuse_type=landuse_type,
+                    fire_layer=case_fire_layer,
+                    utm_fire_layers=case_utm_fire_layers,
+                )
+                terrain.set_name(case_chid)
+                if wind_field:
+                    wind_field.set_name(case_chid)
+
+            if feedback.isCanceled():
+                return {}
+
+            fine_extent = None
+            if refine_buffer is not None:
+                if case_utm_fire_layers:
+                    fine_extent = case_utm_fire_layers[0].extent().buffered(
+                        refine_buffer
+                    )
+                else:
+                    feedback.reportError("No fire layer, uniform MESH resolution.")
+
+            domain = Domain(
+                feedback=feedback,
+                utm_crs=utm_crs,
+                utm_extent=utm_extent,
+                utm_origin=utm_origin,
+                wgs84_origin=wgs84_origin,
+                min_z=terrain.min_z,
+                max_z=terrain.max_z,
+                cell_size=cell_size,
+                nmesh=nmesh,
+                terrain_following=terrain_following,
+                grid=terrain.grid,
+                fine_extent=fine_extent,
+                downwind_directions=case_wind.directions,
+                downwind_length=refine_downwind,
+                fft_snap=fft_snap,
+            )
+
+            # Estimate the simulation cost, before writing
+
+            cost = CostEstimate(
+                feedback=feedback,
+                domain=domain,
+                nfaces=terrain.nfaces,
+                nobsts=terrain.nobsts,
+                max_wind_speed=case_wind.max_speed,
+                max_ncell=max_ncell,
+            )
+
+            # Render the texture once, shared by all scenarios
+            if not texture:
+                texture = Texture(
+                    feedback=feedback,
+                    path=fds_path,
+                    name=chid,
+                    image_type="png",
+                    pixel_size=tex_pixel_size,
+                    tex_layer=tex_layer,
+                    utm_extent=tex_extent,
+                    utm_crs=utm_crs,
+                    store_path=store_path,
+                    store_link=store_link,
+                )
+
+            fds_case = FDSCase(
+                feedback=feedback,
+                path=fds_path,
+                name=case_chid,
+                utm_crs=utm_crs,
+                wgs84_origin=wgs84_origin,
+                pixel_size=pixel_size,
+                dem_layer=dem_layer,
+                domain=domain,
+                terrain=terrain,
+                texture=texture,
+                wind=case_wind,
+                cost=cost,
+                devcs=devcs,
+                wind_field=wind_field,
+                qgis_filepath=project.fileName(),
+            )
+
+            # Save the texture, terrain, and FDS case files concurrently,
+            # the FDS case waits for the files it refers to.
+            # All files are saved before the next scenario updates the terrain
+            with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+                futures = (
+                    texture.save_async(executor),
+                    terrain.save_async(executor, domain=domain),
+                    executor.submit(fds_case.save),
+                )
+                utils.wait_futures(futures)
+            if not futures[-1].result():
+                return {}  # canceled
 
         return results
 
+    def _get_sweep_scenarios(
+        self,
+        context,
+        feedback,
+        sweep,
+        fire_layer,
+        wind_filepath,
+        wind_tolerances,
+        project_path,
+        utm_crs,
+        pixel_size,
+    ):
+        """!
+        Get the scenario sweep cases.
+        Empty fire layers and wind files fall back to the algorithm parameters.
+        @return list of (chid, fire_layer, utm_fire_layers, wind).
+        """
+        from . import algos
+        from .types import Wind
+
+        scenarios, utm_fire_layers, winds = list(), dict(), dict()
+        for case_chid, case_fire_layer, case_wind_filepath in sweep.scenarios:
+            # Fire layer, reprojected once
+            if case_fire_layer:
+                layer = QgsProcessingUtils.mapLayerFromString(case_fire_layer, context)
+                if not layer or not layer.crs().isValid():
+                    raise QgsProcessingException(
+                        f"Scenario <{case_chid}> fire layer <{case_fire_layer}> is not valid, cannot proceed."
+                    )
+            else:
+                layer = fire_layer
+            if layer and layer.id() not in utm_fire_layers:
+                utm_fire_layers[layer.id()] = algos.get_utm_fire_layers(
+                    context,
+                    feedback,
+                    fire_layer=layer,
+                    destination_crs=utm_crs,
+                    pixel_size=pixel_size,
+                )
+            # Wind, imported once
+            case_wind_filepath = case_wind_filepath or wind_filepath
+            if case_wind_filepath not in winds:
+                winds[case_wind_filepath] = Wind(
+                    feedback=feedback,
+                    project_path=project_path,
+                    filepath=case_wind_filepath,
+                    speed_tolerance=wind_tolerances["wind_speed_tolerance"],
+                    direction_tolerance=wind_tolerances["wind_direction_tolerance"],
+                )
+            scenarios.append(
+                (
+                    case_chid,
+                    layer,
+                    layer and utm_fire_layers[layer.id()],
+                    winds[case_wind_filepath],
+                )
+            )
+        return scenarios
+
+    def _set_sweep_fire_layer(
+        self,
+        context,
+        feedback,
+        terrain,
+        sampling_layer,
+        landuse_type,
+        fire_layer,
+        utm_fire_layers,
+    ):
+        """!
+        Set the scenario fire layer bcs in the sampling layer and in the terrain.
+        """
+        from . import algos
+
+        if fire_layer and terrain.landuse_layer:
+            algos.set_sampling_layer_fire_bc(
+                context,
+                feedback,
+                sampling_layer=sampling_layer.id(),
+                landuse_type=landuse_type,
+                utm_fire_layer=utm_fire_layers[0],
+                utm_b_fire_layer=utm_fire_layers[1],
+            )
+            terrain.set_fire_layer(fire_layer)
+        else:
+            terrain.set_fire_layer(None)
+
     def name(self):
         """!
         Returns the algorithm name.
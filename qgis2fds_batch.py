@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+
+"""qgis2fds"""
+
+__author__ = "Emanuele Gissi"
+__date__ = "2020-05-04"
+__copyright__ = "(C) 2020 by Emanuele Gissi"
+__revision__ = "$Format:%H$"  # replaced with git SHA1
+
+# Headless batch runner, for exporting many FDS cases without the QGIS GUI.
+#
+# Usage:
+#   QT_QPA_PLATFORM=offscreen python3 qgis2fds_batch.py jobs.json
+#
+# The jobs file is a list of jobs, or a dict with common "defaults" and "jobs".
+# Each job is a dict of the qgis2fds algorithm parameters
+# (layers by file path, or by name when a "project" file is set), and:
+#   "project": optional QGIS project file, read into a throw away project
+#   "crs": project CRS, when no project file is set (default "EPSG:4326")
+# Relative paths, starting with ".", are relative to the jobs file folder;
+# the algorithm defaults are relative to the project file folder, if set.
+#
+# For regional tiling, the jobs file dict contains a "tiling" section:
+#   "region": region polygon layer filepath
+#   "tile_size": tile size in meters
+#   "overlap": tile overlap in meters (default 0.)
+# and each job is tiled: its jobs are the tiles intersecting the region, exported in
+# their own UTM zone, with chid "<chid>_<row>_<col>" in "<fds_path>/<chid>".
+#
+# Jobs run across a pool of processes with the -p option.
+# A summary index of the produced cases and their timings is saved as
+# "<jobs file name>_index.csv", with the tile geometry as WKT in EPSG:4326.
+#
+# [
+#   {
+#     "chid": "case_a",
+#     "fds_path": "./case_a",
+#     "extent": "6.5,6.6,45.1,45.2 [EPSG:4326]",
+#     "dem_layer": "./dem.tif",
+#     "landuse_layer": "./landuse.tif",
+#     "landuse_type_filepath": "./Landfire.gov_F13.csv",
+#     "fire_layer": "./fire.gpkg",
+#     "wind_filepath": "./wind.csv"
+#   },
+#   ...
+# ]
+
+import os, sys
+
+# The plugin folder contains the types package,
+# that would shadow the types module of the Python standard library
+_plugin_path = os.path.dirname(os.path.abspath(__file__))
+sys.path = [p for p in sys.path if os.path.abspath(p or ".") != _plugin_path]
+
+import argparse, csv, importlib.util, json, multiprocessing, time, traceback
+from math import ceil
+
+
+def import_plugin():
+    """!
+    Import the plugin package as qgis2fds, whatever its folder name.
+    @return the plugin package.
+    """
+    if "qgis2fds" in sys.modules:
+        return sys.modules["qgis2fds"]
+    spec = importlib.util.spec_from_file_location(
+        "qgis2fds",
+        os.path.join(_plugin_path, "__init__.py"),
+        submodule_search_locations=[_plugin_path],
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["qgis2fds"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def init_qgis():
+    """!
+    Init QGIS and processing once, without the GUI and iface.
+    @return the QGIS application and the qgis2fds algorithm id.
+    """
+    from qgis.core import QgsApplication
+
+    app = QgsApplication([], False)
+    app.initQgis()
+
+    # processing is a core plugin, not on the default path
+    sys.path.append(os.path.join(QgsApplication.pkgDataPath(), "python", "plugins"))
+    from processing.core.Processing import Processing
+
+    Processing.initialize()
+
+    import_plugin()
+    from qgis2fds.qgis2fds_provider import qgis2fdsProvider
+
+    provider = qgis2fdsProvider()
+    QgsApplication.processingRegistry().addProvider(provider)
+    return app, provider.algorithms()[0].id()
+
+
+def read_jobs(filepath):
+    """!
+    Read the jobs file.
+    @param filepath: jobs *.json filepath
+    @return the list of jobs, with defaults applied, and the tiling section.
+    """
+    with open(filepath) as f:
+        content = json.load(f)
+    if isinstance(content, dict):
+        defaults, jobs = content.get("defaults", {}), content.get("jobs", [])
+        tiling = content.get("tiling")
+    else:
+        defaults, jobs, tiling = {}, content, None
+    if tiling:
+        jobs = jobs or [{}]
+    return [{**defaults, **job} for job in jobs], tiling
+
+
+def get_tile_jobs(job, tiling, base_path):
+    """!
+    Get the tile jobs covering a region polygon layer.
+    Each tile is exported in its own UTM zone, set by its centroid.
+    Tile metadata are in the job keys starting with "_".
+    @param job: dict of common algorithm parameters
+    @param tiling: dict with region, tile_size, and overlap
+    @param base_path: folder of relative paths
+    @return the list of tile jobs.
+    """
+    from qgis.core import (
+        QgsVectorLayer,
+        QgsGeometry,
+        QgsRectangle,
+        QgsPointXY,
+        QgsProject,
+        QgsCoordinateReferenceSystem,
+        QgsCoordinateTransform,
+    )
+    from qgis2fds.types import utils
+
+    region_filepath = os.path.join(base_path, tiling["region"])
+    tile_size = float(tiling["tile_size"])
+    overlap = float(tiling.get("overlap", 0.0))
+    if tile_size <= 0.0 or not 0.0 <= overlap < tile_size:
+        raise Exception(f"Invalid tile size <{tile_size}> or overlap <{overlap}>.")
+
+    # Get the region geometry
+    region_layer = QgsVectorLayer(region_filepath, "region", "ogr")
+    if not region_layer.isValid():
+        raise Exception(f"Cannot read region layer <{region_filepath}>.")
+    region = QgsGeometry.unaryUnion([f.geometry() for f in region_layer.getFeatures()])
+
+    # Cut the tiles in the region UTM crs
+    wgs84_crs = QgsCoordinateReferenceSystem("EPSG:4326")
+    tc = QgsProject.instance().transformContext()
+    region.transform(QgsCoordinateTransform(region_layer.crs(), wgs84_crs, tc))
+    c = region.centroid().asPoint()
+    region_crs = QgsCoordinateReferenceSystem(utils.lonlat_to_epsg(lon=c.x(), lat=c.y()))
+    to_region_tr = QgsCoordinateTransform(wgs84_crs, region_crs, tc)
+    to_wgs84_tr = QgsCoordinateTransform(region_crs, wgs84_crs, tc)
+    region.transform(to_region_tr)
+    bbox = region.boundingBox()
+
+    chid, fds_path = job.get("chid", "tile"), job.get("fds_path", "./")
+    step = tile_size - overlap
+    nrows = max(ceil((bbox.height() - overlap) / step), 1)
+    ncols = max(ceil((bbox.width() - overlap) / step), 1)
+    jobs = list()
+    for row in range(nrows):
+        for col in range(ncols):
+            x0, y1 = bbox.xMinimum() + col * step, bbox.yMaximum() - row * step
+            tile = QgsRectangle(x0, y1 - tile_size, x0 + tile_size, y1)
+            if not region.intersects(QgsGeometry.fromRect(tile)):
+                continue
+            center = to_wgs84_tr.transform(tile.center())
+            tile_crs = utils.lonlat_to_epsg(lon=center.x(), lat=center.y())
+            wgs84_tile = QgsGeometry.fromRect(tile)
+            wgs84_tile.transform(to_wgs84_tr)
+            tile_chid = f"{chid}_{row:03d}_{col:03d}"
+            jobs.append(
+                {
+                    **job,
+                    "chid": tile_chid,
+                    "fds_path": os.path.join(fds_path, tile_chid),
+                    "extent": f"{tile.xMinimum()},{tile.xMaximum()},{tile.yMinimum()},{tile.yMaximum()} [{region_crs.authid()}]",
+                    "origin": f"{tile.center().x()},{tile.center().y()} [{region_crs.authid()}]",
+                    "_utm_crs": tile_crs,
+                    "_wkt": wgs84_tile.asWkt(),
+                }
+            )
+    print(f"{len(jobs)} tiles of {nrows} · {ncols} intersect the region", flush=True)
+    return jobs
+
+
+def run_job(alg_id, job, base_path, verbose=False):
+    """!
+    Run a single export job in a throw away QGIS project.
+    @param alg_id: qgis2fds algorithm id
+    @param job: dict of algorithm parameters
+    @param base_path: folder of relative paths
+    @param verbose: print the algorithm feedback
+    @return the algorithm results.
+    """
+    import processing
+    from qgis.core import (
+        QgsProject,
+        QgsProcessingContext,
+        QgsProcessingFeedback,
+        QgsCoordinateReferenceSystem,
+    )
+
+    # Throw away project, no side effects on saved projects
+    params = {k: v for k, v in job.items() if not k.startswith("_")}
+    project = QgsProject()
+    project_filepath = params.pop("project", None)
+    crs = params.pop("crs", "EPSG:4326")
+    if project_filepath:
+        project_filepath = os.path.join(base_path, project_filepath)
+        if not project.read(project_filepath):
+            raise Exception(f"Cannot read QGIS project <{project_filepath}>.")
+    else:
+        project.setCrs(QgsCoordinateReferenceSystem(crs))
+        # Unsaved, the algorithm defaults are relative to the jobs file folder
+        project.setFileName(os.path.join(base_path, "qgis2fds_batch.qgz"))
+
+    # Resolve relative file paths from the jobs file folder,
+    # the read project keeps its own filename, stamped in the FDS case
+    for key, value in params.items():
+        if isinstance(value, str) and value.startswith("."):
+            params[key] = os.path.normpath(os.path.join(base_path, value))
+
+    class PrintFeedback(QgsProcessingFeedback):
+        def pushInfo(self, info):
+            if verbose:
+                print(info, flush=True)
+
+        def reportError(self, error, fatalError=False):
+            print(f"Error: {error}", file=sys.stderr, flush=True)
+
+    context = QgsProcessingContext()
+    context.setProject(project)
+    feedback = PrintFeedback()
+    return processing.run(alg_id, params, context=context, feedback=feedback)
+
+
+def _run_timed_job(alg_id, i, njobs, job, base_path, verbose):
+    """Run a job, and return (chid, status, elapsed time in s)."""
+    chid = job.get("chid", f"job{i}")
+    print(f"Job {i + 1}/{njobs} <{chid}>...", flush=True)
+    t0 = time.time()
+    try:
+        run_job(alg_id=alg_id, job=job, base_path=base_path, verbose=verbose)
+        status = "ok"
+    except Exception as err:
+        traceback.print_exc()
+        status = f"error: {err}"
+    dt = time.time() - t0
+    print(f"Job {i + 1}/{njobs} <{chid}> {status} in {dt:.1f} s", flush=True)
+    return chid, status, dt
+
+
+# Each pool worker process inits QGIS once, as QGIS cannot be forked
+
+_worker = dict()
+
+
+def _init_worker():
+    _worker["app"], _worker["alg_id"] = init_qgis()
+
+
+def _run_worker_job(args):
+    return _run_timed_job(_worker["alg_id"], *args)
+
+
+def run_jobs(alg_id, jobs, base_path, verbose=False, processes=1):
+    """!
+    Run the export jobs back to back, in the same process or in a process pool.
+    @param alg_id: qgis2fds algorithm id
+    @param jobs: list of dict of algorithm parameters
+    @param base_path: folder of relative paths
+    @param verbose: print the algorithm feedback
+    @param processes: number of pool processes
+    @return list of (chid, status, elapsed time in s).
+    """
+    args = [(i, len(jobs), job, base_path, verbose) for i, job in enumerate(jobs)]
+    if processes > 1:
+        with multiprocessing.get_context("spawn").Pool(
+            processes=processes, initializer=_init_worker
+        ) as pool:
+            return pool.map(_run_worker_job, args, chunksize=1)
+    return [_run_timed_job(alg_id, *a) for a in args]
+
+
+def write_index(filepath, jobs, summary):
+    """!
+    Write the summary index of the produced cases.
+    @param filepath: index *.csv filepath
+    @param jobs: list of dict of algorithm parameters
+    @param summary: list of (chid, status, elapsed time in s)
+    """
+    with open(filepath, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(("chid", "status", "time_s", "fds_path", "utm_crs", "wkt"))
+        for job, (chid, status, dt) in zip(jobs, summary):
+            writer.writerow(
+                (
+                    chid,
+                    status,
+                    f"{dt:.1f}",
+                    job.get("fds_path", ""),
+                    job.get("_utm_crs", ""),
+                    job.get("_wkt", ""),
+                )
+            )
+    print(f"Summary index saved: <{filepath}>", flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Export many FDS cases with qgis2fds, without the QGIS GUI."
+    )
+    parser.add_argument("jobs_filepath", help="jobs *.json file")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print feedback")
+    parser.add_argument(
+        "-p", "--processes", type=int, default=1, help="number of pool processes"
+    )
+    args = parser.parse_args(argv)
+
+    jobs_filepath = os.path.abspath(args.jobs_filepath)
+    base_path = os.path.dirname(jobs_filepath)
+    jobs, tiling = read_jobs(jobs_filepath)
+    t0 = time.time()
+    app, alg_id = init_qgis()
+    print(f"QGIS and processing ready in {time.time() - t0:.1f} s", flush=True)
+
+    if tiling:
+        chids = [job.get("chid", "tile") for job in jobs]
+        if len(set(chids)) < len(chids):
+            raise Exception("Tiled jobs need distinct chids.")
+        jobs = [
+            tile_job
+            for job in jobs
+            for tile_job in get_tile_jobs(job=job, tiling=tiling, base_path=base_path)
+        ]
+
+    summary = run_jobs(
+        alg_id=alg_id,
+        jobs=jobs,
+        base_path=base_path,
+        verbose=args.verbose,
+        processes=args.processes,
+    )
+    write_index(
+        filepath=f"{os.path.splitext(jobs_filepath)[0]}_index.csv",
+        jobs=jobs,
+        summary=summary,
+    )
+    nerrors = sum(status != "ok" for _, status, _ in summary)
+    print(f"{len(summary) - nerrors} jobs ok, {nerrors} errors, in {time.time() - t0:.1f} s")
+    app.exitQgis()
+    return nerrors and 1 or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
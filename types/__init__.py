@@ -7,9 +7,12 @@ __date__ = "2020-05-04"
 __copyright__ = "(C) 2020 by Emanuele Gissi"
 __revision__ = "$Format:%H$"  # replaced with git SHA1
 
+from .cost import CostEstimate
+from .devc import DEVCs
 from .domain import Domain
 from .fds import FDSCase
 from .landuse import LanduseType
+from .sweep import Sweep
 from .terrain import GEOMTerrain, OBSTTerrain
 from .texture import Texture
-from .wind import Wind
+from .wind import Wind, WindField
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+"""qgis2fds"""
+
+__author__ = "Emanuele Gissi"
+__date__ = "2020-05-04"
+__copyright__ = "(C) 2020 by Emanuele Gissi"
+__revision__ = "$Format:%H$"  # replaced with git SHA1
+
+from qgis.core import QgsProcessingException
+
+
+class CostEstimate:
+    """
+    Estimate the FDS simulation cost, before exporting the case.
+    Each MESH is assigned to its own MPI process.
+    Calibrate the class attributes on your cluster.
+    """
+
+    bytes_per_cell = 1.0e3  # FDS memory per cell
+    bytes_per_face = 1.0e3  # FDS memory per GEOM face, on each process
+    bytes_per_obst = 5.0e2  # FDS memory per OBST, on each process
+    seconds_per_cell_step = 1.0e-6  # FDS wall clock per cell per time step
+    cfl = 0.95  # FDS target CFL number
+    min_velocity = 1.0  # min velocity for the CFL limited time step, m/s
+
+    def __init__(
+        self,
+        feedback,
+        domain,
+        nfaces,
+        nobsts,
+        max_wind_speed,
+        max_ncell=None,
+    ) -> None:
+        feedback.pushInfo("Estimate FDS simulation cost...")
+        self.feedback = feedback
+
+        # Cells
+        meshes = domain.meshes
+        self.nmesh = len(meshes)
+        self.ncell = sum(ijk[0] * ijk[1] * ijk[2] for ijk, _ in meshes)
+        self.max_mesh_ncell = max(ijk[0] * ijk[1] * ijk[2] for ijk, _ in meshes)
+
+        # Memory on the most loaded MPI process
+        self.memory_per_process = (
+            self.max_mesh_ncell * self.bytes_per_cell
+            + nfaces * self.bytes_per_face
+            + nobsts * self.bytes_per_obst
+        )
+
+        # CFL limited time step on the smallest cell
+        min_cell_size = min(
+            min((xb[1] - xb[0]) / ijk[0], (xb[3] - xb[2]) / ijk[1], (xb[5] - xb[4]) / ijk[2])
+            for ijk, xb in meshes
+        )
+        velocity = max(max_wind_speed or 0.0, self.min_velocity)
+        self.time_step = self.cfl * min_cell_size / velocity
+
+        # Wall clock per simulated minute, limited by the most loaded MPI process
+        nsteps = 60.0 / self.time_step
+        self.wall_clock = nsteps * self.max_mesh_ncell * self.seconds_per_cell_step
+
+        feedback.pushInfo(self.get_comment())
+
+        # Check budget
+        if max_ncell and self.ncell > max_ncell:
+            raise QgsProcessingException(
+                f"FDS cell number {self.ncell:d} exceeds the {max_ncell:d} cell budget, cannot proceed."
+            )
+
+    def get_comment(self) -> str:
+        return f"""\
+Cost estimate: {self.ncell:d} cells in {self.nmesh:d} MPI processes
+  memory per MPI process: {self.memory_per_process / 1e9:.2f} GB
+  CFL limited time step: {self.time_step:.3f} s
+  wall clock per simulated minute: {self.wall_clock / 60.:.1f} min
+"""
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""qgis2fds"""
+
+__author__ = "Emanuele Gissi"
+__date__ = "2020-05-04"
+__copyright__ = "(C) 2020 by Emanuele Gissi"
+__revision__ = "$Format:%H$"  # replaced with git SHA1
+
+import numpy as np
+from qgis.core import NULL
+from .. import core
+
+
+class DEVCs:
+    """!
+    FDS DEVCs placed above the terrain, from the vertices of a DEVCs layer in UTM.
+    Each feature can set the attributes:
+    devc_id (str), quantity (str, multiple separated by ;), and agl (float, in meters).
+    """
+
+    quantity_default = "TEMPERATURE"
+    agl_default = 2.0  # m
+
+    def __init__(self, feedback, utm_devc_layer, utm_origin, grid) -> None:
+        """!
+        @param feedback: pyqgis feedback
+        @param utm_devc_layer: DEVCs layer, in UTM
+        @param utm_origin: domain origin, in UTM
+        @param grid: the terrain Grid, see core.terrain
+        """
+        self.feedback = feedback
+        self.name = utm_devc_layer.name()
+        self._ids, self._quantities, self._xyzs = list(), list(), None
+        self._init_devcs(utm_devc_layer, utm_origin, grid)
+
+    def _init_devcs(self, layer, utm_origin, grid) -> None:
+        """Init the DEVCs, the terrain z of all points is looked up at once."""
+        feedback = self.feedback
+        feedback.pushInfo(f"Prepare DEVCs from <{self.name}> layer...")
+        fields = layer.fields()
+        id_idx = fields.indexOf("devc_id")
+        quantity_idx = fields.indexOf("quantity")
+        agl_idx = fields.indexOf("agl")
+        if quantity_idx == -1 or agl_idx == -1:
+            feedback.pushInfo(
+                f"No quantity or agl attributes, default quantity=<{self.quantity_default}>, agl=<{self.agl_default}>."
+            )
+
+        # Collect the vertices, eg. multipoints or the lines of fuel-breaks
+        ox, oy = utm_origin.x(), utm_origin.y()
+        xs, ys, agls, names, quantities = list(), list(), list(), list(), list()
+        for f in layer.getFeatures():
+            a = f.attributes()
+            name = f"DEVC{f.id():05d}"
+            if id_idx != -1 and a[id_idx] != NULL and str(a[id_idx]):
+                name = str(a[id_idx]).replace("'", "")
+            quantity = self.quantity_default
+            if quantity_idx != -1 and a[quantity_idx] != NULL and a[quantity_idx]:
+                quantity = str(a[quantity_idx])
+            quantity = [q.strip().replace("'", "") for q in quantity.split(";")]
+            quantity = [q for q in quantity if q]
+            agl = self.agl_default
+            if agl_idx != -1 and a[agl_idx] != NULL:
+                agl = float(a[agl_idx])
+            vertices = list(f.geometry().vertices())
+            for iv, v in enumerate(vertices):
+                xs.append(v.x() - ox)
+                ys.append(v.y() - oy)
+                agls.append(agl)
+                names.append(len(vertices) > 1 and f"{name}_{iv:03d}" or name)
+                quantities.append(quantity)
+
+        # Look up the terrain z, all at once
+        x, y = np.array(xs, dtype=np.float64), np.array(ys, dtype=np.float64)
+        z = core.terrain.get_point_z(grid, x, y) + np.array(agls, dtype=np.float64)
+        outside = np.isnan(z)
+        if outside.any():
+            feedback.reportError(
+                f"{int(outside.sum())} DEVC points outside the terrain, not exported."
+            )
+        inside = np.flatnonzero(~outside)
+        self._xyzs = np.column_stack((x, y, z))[inside]
+        self._ids = [names[i] for i in inside.tolist()]
+        self._quantities = [quantities[i] for i in inside.tolist()]
+        feedback.pushInfo(f"{len(self._ids)} DEVC points ready.")
+
+    @property
+    def ndevcs(self) -> int:
+        """The number of FDS DEVCs."""
+        return sum(len(qs) for qs in self._quantities)
+
+    def get_fds(self) -> str:
+        return "".join(self.get_fds_chunks())
+
+    def get_fds_chunks(self):
+        """Yield the FDS text by chunks, the DEVCs can be thousands."""
+        yield f"""
+DEVCs from <{self.name}> layer ({self.ndevcs} DEVCs)
+"""
+        i = 0
+        for name, quantities, xyz in zip(self._ids, self._quantities, self._xyzs):
+            for q in quantities:
+                devc_id = len(quantities) > 1 and f"{name}_{q}" or name
+                line = f"&DEVC ID='{devc_id}' XYZ={xyz[0]:.2f},{xyz[1]:.2f},{xyz[2]:.2f} QUANTITY='{q}' /"
+                yield i and f"\n{line}" or line
+                i += 1
+        yield "\n"
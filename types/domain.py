@@ -7,11 +7,15 @@ __date__ = "2020-05-04"
 __copyright__ = "(C) 2020 by Emanuele Gissi"
 __revision__ = "$Format:%H$"  # replaced with git SHA1
 
-from math import sqrt
+from qgis.core import QgsProcessingException
+from .. import core
 from . import utils
 
 
 class Domain:
+
+    fft_tolerance = 0.05  # max relative change of MESH J and K for the FFT snap
+
     def __init__(
         self,
         feedback,
@@ -23,12 +27,21 @@ class Domain:
         max_z,
         cell_size,
         nmesh,
+        terrain_following=False,
+        grid=None,
+        fine_extent=None,
+        downwind_directions=None,
+        downwind_length=None,
+        fft_snap=False,
     ) -> None:
         feedback.pushInfo("Init MESH...")
 
         self.feedback = feedback
         self.utm_extent = utm_extent
         self.utm_origin = utm_origin
+        self.cell_size = cell_size
+        self._fft_snap = fft_snap
+        self._j_unsnapped = None  # uniform layout MESH J before the FFT snap
 
         # Calc domain XB, relative to origin,
         # and a little smaller than the terrain
@@ -41,36 +54,6 @@ class Domain:
             max_z + cell_size * 10,  # 10 cells over max z
         )
 
-        # Calc number of MESH along x and y
-        ratio = abs((dom_xb[1] - dom_xb[0]) / (dom_xb[3] - dom_xb[2]))
-        nmesh_y = round(sqrt(nmesh / ratio))
-        nmesh_x = int(nmesh / nmesh_y)
-
-        # Calc MESH XB
-        m_xb = (
-            dom_xb[0],
-            dom_xb[0] + (dom_xb[1] - dom_xb[0]) / nmesh_x,
-            dom_xb[2],
-            dom_xb[2] + (dom_xb[3] - dom_xb[2]) / nmesh_y,
-            dom_xb[4],
-            dom_xb[5],
-        )
-        m_xb = [round(x, 2) for x in m_xb]
-
-        # Calc MESH IJK
-        m_ijk = (
-            int((m_xb[1] - m_xb[0]) / cell_size),
-            int((m_xb[3] - m_xb[2]) / cell_size),
-            int((m_xb[5] - m_xb[4]) / cell_size),
-        )
-
-        # Calc MESH MULT DX DY
-        mult_dx, mult_dy = m_xb[1] - m_xb[0], m_xb[3] - m_xb[2]
-
-        # Calc MESH size and cell number
-        mesh_sizes = [m_xb[1] - m_xb[0], m_xb[3] - m_xb[2], m_xb[5] - m_xb[4]]
-        ncell = m_ijk[0] * m_ijk[1] * m_ijk[2]
-
         # Prepare comment string
         utm_crs_desc = utm_crs.description()
         utm_origin_desc = f"{utm_origin.x():.1f}E {utm_origin.y():.1f}N"
@@ -84,8 +67,135 @@ Domain origin: {utm_origin_desc}
 Domain extent: {domain_extent_desc}
 """
 
+        # Prepare the list of MESH, as (ijk, xb)
+        try:
+            if fine_extent:
+                fine_xb = (
+                    fine_extent.xMinimum() - utm_origin.x(),
+                    fine_extent.xMaximum() - utm_origin.x(),
+                    fine_extent.yMinimum() - utm_origin.y(),
+                    fine_extent.yMaximum() - utm_origin.y(),
+                )
+                if downwind_length:
+                    fine_xb = core.domain.get_downwind_xb(
+                        xb=fine_xb,
+                        directions=downwind_directions,
+                        length=downwind_length,
+                    )
+                    self._comment += f"Fire refinement downwind corridor: {downwind_length:.1f}m\n"
+                self._init_multires_meshes(dom_xb=dom_xb, fine_xb=fine_xb, nmesh=nmesh)
+            else:
+                self._init_uniform_meshes(dom_xb=dom_xb, nmesh=nmesh)
+        except ValueError as err:
+            raise QgsProcessingException(f"{err} Cannot proceed.")
+
+        # Fit the MESH to the terrain
+        if terrain_following:
+            if grid is None:
+                raise QgsProcessingException(
+                    "Terrain following MESHes need the terrain grid, cannot proceed."
+                )
+            self._fit_meshes_to_terrain(grid=grid, min_z=min_z, max_z=max_z)
+
+        # Snap MESH J and K to FFT friendly numbers
+        if fft_snap:
+            self._snap_meshes_to_fft()
+
+        self.ncell = core.domain.get_ncell(self.meshes)
+
         # Prepare fds string
-        self._fds = f"""
+        if self._mult:
+            self._fds = self._get_fds_mult()
+        else:
+            self._fds = self._get_fds_meshes()
+
+    def _init_uniform_meshes(self, dom_xb, nmesh) -> None:
+        """Init the uniform MESH layout, as a MULT of equal MESHes."""
+        self.meshes, self._mult, self._j_unsnapped, halo = (
+            core.domain.get_uniform_meshes(
+                dom_xb=dom_xb,
+                cell_size=self.cell_size,
+                nmesh=nmesh,
+                fft_snap=self._fft_snap,
+                fft_tolerance=self.fft_tolerance,
+            )
+        )
+        nmesh_x, nmesh_y = self._mult[:2]
+        self.feedback.pushInfo(
+            f"MESH decomposition: {nmesh_x:d} · {nmesh_y:d}, halo surface of {halo:d} cell faces."
+        )
+        self._comment += (
+            f"MESH decomposition: {nmesh_x:d} · {nmesh_y:d} of {nmesh:d} requested\n"
+        )
+        # The smaller FFT snap of J cuts the domain at its north edge
+        m_ijk, m_xb = self.meshes[0]
+        if self._j_unsnapped and m_ijk[1] < self._j_unsnapped:
+            lost = (self._j_unsnapped - m_ijk[1]) * nmesh_y * self.cell_size
+            self.feedback.reportError(
+                f"FFT friendly MESH J: domain reduced by {lost:.1f}m at its north edge, to y={m_xb[2] + self._mult[3] * nmesh_y:.1f}m."
+            )
+            self._comment += f"FFT friendly MESH J: domain reduced by {lost:.1f}m at its north edge\n"
+
+    # Fire focused multi-resolution MESH layout, see core.domain
+
+    def _init_multires_meshes(self, dom_xb, fine_xb, nmesh) -> None:
+        """Init the fire focused multi-resolution MESH layout."""
+        self.feedback.pushInfo("Init fire focused multi-resolution MESHes...")
+        cs = self.cell_size
+        meshes, nfine, ncell_fine = core.domain.get_multires_meshes(
+            dom_xb=dom_xb, fine_xb=fine_xb, cell_size=cs, nmesh=nmesh
+        )
+        self._mult = None
+        self.meshes = meshes
+        ncell = core.domain.get_ncell(meshes)
+        max_ncell = max(ijk[0] * ijk[1] * ijk[2] for ijk, _ in meshes)
+        self._comment += f"Multi-resolution MESH decomposition: {nfine:d} fine MESHes of {cs:.1f}m cells, {len(meshes) - nfine:d} coarse MESHes of {cs * 2.0:.1f}m cells, for {nmesh:d} MPI processes\n"
+        self.feedback.pushInfo(
+            f"Multi-resolution MESHes: {ncell} cells, {ncell_fine - ncell} cells saved over the uniform fine layout."
+        )
+        self.feedback.pushInfo(
+            f"MPI load: {max_ncell} cells in the largest MESH, {max_ncell * len(meshes) / ncell:.2f} times the mean."
+        )
+
+    # Terrain following MESH columns, see core.domain.
+    # The exposed MESH tops and sides are OPEN.
+
+    def _fit_meshes_to_terrain(self, grid, min_z, max_z) -> None:
+        """Fit each MESH column to the terrain below it."""
+        self.feedback.pushInfo("Fit MESH columns to the terrain...")
+        ncell_uniform = core.domain.get_ncell(self.meshes)
+        self.meshes = core.domain.fit_meshes_to_terrain(
+            meshes=self.meshes, grid=grid, min_z=min_z, max_z=max_z
+        )
+        self._mult = None
+
+        ncell = core.domain.get_ncell(self.meshes)
+        saved = ncell_uniform - ncell
+        self._comment += f"Terrain following MESHes: {saved:d} cells saved over the uniform layout of {ncell_uniform:d} cells\n"
+        self.feedback.pushInfo(
+            f"Terrain following MESHes: {ncell} cells, {saved} cells saved ({saved / ncell_uniform * 100.:.1f}%) over the uniform layout."
+        )
+
+    def _snap_meshes_to_fft(self) -> None:
+        """Snap the MESH K to the next FFT friendly number, and report the speedup."""
+        self.feedback.pushInfo("Snap MESH J and K to FFT friendly numbers...")
+        self.meshes, speedup = core.domain.snap_meshes_to_fft(
+            meshes=self.meshes,
+            j_unsnapped=self._j_unsnapped,
+            tolerance=self.fft_tolerance,
+        )
+        self._comment += f"FFT friendly MESH J and K: expected pressure solver speedup {speedup:.2f}x\n"
+        self.feedback.pushInfo(
+            f"FFT friendly MESH J and K: expected pressure solver speedup {speedup:.2f}x."
+        )
+
+    def _get_fds_mult(self) -> str:
+        """Get the FDS text of the uniform MESH layout."""
+        nmesh_x, nmesh_y, mult_dx, mult_dy = self._mult
+        m_ijk, m_xb = self.meshes[0]
+        mesh_sizes = [m_xb[1] - m_xb[0], m_xb[3] - m_xb[2], m_xb[5] - m_xb[4]]
+        ncell = m_ijk[0] * m_ijk[1] * m_ijk[2]
+        return f"""
 Domain and its boundary conditions
 {nmesh_x:d} · {nmesh_y:d} meshes of {mesh_sizes[0]:.1f}m · {mesh_sizes[1]:.1f}m · {mesh_sizes[2]:.1f}m size and {ncell:d} cells each
 &MULT ID='Meshes'
@@ -98,14 +208,93 @@ Domain and its boundary conditions
 &VENT ID='Domain BC YMIN' DB='YMIN' SURF_ID='OPEN' /
 &VENT ID='Domain BC YMAX' DB='YMAX' SURF_ID='OPEN' /
 &VENT ID='Domain BC ZMAX' DB='ZMAX' SURF_ID='OPEN' /
+{self._get_fds_devcs()}"""
+
+    def _get_fds_meshes(self) -> str:
+        """Get the FDS text of a generic MESH layout."""
+        meshes = self.meshes
+        mesh_strs, vent_strs = list(), list()
+        for im, (ijk, xb) in enumerate(meshes):
+            mesh_strs.append(
+                f"&MESH ID='Mesh{im:03d}' IJK={ijk[0]:d},{ijk[1]:d},{ijk[2]:d}\n      XB={xb[0]:.2f},{xb[1]:.2f},{xb[2]:.2f},{xb[3]:.2f},{xb[4]:.2f},{xb[5]:.2f} /"
+            )
 
+        # OPEN MESH tops, when not at the domain top
+        top_z = max(xb[5] for _, xb in meshes)
+        for im, (_, xb) in enumerate(meshes):
+            if xb[5] < top_z:
+                vent_strs.append(
+                    f"&VENT ID='Mesh{im:03d} BC ZMAX' XB={xb[0]:.2f},{xb[1]:.2f},{xb[2]:.2f},{xb[3]:.2f},{xb[5]:.2f},{xb[5]:.2f} SURF_ID='OPEN' /"
+                )
+
+        # OPEN MESH sides, where a MESH is taller than its neighbour
+        for (im, (_, xb)), (jm, (_, nxb)) in (
+            (a, b) for a in enumerate(meshes) for b in enumerate(meshes)
+        ):
+            z0, z1 = nxb[5], xb[5]
+            if z1 <= z0:
+                continue
+            y0, y1 = max(xb[2], nxb[2]), min(xb[3], nxb[3])
+            if y1 > y0:
+                for side, x in (("XMIN", xb[0]), ("XMAX", xb[1])):
+                    if abs(x - (nxb[1] if side == "XMIN" else nxb[0])) < 1e-3:
+                        vent_strs.append(
+                            f"&VENT ID='Mesh{im:03d} BC {side} Mesh{jm:03d}' XB={x:.2f},{x:.2f},{y0:.2f},{y1:.2f},{z0:.2f},{z1:.2f} SURF_ID='OPEN' /"
+                        )
+            x0, x1 = max(xb[0], nxb[0]), min(xb[1], nxb[1])
+            if x1 > x0:
+                for side, y in (("YMIN", xb[2]), ("YMAX", xb[3])):
+                    if abs(y - (nxb[3] if side == "YMIN" else nxb[2])) < 1e-3:
+                        vent_strs.append(
+                            f"&VENT ID='Mesh{im:03d} BC {side} Mesh{jm:03d}' XB={x0:.2f},{x1:.2f},{y:.2f},{y:.2f},{z0:.2f},{z1:.2f} SURF_ID='OPEN' /"
+                        )
+
+        mesh_str, vent_str = "\n".join(mesh_strs), "\n".join(vent_strs)
+        return f"""
+Domain and its boundary conditions
+{len(meshes):d} meshes and {self.ncell:d} cells
+{mesh_str}
+&VENT ID='Domain BC XMIN' DB='XMIN' SURF_ID='OPEN' /
+&VENT ID='Domain BC XMAX' DB='XMAX' SURF_ID='OPEN' /
+&VENT ID='Domain BC YMIN' DB='YMIN' SURF_ID='OPEN' /
+&VENT ID='Domain BC YMAX' DB='YMAX' SURF_ID='OPEN' /
+&VENT ID='Domain BC ZMAX' DB='ZMAX' SURF_ID='OPEN' /{vent_str and chr(10) + vent_str}
+{self._get_fds_devcs()}"""
+
+    def _get_fds_devcs(self) -> str:
+        """Get the FDS text of the wind rose at domain origin."""
+        # Wind rose in the MESH containing the origin
+        origin_z = self.meshes[0][1][5]
+        for _, xb in self.meshes:
+            if xb[0] <= 0.0 <= xb[1] and xb[2] <= 0.0 <= xb[3]:
+                origin_z = xb[5]
+                break
+        return f"""
 Wind rose at domain origin
-&DEVC ID='Origin_UV' XYZ=0.,0.,{(m_xb[5]-.1):.2f} QUANTITY='U-VELOCITY' /
-&DEVC ID='Origin_VV' XYZ=0.,0.,{(m_xb[5]-.1):.2f} QUANTITY='V-VELOCITY' /
-&DEVC ID='Origin_WV' XYZ=0.,0.,{(m_xb[5]-.1):.2f} QUANTITY='W-VELOCITY' /"""
+&DEVC ID='Origin_UV' XYZ=0.,0.,{(origin_z-.1):.2f} QUANTITY='U-VELOCITY' /
+&DEVC ID='Origin_VV' XYZ=0.,0.,{(origin_z-.1):.2f} QUANTITY='V-VELOCITY' /
+&DEVC ID='Origin_WV' XYZ=0.,0.,{(origin_z-.1):.2f} QUANTITY='W-VELOCITY' /"""
+
+    @property
+    def fds_meshes(self):
+        """The MESHes in the FDS order, the MULT copies vary along x first."""
+        if self._mult:
+            nmesh_x, nmesh_y = self._mult[:2]
+            return [
+                self.meshes[i * nmesh_y + j]
+                for j in range(nmesh_y)
+                for i in range(nmesh_x)
+            ]
+        return self.meshes
 
     def get_comment(self) -> str:
-        return self._comment
+        mesh_strs = "\n".join(
+            f"  Mesh{im:03d} IJK={ijk[0]:d},{ijk[1]:d},{ijk[2]:d} cells={ijk[0] * ijk[1] * ijk[2]:d}"
+            for im, (ijk, _) in enumerate(self.fds_meshes)
+        )
+        return f"""{self._comment}MESH cells: {self.ncell:d}
+{mesh_strs}
+"""
 
     def get_fds(self) -> str:
         return self._fds
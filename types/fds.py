@@ -8,8 +8,7 @@ __copyright__ = "(C) 2020 by Emanuele Gissi"
 __revision__ = "$Format:%H$"  # replaced with git SHA1
 
 import time, os
-from qgis.core import Qgis, QgsProject
-from qgis.utils import pluginMetadata
+from qgis.core import Qgis
 from . import utils
 
 
@@ -27,6 +26,10 @@ class FDSCase:
         terrain,
         texture,
         wind,
+        cost=None,
+        devcs=None,
+        wind_field=None,
+        qgis_filepath=None,
     ) -> None:
         self.feedback = feedback
         self.name = name  # chid
@@ -38,15 +41,23 @@ class FDSCase:
         self.terrain = terrain
         self.texture = texture
         self.wind = wind
+        self.cost = cost
+        self.devcs = devcs
+        self.wind_field = wind_field
+        self.qgis_filepath = qgis_filepath  # of the exported project
 
         self.filename = f"{name}.fds"
         self.filepath = os.path.join(path, self.filename)
 
     def get_fds(self):
+        return "".join(self.get_fds_chunks())
+
+    def get_fds_chunks(self):
+        """Yield the FDS case text by chunks, section by section."""
         # Init
-        plugin_version = pluginMetadata("qgis2fds", "version")
+        plugin_version = utils.get_plugin_version()
         qgis_version = Qgis.QGIS_VERSION.encode("ascii", "ignore").decode("ascii")
-        qgis_filepath = QgsProject.instance().fileName() or "not saved"
+        qgis_filepath = self.qgis_filepath or "not saved"
         date = time.strftime("%a, %d %b %Y, %H:%M:%S", time.localtime())
 
         landuse_layer_desc = f"{self.terrain.landuse_layer and self.terrain.landuse_layer.name() or 'none'}"
@@ -54,22 +65,23 @@ class FDSCase:
         fire_layer_desc = (
             f"{self.terrain.fire_layer and self.terrain.fire_layer.name() or 'none'}"
         )
+        devc_layer_desc = f"{self.devcs and self.devcs.name or 'none'}"
         wind_filepath = (
             f"{self.wind.filepath and utils.shorten(self.wind.filepath) or 'none'}"
         )
 
         # Prepare fds case
-        return f"""\
+        yield f"""\
 ! Generated by qgis2fds {plugin_version} on QGIS {qgis_version}
 ! QGIS file: {utils.shorten(qgis_filepath)}
 ! Date: {date}
-{self.domain.get_comment()}
+{self.domain.get_comment()}{self.cost and self.cost.get_comment() or ''}{self.terrain.get_comment()}
 Desired resolution: {self.pixel_size:.1f}m
 DEM layer: {self.dem_layer.name()}
 Landuse layer: {landuse_layer_desc}
 Landuse type file: {landuse_type_filepath}
 Fire layer: {fire_layer_desc}
-FDS DEVCs layer: FIXME
+FDS DEVCs layer: {devc_layer_desc}
 Wind file: {wind_filepath}
 
 &HEAD CHID='{self.name}' TITLE='Description of {self.name}' /
@@ -92,24 +104,37 @@ MISC LEVEL_SET_MODE parameter
 Example REAC, used when LEVEL_SET_MODE=4
 _REAC ID='Wood' SOOT_YIELD=0.005 O=2.5 C=3.4 H=6.2
       HEAT_OF_COMBUSTION=17700. /
-{self.domain.get_fds()}
-{self.terrain.landuse_type.get_fds()}
+"""
+        yield self.domain.get_fds()
+        yield f"""
+{self.terrain.landuse_type.get_fds(surf_keys=self.terrain.surf_keys)}
 
 Output quantities
 &SLCF AGL_SLICE=5. QUANTITY='LEVEL SET VALUE' /
 &SLCF AGL_SLICE=5. QUANTITY='TEMPERATURE' VECTOR=T /
 &SLCF PBX={0.:.2f} QUANTITY='TEMPERATURE' VECTOR=T /
 &SLCF PBY={0.:.2f} QUANTITY='TEMPERATURE' VECTOR=T /
-{self.wind.get_fds()}
-{self.terrain.get_fds()}
+"""
+        yield from self.wind.get_fds_chunks()
+        yield "\n"
+        if self.wind_field:
+            yield from self.wind_field.get_fds_chunks(domain=self.domain)
+        if self.devcs:
+            yield from self.devcs.get_fds_chunks()
+        yield from self.terrain.get_fds_chunks(domain=self.domain)
+        yield """
 
 &TAIL /
 """
 
     def save(self):
+        """!
+        Stream the fds case to its file, atomically.
+        @return True if saved, False if canceled.
+        """
         self.feedback.pushInfo(f"Write the fds case to <{self.filepath}>...")
-        utils.write_file(
+        return utils.write_file_chunks(
             feedback=self.feedback,
             filepath=self.filepath,
-            content=self.get_fds(),
+            chunks=self.get_fds_chunks(),
         )
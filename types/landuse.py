@@ -72,15 +72,28 @@ class LanduseType:
     def get_comment(self) -> str:
         return f"Landuse type file: <{self.filepath and utils.shorten(self.filepath) or 'none'}>"
 
-    def get_fds(self) -> str:
-        res = "\n".join(self.surf_dict.values())
+    def get_fds(self, surf_keys=None) -> str:
+        """!
+        Get the FDS text of the SURFs.
+        @param surf_keys: the landuses of the used SURFs, if None all of them.
+        """
+        surf_keys = self.surf_dict if surf_keys is None else surf_keys
+        res = "\n".join(self.surf_dict[k] for k in surf_keys if k in self.surf_dict)
         return f"""
 Landuse boundary conditions
 {res or 'none'}"""
 
     @property
     def surf_id_str(self):
-        return ",".join((f"'{s}'" for s in self.surf_id_dict.values()))
+        return self.get_surf_id_str()
+
+    def get_surf_id_str(self, surf_keys=None) -> str:
+        """!
+        Get the FDS SURF_ID list.
+        @param surf_keys: the landuses of the used SURFs, if None all of them.
+        """
+        surf_keys = self.surf_id_dict if surf_keys is None else surf_keys
+        return ",".join((f"'{self.surf_id_dict[k]}'" for k in surf_keys))
 
     @property
     def bc_out_default(self) -> str:
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+"""qgis2fds"""
+
+__author__ = "Emanuele Gissi"
+__date__ = "2020-05-04"
+__copyright__ = "(C) 2020 by Emanuele Gissi"
+__revision__ = "$Format:%H$"  # replaced with git SHA1
+
+import csv, os
+from qgis.core import QgsProcessingException
+
+
+class Sweep:
+    def __init__(self, feedback, project_path, filepath) -> None:
+        self.feedback = feedback
+        self.filepath = filepath and os.path.join(project_path, filepath) or str()
+        self.scenarios = list()
+
+        # Check
+        if not filepath:
+            return
+        self.feedback.pushInfo(f"Import scenario sweep *.csv file: <{self.filepath}>")
+
+        # Import
+        try:
+            with open(self.filepath) as csv_file:
+                # sweep csv file has an header line and three columns:
+                # chid, fire layer (name, id, or filepath), and wind *.csv filepath
+                # Empty fire layer or wind filepath use the algorithm parameters
+                csv_reader = csv.reader(csv_file, delimiter=",")
+                next(csv_reader)  # skip header line
+                for r in csv_reader:
+                    if not r:
+                        continue
+                    r = [c.strip() for c in r] + ["", ""]
+                    if not r[0]:
+                        raise QgsProcessingException("Empty scenario chid.")
+                    self.scenarios.append((r[0], r[1], r[2]))
+        except Exception as err:
+            raise QgsProcessingException(
+                f"Cannot import scenario sweep *.csv file: <{self.filepath}>:\n{err}"
+            )
+        if len(set(s[0] for s in self.scenarios)) != len(self.scenarios):
+            raise QgsProcessingException(
+                f"Duplicated chid in scenario sweep *.csv file not allowed."
+            )
+        self.feedback.pushInfo(f"{len(self.scenarios)} scenarios imported.")
@@ -7,9 +7,10 @@ __date__ = "2020-05-04"
 __copyright__ = "(C) 2020 by Emanuele Gissi"
 __revision__ = "$Format:%H$"  # replaced with git SHA1
 
-import os
+import os, itertools
 import numpy as np
 from qgis.core import QgsProcessingException
+from .. import core
 from . import utils
 
 
@@ -24,6 +25,12 @@ class GEOMTerrain:
         fire_layer,
         path,
         name,
+        store_path=None,
+        store_link=False,
+        max_memory=None,
+        tolerance=None,
+        split=False,
+        matrix=False,
     ) -> None:
         self.feedback = feedback
         self.sampling_layer = sampling_layer
@@ -32,10 +39,21 @@ class GEOMTerrain:
         self.landuse_type = landuse_type
         self.fire_layer = fire_layer
 
-        self._filename = f"{name}_terrain.bingeom"
-        self._filepath = os.path.join(path, self._filename)
-
-        self._m = None
+        self._path = path
+        self.set_name(name)
+        self._store_path = store_path
+        self._store_link = store_link
+        self._max_bytes = max_memory and max_memory * 2**20 or None
+        self._chunk_bytes = None
+        self._tolerance = tolerance
+        self._simplified = None
+        self._surf_counts = None
+        self._split = split
+        self._matrix = matrix
+        self._pieces = None
+        self._future = None
+
+        self._grid = None
         self.min_z = 0.0
         self.max_z = 0.0
         self._init_matrix()
@@ -43,43 +61,14 @@ class GEOMTerrain:
         if self.feedback.isCanceled():
             return {}
 
-        self._faces = list()
-        self._landuses = list()
-        self._init_faces_and_landuses()
-
-        if self.feedback.isCanceled():
-            return {}
+        self._inject_ghost_centers()
 
-        self._verts = list()
-        self._init_verts()
-
-    # The layer is a flat list of quad faces center points (z, x, y, landuse)
-    # ordered by column. The original flat list is cut in columns, when three consecutive points
-    # form an angle < 180°.
-    # The returned matrix is a topological 2D representation of them by row (when transposed).
-
-    # Same column:  following column:
-    #      first ·            first · · current
-    #            |                  | ^
-    #            |                  | |
-    #       prev ·                  | |
-    #            |                  |/
-    #    current ·             prev ·
-
-    # matrix:    j
-    #      o   o   o   o   o
-    #        ·   ·   ·   ·
-    #      o   *---*   o   o
-    # row    · | · | ·   ·   i
-    #      o   *---*   o   o
-    #        ·   ·   ·   ·
-    #      o   o   o   o   o
-    #
-    # · center points of quad faces
-    # o verts
+    # The sampling layer is a flat list of quad faces center points (x, y, z, landuse)
+    # ordered by column, see core.terrain.
+    # Only z and landuse are stored, x and y are implicit in the Grid.
 
     def _init_matrix(self) -> None:
-        """Init the matrix from the sampling layer."""
+        """Init the terrain grid from the sampling layer."""
         self.feedback.pushInfo("Init the matrix of sampling points...")
         self.feedback.setProgress(0)
 
@@ -87,214 +76,494 @@ class GEOMTerrain:
         sampling_layer = self.sampling_layer
         nfeatures = sampling_layer.featureCount()
         partial_progress = nfeatures // 100 or 1
-        m = np.empty((nfeatures, 4))  # allocate the np array
         ox, oy = self.utm_origin.x(), self.utm_origin.y()  # get origin
 
-        # Fill the array with point coordinates, points are listed by column
-        # calc min and max z
-        min_z, max_z = 1e6, -1e6
+        # Check the memory budget, and use the compact layout if exceeded
+        z_dtype = np.float64
+        if self._max_bytes:
+            footprint = core.terrain.get_footprint(nfeatures)
+            if footprint > self._max_bytes:
+                z_dtype = np.float32
+                self._chunk_bytes = max(
+                    self._max_bytes - core.terrain.get_grid_footprint(nfeatures, 4),
+                    1,
+                )
+                self.feedback.pushInfo(
+                    f"Estimated memory footprint {footprint / 2**20:.0f} MB over budget {self._max_bytes / 2**20:.0f} MB, use float32 z and process by row chunks."
+                )
+        z = np.empty(nfeatures, dtype=z_dtype)  # allocate the np arrays
+        landuses = np.zeros(nfeatures, dtype=np.int16)
+
+        # Fill the array with the z, points are listed by column,
+        # keep the x and y of the first column end only
+        p0 = p1 = p2 = None
+        column_len = None
         for i, f in enumerate(self.sampling_layer.getFeatures()):
             g = f.geometry().get()  # QgsPoint
-            z = g.z()
-            if z > max_z:
-                max_z = z
-            if z < min_z:
-                min_z = z
-            m[i] = (
-                g.x() - ox,  # x, relative to origin
-                g.y() - oy,  # y, relative to origin
-                g.z(),  # z absolute
-                0,  # for landuse
-            )
+            z[i] = g.z()  # z absolute
+            if column_len is None:
+                p = g.x() - ox, g.y() - oy  # x, y relative to origin
+                if i == 0:
+                    p0 = p
+                elif i == 1:
+                    p1 = p
+                elif core.terrain.is_column_end(p0, p1, p):
+                    column_len, p2 = i, p
             if i % partial_progress == 0:
                 self.feedback.setProgress(int(i / nfeatures * 100))
-        self.max_z, self.min_z = max_z, min_z
+        if nfeatures:
+            self.max_z, self.min_z = float(z.max()), float(z.min())
 
         # Fill the array with the landuse
         if self.landuse_layer:
             landuse_idx = self.sampling_layer.fields().indexOf("landuse1")
+            lu_info = np.iinfo(landuses.dtype)
             for i, f in enumerate(self.sampling_layer.getFeatures()):
                 a = f.attributes()
-                m[i][3] = a[landuse_idx] or 0
+                landuse = int(a[landuse_idx] or 0)
+                if not lu_info.min <= landuse <= lu_info.max:
+                    landuses = self._get_wider_landuses(landuses, landuse)
+                    lu_info = np.iinfo(landuses.dtype)
+                landuses[i] = landuse
                 if i % partial_progress == 0:
                     self.feedback.setProgress(int(i / nfeatures * 100))
 
+        self._landuses0 = landuses.copy()  # without the fire layer bcs
+
         # Fill the array with the fire layer bcs
         if self.fire_layer:
-            bc_idx = self.sampling_layer.fields().indexOf("bc")
-            for i, f in enumerate(self.sampling_layer.getFeatures()):
-                a = f.attributes()
-                if a[bc_idx]:
-                    m[i][3] = a[bc_idx]
-                if i % partial_progress == 0:
-                    self.feedback.setProgress(int(i / nfeatures * 100))
+            self._load_bcs(landuses)
 
-        # Get point column length
-        column_len = 2
-        p0, p1 = m[0, :2], m[1, :2]
-        v0 = p1 - p0
-        for p2 in m[2:, :2]:
-            v1 = p2 - p1
-            if abs(np.dot(v0, v1) / np.linalg.norm(v0) / np.linalg.norm(v1)) < 0.9:
-                break  # end of point column
-            column_len += 1
-
-        # Split matrix into columns list, get np array, and transpose
-        # Now points are by row
-        m = np.array(np.split(m, nfeatures // column_len)).transpose(1, 0, 2)
-        # Check
-        if m.shape[0] < 3 or m.shape[1] < 3:
+        # Split the points in columns, and get the grid by row
+        if p0 is None or p1 is None or p2 is None:
             raise QgsProcessingException(
-                f"[QGIS bug] Sampling matrix is too small: {m.shape[0]}x{m.shape[1]}"
+                f"[QGIS bug] Sampling matrix is too small: {nfeatures} points"
             )
-        self._m = m
+        self._column_len = column_len
+        try:
+            self._grid = core.terrain.get_grid(
+                x0=p0[0],
+                y0=p0[1],
+                dx=(p2[0] - p0[0], p2[1] - p0[1]),
+                dy=(p1[0] - p0[0], p1[1] - p0[1]),
+                z=z,
+                landuse=landuses,
+                column_len=column_len,
+            )
+        except ValueError as err:
+            raise QgsProcessingException(f"[QGIS bug] {err}")
+
+    def _get_wider_landuses(self, landuses, landuse):
+        """Get the landuses as int32, when a landuse does not fit in int16."""
+        if landuses.dtype == np.int16 and (
+            np.iinfo(np.int32).min <= landuse <= np.iinfo(np.int32).max
+        ):
+            self.feedback.pushInfo(f"Landuse <{landuse}> out of int16, use int32.")
+            return landuses.astype(np.int32)
+        raise QgsProcessingException(
+            f"Landuse <{landuse}> out of the supported range, cannot proceed."
+        )
+
+    def _load_bcs(self, landuses) -> None:
+        """Load the fire layer bcs from the sampling layer over the landuses."""
+        self.feedback.pushInfo("Load the fire layer bcs...")
+        nfeatures = self.sampling_layer.featureCount()
+        partial_progress = nfeatures // 100 or 1
+        bc_idx = self.sampling_layer.fields().indexOf("bc")
+        if bc_idx == -1:
+            return  # no bcs, eg. no landuse layer
+        lu_info = np.iinfo(landuses.dtype)
+        for i, f in enumerate(self.sampling_layer.getFeatures()):
+            a = f.attributes()
+            if a[bc_idx]:
+                bc = int(a[bc_idx])
+                if not lu_info.min <= bc <= lu_info.max:
+                    raise QgsProcessingException(
+                        f"Fire layer bc <{bc}> out of the landuse range, cannot proceed."
+                    )
+                landuses[i] = bc
+            if i % partial_progress == 0:
+                self.feedback.setProgress(int(i / nfeatures * 100))
+
+    def set_fire_layer(self, fire_layer) -> None:
+        """!
+        Set a new fire layer, sharing the terrain geometry.
+        Its bcs shall be already set in the sampling layer.
+        @param fire_layer: the new fire layer, or None.
+        """
+        self.fire_layer = fire_layer
+        landuses = self._landuses0.copy()
+        if fire_layer:
+            self._load_bcs(landuses)
+        # From the feature list by column to the grid by row
+        g = self._grid
+        g.landuse[1:-1, 1:-1] = landuses.reshape(-1, self._column_len).T
+        # Ghost centers copy the landuse of their neighbours
+        core.terrain.update_ghost_landuses(g)
+        self._update_landuses()
+
+    def set_name(self, name) -> None:
+        """!
+        Set a new name of the exported files.
+        @param name: the new name, eg. the chid.
+        """
+        self._name = name
+        self._filename = f"{name}_terrain.bingeom"
+        self._filepath = os.path.join(self._path, self._filename)
+        self._binary_file = self._filename
+        self._saved = False
+
+    def _update_landuses(self) -> None:
+        """Update the landuses from the grid."""
+        self._simplified = None  # GEOM face landuses are read from the grid
+        self._surf_counts = None
+        self._saved = False
 
     def _inject_ghost_centers(self):
-        """Inject ghost centers into the matrix."""
+        """Inject ghost centers into the grid."""
         feedback = self.feedback
         feedback.pushInfo("Inject ghost centers in matrix...")
         feedback.setProgress(0)
 
-        # Init displacements
-        dx, dy = self._m[0, 1] - self._m[0, 0], self._m[1, 0] - self._m[0, 0]
-        dx[2], dy[2] = 0.0, 0.0  # no z displacement
-        dx[3], dy[3] = 0.0, 0.0  # no landuse change
-
-        # Inject first row
-        row = tuple(c - dy for c in self._m[0, :])
-        self._m = np.insert(self._m, 0, row, axis=0)
+        self._grid = core.terrain.inject_ghost_centers(self._grid)
 
-        # Append last row
-        row = tuple((tuple(c + dy for c in self._m[-1, :]),))
-        self._m = np.append(self._m, row, axis=0)
+    # Adaptive simplification, see core.terrain.
+    # Simplified verts, faces, and landuses are not chunked.
 
-        # Inject first col
-        col = tuple(c - dx for c in self._m[:, 0])
-        self._m = np.insert(self._m, 0, col, axis=1)
-
-        # Append last col
-        col = tuple(
-            tuple((c + dx,) for c in self._m[:, -1]),
+    def _get_simplified(self):
+        """Get the simplified GEOM verts, faces, and landuses."""
+        if self._simplified is None:
+            self.feedback.pushInfo(
+                f"Simplify GEOM terrain, vertical tolerance {self._tolerance} m..."
+            )
+            self._simplified = core.terrain.get_simplified(
+                self._grid, tolerance=self._tolerance
+            )
+            nfaces = core.terrain.get_nfaces(self._grid)
+            self.feedback.pushInfo(
+                f"GEOM terrain faces reduced from {nfaces} to {len(self._simplified[1])}."
+            )
+        return self._simplified
+
+    @property
+    def nverts(self) -> int:
+        """The number of GEOM verts."""
+        if self._tolerance is not None:
+            return len(self._get_simplified()[0])
+        return core.terrain.get_nverts(self._grid)
+
+    @property
+    def nfaces(self) -> int:
+        """The number of GEOM faces."""
+        if self._tolerance is not None:
+            return len(self._get_simplified()[1])
+        return core.terrain.get_nfaces(self._grid)
+
+    @property
+    def nobsts(self) -> int:
+        """The number of OBSTs."""
+        return 0
+
+    @property
+    def grid(self):
+        """The terrain grid of z and landuse by row, with ghost centers."""
+        return self._grid
+
+    # Only the FDS SURFs of the landuses present in the grid are used,
+    # and the GEOM face SURF indexes are densely remapped to them.
+    # Unknown landuses are set to the first SURF.
+
+    _count_name = "faces"
+
+    def _get_landuse_counts(self):
+        """Get the present landuses and their GEOM face counts."""
+        if self._tolerance is not None:
+            return core.terrain.get_landuse_counts(self._get_simplified()[2])
+        landuses, counts = core.terrain.get_landuse_counts(
+            self._grid.landuse[1:-1, 1:-1]
         )
-        self._m = np.append(self._m, col, axis=1)
+        return landuses, counts * 2  # two faces for each center
+
+    def _get_surf_counts(self) -> dict:
+        """Get the counts by used SURF landuse, in SURF_ID order."""
+        if self._surf_counts is None:
+            surf_keys = list(self.landuse_type.surf_id_dict)
+            landuses, counts = self._get_landuse_counts()
+            counts = dict(zip(landuses.tolist(), counts.tolist()))
+            surf_counts = {k: counts.pop(k) for k in surf_keys if k in counts}
+            if counts:  # unknown landuses
+                n0 = surf_counts.pop(surf_keys[0], 0) + sum(counts.values())
+                surf_counts = {surf_keys[0]: n0, **surf_counts}
+            self._surf_counts = surf_counts
+        return self._surf_counts
+
+    @property
+    def surf_keys(self) -> list:
+        """The landuses of the used FDS SURFs, in SURF_ID order."""
+        return list(self._get_surf_counts())
+
+    def get_comment(self) -> str:
+        surf_id_dict = self.landuse_type.surf_id_dict
+        surf_counts = self._get_surf_counts()
+        surf_strs = "\n".join(
+            f"  {surf_id_dict[k]} (landuse {k}): {n} {self._count_name}"
+            for k, n in surf_counts.items()
+        )
+        return f"""Terrain SURFs: {len(surf_counts)} of {len(surf_id_dict)} used
+{surf_strs}
+"""
 
-    def _init_faces_and_landuses(self):
-        """Init GEOM faces and landuses."""
-        self.feedback.pushInfo("Init GEOM faces and their landuses...")
-        self.feedback.setProgress(0)
-        m = self._m
-        len_vrow = m.shape[0]
-        len_vcol = m.shape[1] + 1  # vert matrix is larger
-        for i, row in enumerate(m):
-            for j, p in enumerate(row):
-                self._faces.extend(
-                    (
-                        (
-                            self._get_vert_index(i, j, len_vcol),  # 1st face
-                            self._get_vert_index(i + 1, j, len_vcol),
-                            self._get_vert_index(i, j + 1, len_vcol),
-                        ),
-                        (
-                            self._get_vert_index(i + 1, j + 1, len_vcol),  # 2nd face
-                            self._get_vert_index(i, j + 1, len_vcol),
-                            self._get_vert_index(i + 1, j, len_vcol),
-                        ),
-                    )
+    # The GEOM verts, faces and surfs are streamed to the bingeom file by row chunks,
+    # so they are never held in memory all together, when over the memory budget
+
+    def _get_verts_chunks(self):
+        """Yield the GEOM verts by row chunks."""
+        if self._tolerance is not None:
+            yield self._get_simplified()[0]
+            return
+        g = self._grid
+        nrows, ncols = g.shape
+        for i0, i1 in core.terrain.get_row_chunks(
+            nrows - 1, ncols - 1, self._chunk_bytes
+        ):
+            yield core.terrain.get_verts(g, i0, i1)
+
+    def _get_faces_chunks(self):
+        """Yield the GEOM faces by row chunks."""
+        if self._tolerance is not None:
+            yield self._get_simplified()[1]
+            return
+        nrows, ncols = self._grid.shape[0] - 2, self._grid.shape[1] - 2
+        for i0, i1 in core.terrain.get_row_chunks(nrows, ncols, self._chunk_bytes):
+            yield core.terrain.get_faces(nrows, ncols, i0, i1)
+
+    def _get_surfs_chunks(self, surf_keys):
+        """Yield the GEOM face SURF indexes by row chunks."""
+        g = self._grid
+        nrows, ncols = g.shape[0] - 2, g.shape[1] - 2
+        unknowns = set()
+        if self._tolerance is not None:
+            landuses_chunks = (self._get_simplified()[2],)
+        else:
+            landuses_chunks = (
+                core.terrain.get_face_landuses(g, i0, i1)
+                for i0, i1 in core.terrain.get_row_chunks(
+                    nrows, ncols, self._chunk_bytes
                 )
-                lu = int(p[3])
-                self._landuses.extend((lu, lu))
-            self.feedback.setProgress(int(i / len_vrow * 100))
-
-    # First inject ghost centers all around the vertices
-    # then extract the vertices by averaging the neighbour centers coordinates
-
-    # · centers of quad faces  + ghost centers
-    # o verts  * cs  x vert
-    #
-    #           dx       j
-    #          + > +   +   +   +   +  first ghost row
-    #       dy v o---o---o---o---o
-    #          + | · | · | · | · | +  i center
-    #            o---o---x---o---o    i vert
-    #          + | · | · | · | · | +  i+1 center
-    #            o---o---o---o---o
-    #          +   +   +   +   +   +  last ghost row (skipped)
-
-    def _init_verts(self):
-        """Init verts as average of surrounding centers."""
-        self.feedback.pushInfo("Init GEOM verts...")
-        self.feedback.setProgress(0)
+            )
+        for landuses in landuses_chunks:
+            fds_surfs, unknown = core.terrain.get_surf_indexes(
+                landuses=landuses, surf_keys=surf_keys
+            )
+            unknowns |= unknown
+            yield fds_surfs
+        for lu in sorted(unknowns):
+            self.feedback.reportError(f"Unknown landuse index <{lu}>, setting <0>.")
+
+    def _save_bingeom_file(
+        self, filename, n_verts, n_faces, verts_chunks, faces_chunks, surfs_chunks
+    ) -> str:
+        """!
+        Save a bingeom file, in the shared store if set.
+        @return the BINARY_FILE reference for the FDS case.
+        """
+        n_surf_id = len(self.surf_keys)
 
-        self._inject_ghost_centers()
-        m = self._m
-        ncenters = m.shape[0] * m.shape[1]
-        partial_progress = ncenters // 100 or 1
-        # Skip last row and last col
-        for ip, idxs in enumerate(np.ndindex(m.shape[0] - 1, m.shape[1] - 1)):
-            i, j = idxs
-            self._verts.append(
-                (m[i, j, :3] + m[i + 1, j, :3] + m[i, j + 1, :3] + m[i + 1, j + 1, :3])
-                / 4.0
+        # Write bingeom
+        def save(filepath):
+            return utils.write_bingeom(
+                feedback=self.feedback,
+                filepath=filepath,
+                geom_type=2,
+                n_surf_id=n_surf_id,
+                n_verts=n_verts,
+                n_faces=n_faces,
+                verts_chunks=verts_chunks,
+                faces_chunks=faces_chunks,
+                surfs_chunks=surfs_chunks,
+                hashed=bool(self._store_path),
             )
-            if ip % partial_progress == 0:
-                self.feedback.setProgress(int(ip / ncenters * 100))
 
-    #        j   j  j+1
-    #        *<------* i
-    #        | f1 // |
-    # faces  |  /·/  | i
-    #        | // f2 |
-    #        *------>* i+1
+        if not self._store_path:
+            save(os.path.join(self._path, filename))
+            return filename
 
-    def _get_vert_index(self, i, j, len_vcol):
-        """Get vert index in FDS notation."""
-        return i * len_vcol + j + 1  # F90 indexes start from 1
+        # Write bingeom once in the shared store, keyed by its content
+        store_filepath = utils.save_hashed_to_store(
+            feedback=self.feedback,
+            store_path=self._store_path,
+            ext=".bingeom",
+            save=save,
+        )
+        return utils.link_from_store(
+            feedback=self.feedback,
+            store_filepath=store_filepath,
+            path=self._path,
+            filename=filename,
+            hard_link=self._store_link,
+        )
 
     def _save_bingeom(self) -> None:
         """Save the bingeom file."""
-
-        # Format in fds notation
-        fds_verts = tuple(v for vs in self._verts for v in vs)
-        fds_faces = tuple(f for fs in self._faces for f in fs)
-        fds_surfs = list()
-
         # Translate landuse_layer landuses into FDS SURF index
-        surf_id_list = list(self.landuse_type.surf_id_dict)
-        n_surf_id = len(surf_id_list)
-        for i, _ in enumerate(self._faces):
-            lu = self._landuses[i]
-            try:
-                fds_surfs.append(surf_id_list.index(lu) + 1)  # +1 for F90
-            except ValueError:
-                self.feedback.reportError(f"Unknown landuse index <{lu}>, setting <0>.")
-                fds_surfs.append(1)  # 0 + 1 for F90
-        fds_surfs = tuple(fds_surfs)
-
-        # Write bingeom
-        utils.write_bingeom(
-            feedback=self.feedback,
-            filepath=self._filepath,
-            geom_type=2,
-            n_surf_id=n_surf_id,
-            fds_verts=fds_verts,
-            fds_faces=fds_faces,
-            fds_surfs=fds_surfs,
-            fds_volus=list(),
+        surf_keys = self.surf_keys
+        self._binary_file = self._save_bingeom_file(
+            filename=self._filename,
+            n_verts=self.nverts,
+            n_faces=self.nfaces,
+            verts_chunks=self._get_verts_chunks(),
+            faces_chunks=self._get_faces_chunks(),
+            surfs_chunks=self._get_surfs_chunks(surf_keys),
         )
 
+    # Split of the GEOM terrain by MESH, see core.terrain.
+    # Each MPI process reads the piece of its own MESH only.
+    # The pieces are built in one go, and are not chunked.
+
+    def _save_bingeom_pieces(self, domain) -> list:
+        """!
+        Save a bingeom file for each MESH.
+        @param domain: the Domain
+        @return list of (MESH index, BINARY_FILE reference, nverts, nfaces).
+        """
+        self.feedback.pushInfo("Split GEOM terrain by MESH...")
+        verts = np.concatenate(tuple(self._get_verts_chunks()))
+        faces = np.concatenate(tuple(self._get_faces_chunks()))
+        surf_keys = self.surf_keys
+        surfs = np.concatenate(tuple(self._get_surfs_chunks(surf_keys)))
+        meshes = domain.fds_meshes  # pieces numbered in the FDS MESH order
+        mesh_idxs = core.terrain.get_face_meshes(
+            verts=verts, faces=faces, mesh_xbs=[xb for _, xb in meshes]
+        )
+        pieces = list()
+        for im in range(len(meshes)):
+            face_idxs = np.flatnonzero(mesh_idxs == im)
+            if not face_idxs.size:
+                continue  # no terrain in this MESH
+            piece_verts, piece_faces = core.terrain.get_piece(
+                verts=verts, faces=faces, face_idxs=face_idxs
+            )
+            binary_file = self._save_bingeom_file(
+                filename=self._filename.replace(".bingeom", f"_{im:03d}.bingeom"),
+                n_verts=len(piece_verts),
+                n_faces=len(piece_faces),
+                verts_chunks=(piece_verts,),
+                faces_chunks=(piece_faces,),
+                surfs_chunks=(surfs[face_idxs],),
+            )
+            pieces.append((im, binary_file, len(piece_verts), len(piece_faces)))
+        return pieces
+
+    # The terrain files are saved by save(),
+    # possibly in a worker thread by save_async()
+
+    def save(self, domain=None) -> None:
+        """!
+        Save the bingeom file, or a bingeom file for each MESH.
+        @param domain: the Domain, to split the GEOM terrain by MESH.
+        """
+        if self._split and domain:
+            self._pieces = self._save_bingeom_pieces(domain)
+        else:
+            self._pieces = None
+            self._save_bingeom()
+        if self._matrix:
+            self._save_matrix()
+        self._saved = True
+
+    def save_async(self, executor, domain=None):
+        """!
+        Save the terrain files in a worker thread.
+        @param executor: concurrent.futures executor
+        @param domain: the Domain, to split the terrain by MESH.
+        @return the future.
+        """
+        self._future = executor.submit(self.save, domain)
+        return self._future
+
+    def _wait_saved(self, domain=None) -> None:
+        """Wait for the terrain files saved by save_async, or save them now."""
+        if self._future:
+            future, self._future = self._future, None
+            utils.wait_futures((future,))
+        elif not self._saved:
+            self.save(domain)
+
+    # The terrain matrix is saved for post-processing without QGIS,
+    # see core.matrix
+
+    def _save_matrix(self) -> None:
+        """Save the terrain matrix .npz and GeoTIFF files, without ghost centers."""
+        g = self._grid
+        grid = core.terrain.Grid(
+            x0=g.x0 + g.dx[0] + g.dy[0],
+            y0=g.y0 + g.dx[1] + g.dy[1],
+            dx=g.dx,
+            dy=g.dy,
+            z=g.z[1:-1, 1:-1],
+            landuse=self._landuses0.reshape(-1, self._column_len).T,
+        )
+        landuse = g.landuse[1:-1, 1:-1]
+        bc = np.where(landuse != grid.landuse, landuse, 0).astype(landuse.dtype)
+        origin = self.utm_origin.x(), self.utm_origin.y()
+        crs = self.sampling_layer.crs().toWkt()
+        for ext, write in (
+            ("npz", core.matrix.write_matrix),
+            ("tif", core.matrix.write_geotiff),
+        ):
+            filepath = os.path.join(self._path, f"{self._name}_terrain.{ext}")
+            self.feedback.pushInfo(f"Save terrain matrix file: <{filepath}>")
+            try:
+                write(filepath, grid=grid, bc=bc, origin=origin, crs=crs)
+            except ImportError as err:
+                self.feedback.reportError(
+                    f"GDAL not available, terrain matrix GeoTIFF not saved.\n{err}"
+                )
+            except (OSError, ValueError, RuntimeError) as err:
+                raise QgsProcessingException(
+                    f"Terrain matrix file not writable to <{filepath}>, cannot proceed.\n{err}"
+                )
 
-
-    def get_fds(self) -> str:
-        """Get the FDS text and save."""
-        self._save_bingeom()
+    def get_fds_chunks(self, domain=None):
+        """!
+        Yield the FDS text by chunks, and save.
+        @param domain: the Domain, to split the GEOM terrain by MESH.
+        """
+        yield self.get_fds(domain=domain)
+
+    def get_fds(self, domain=None) -> str:
+        """!
+        Get the FDS text and save.
+        @param domain: the Domain, to split the GEOM terrain by MESH.
+        """
+        self._wait_saved(domain)
+        if self._pieces is not None:
+            return self._get_fds_pieces()
         self.feedback.pushInfo(f"GEOM terrain ready.")
         return f"""
-Terrain ({len(self._verts)} verts, {len(self._faces)} faces)
+Terrain ({self.nverts} verts, {self.nfaces} faces)
 &GEOM ID='Terrain'
-      SURF_ID={self.landuse_type.surf_id_str}
-      BINARY_FILE='{self._filename}'
+      SURF_ID={self.landuse_type.get_surf_id_str(self.surf_keys)}
+      BINARY_FILE='{self._binary_file}'
       IS_TERRAIN=T EXTEND_TERRAIN=F /"""
 
+    def _get_fds_pieces(self) -> str:
+        """Get the FDS text of the GEOM terrain split by MESH."""
+        pieces = self._pieces
+        geom_strs = list()
+        for im, binary_file, nverts, nfaces in pieces:
+            geom_strs.append(
+                f"""&GEOM ID='Terrain{im:03d}'
+      SURF_ID={self.landuse_type.get_surf_id_str(self.surf_keys)}
+      BINARY_FILE='{binary_file}'
+      IS_TERRAIN=T EXTEND_TERRAIN=F /  Mesh{im:03d}: {nverts} verts, {nfaces} faces"""
+            )
+        self.feedback.pushInfo(f"GEOM terrain ready, in {len(pieces)} pieces.")
+        geom_str = "\n".join(geom_strs)
+        return f"""
+Terrain ({self.nfaces} faces, split by MESH in {len(pieces)} pieces)
+{geom_str}"""
+
 
 # OBST terrain
 
@@ -308,8 +577,14 @@ class OBSTTerrain(GEOMTerrain):
         landuse_layer,
         landuse_type,
         fire_layer,
-        path=None,  # unused
-        name=None,  # unused
+        path=None,
+        name=None,
+        store_path=None,  # unused
+        store_link=False,  # unused
+        max_memory=None,  # unused
+        tolerance=None,  # unused
+        split=False,  # unused
+        matrix=False,
     ) -> None:
         self.feedback = feedback
         self.sampling_layer = sampling_layer
@@ -318,7 +593,17 @@ class OBSTTerrain(GEOMTerrain):
         self.landuse_type = landuse_type
         self.fire_layer = fire_layer
 
+        self._path = path
+        self.set_name(name)
+        self._catf_strs = None
+        self._surf_counts = None
+        self._matrix = matrix
+        self._future = None
+        self._tolerance = None  # OBSTs are not simplified
+
         # Init
+        self._max_bytes = None
+        self._chunk_bytes = None
         self.min_z = 0.0
         self.max_z = 0.0
 
@@ -331,46 +616,136 @@ class OBSTTerrain(GEOMTerrain):
         self._inject_ghost_centers()
         self._init_obsts()
 
+    def set_name(self, name) -> None:
+        """!
+        Set a new name of the exported files.
+        @param name: the new name, eg. the chid.
+        """
+        self._name = name
+        self._saved = False
+
+    def _update_landuses(self) -> None:
+        """Update the OBSTs from the matrix."""
+        self._init_obsts()
+        self._surf_counts = None
+        self._saved = False
+
     def _init_obsts(self):
-        """Get the formatted OBSTs from sampling layer."""
+        """Get the OBSTs from sampling layer."""
         feedback = self.feedback
         feedback.pushInfo("Prepare OBSTs...")
         feedback.setProgress(0)
-        m = self._m
-        _obsts = list()
-
-        # Init
-        ncenters = m.shape[0] * m.shape[1]
-        partial_progress = ncenters // 100 or 1
         surf_id_dict = self.landuse_type.surf_id_dict
-
-        # Skip last two rows and last two cols
-        min_z = self.min_z
-        for ip, idxs in enumerate(np.ndindex(m.shape[0] - 2, m.shape[1] - 2)):
-            i, j = idxs
-            p0 = (m[i + 2, j, :2] + m[i + 1, j + 1, :2]) / 2.0
-            p1 = (m[i + 1, j + 1, :2] + m[i, j + 2, :2]) / 2.0
-            z = m[i + 1, j + 1, 2]
-            lu = m[i + 1, j + 1, 3]
-            xb = tuple((p0[0], p1[0], p0[1], p1[1], min_z, z))
+        self._xbs, landuses = core.terrain.get_obsts(self._grid, min_z=self.min_z)
+        surf_ids = dict()  # by landuse
+        for lu in np.unique(landuses).tolist():
             try:
-                surf_id = surf_id_dict[lu]
-            except ValueError:
+                surf_ids[lu] = surf_id_dict[lu]
+            except KeyError:
                 self.feedback.reportError(f"Unknown landuse index <{lu}>, setting <0>.")
-                surf_id = surf_id_dict[0]
-            _obsts.append(
-                f"&OBST XB={xb[0]:.2f},{xb[1]:.2f},{xb[2]:.2f},{xb[3]:.2f},{xb[4]:.2f},{xb[5]:.2f} SURF_ID='{surf_id}' /"
+                surf_ids[lu] = list(surf_id_dict.values())[0]
+        self._surf_ids = [surf_ids[lu] for lu in landuses.tolist()]
+
+    @property
+    def nfaces(self) -> int:
+        """The number of GEOM faces."""
+        return 0
+
+    _count_name = "OBSTs"
+
+    def _get_landuse_counts(self):
+        """Get the present landuses and their OBST counts."""
+        return core.terrain.get_landuse_counts(self._grid.landuse[1:-1, 1:-1])
+
+    @property
+    def nobsts(self) -> int:
+        """The number of OBSTs."""
+        return len(self._xbs)
+
+    def _get_obsts_lines(self, idxs):
+        """Yield the FDS text lines of the OBSTs."""
+        xbs, surf_ids = self._xbs, self._surf_ids
+        for i, xb in zip(idxs, xbs[idxs]):
+            yield f"&OBST XB={xb[0]:.2f},{xb[1]:.2f},{xb[2]:.2f},{xb[3]:.2f},{xb[4]:.2f},{xb[5]:.2f} SURF_ID='{surf_ids[i]}' /"
+
+    def save(self, domain=None) -> None:
+        """!
+        Save the OBST files, one for each MESH.
+        @param domain: the Domain, or None for inline OBSTs.
+        """
+        if domain and self._path and self._name:
+            self._catf_strs = self._save_catf(domain)
+        else:
+            self._catf_strs = None
+        if self._matrix:
+            self._save_matrix()
+        self._saved = True
+
+    def get_fds(self, domain=None) -> str:
+        """!
+        Get the FDS text, and save the OBST files.
+        @param domain: the Domain, to save the OBSTs in a file for each MESH.
+        """
+        return "".join(self.get_fds_chunks(domain=domain))
+
+    def get_fds_chunks(self, domain=None):
+        """!
+        Yield the FDS text by chunks, and save the OBST files.
+        @param domain: the Domain, to save the OBSTs in a file for each MESH.
+        """
+        self._wait_saved(domain)
+        if self._catf_strs is not None:
+            self.feedback.pushInfo(
+                f"OBST terrain ready, in {len(self._catf_strs)} files."
             )
-            if ip % partial_progress == 0:
-                self.feedback.setProgress(int(ip / ncenters * 100))
-
-        self._obsts = _obsts
-
-    def get_fds(self) -> str:
-        """Get the FDS text."""
+            catf_str = "\n".join(self._catf_strs)
+            yield f"""
+Terrain ({self.nobsts} OBSTs, by MESH in {len(self._catf_strs)} files)
+{catf_str}
+"""
+            return
         self.feedback.pushInfo(f"OBST terrain ready.")
-        obsts_str = "\n".join(self._obsts)
-        return f"""
-Terrain ({len(self._obsts)} OBSTs)
-{obsts_str}
+        yield f"""
+Terrain ({self.nobsts} OBSTs)
 """
+        for i, line in enumerate(self._get_obsts_lines(np.arange(self.nobsts))):
+            yield i and f"\n{line}" or line
+        yield "\n"
+
+    # The OBSTs are bucketed by MESH and saved in a file for each MESH,
+    # concatenated to the FDS case by CATF, so that the main file stays small.
+
+    def _save_catf(self, domain) -> list:
+        """!
+        Save the OBST files.
+        @param domain: the Domain
+        @return list of the FDS CATF lines.
+        """
+        xbs = self._xbs
+        meshes = domain.fds_meshes  # files numbered in the FDS MESH order
+        mesh_idxs = core.terrain.get_point_meshes(
+            x=(xbs[:, 0] + xbs[:, 1]) / 2.0,
+            y=(xbs[:, 2] + xbs[:, 3]) / 2.0,
+            mesh_xbs=[xb for _, xb in meshes],
+        )
+        catf_strs = list()
+        for im in range(len(meshes)):
+            idxs = np.flatnonzero(mesh_idxs == im)
+            if not idxs.size:
+                continue  # no terrain in this MESH
+            filename = f"{self._name}_terrain_{im:03d}.fds"
+            utils.write_file_chunks(
+                feedback=self.feedback,
+                filepath=os.path.join(self._path, filename),
+                chunks=(
+                    f"{line}\n"
+                    for line in itertools.chain(
+                        (f"Terrain OBSTs of Mesh{im:03d} ({idxs.size} OBSTs)",),
+                        self._get_obsts_lines(idxs),
+                    )
+                ),
+            )
+            catf_strs.append(
+                f"&CATF OTHER_FILES='{filename}' /  Mesh{im:03d}: {idxs.size} OBSTs"
+            )
+        return catf_strs
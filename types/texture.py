@@ -10,7 +10,8 @@ __revision__ = "$Format:%H$"  # replaced with git SHA1
 import os, time
 from qgis.core import QgsProcessingException, QgsMapSettings, QgsMapRendererParallelJob
 from qgis.utils import iface
-from qgis.PyQt.QtCore import QSize, QCoreApplication
+from qgis.PyQt.QtCore import QSize, QCoreApplication, QByteArray, QBuffer, QIODevice
+from . import utils
 
 
 class Texture:
@@ -27,21 +28,31 @@ class Texture:
         tex_layer,
         utm_extent,
         utm_crs,
+        store_path=None,
+        store_link=False,
     ) -> None:
         self.feedback = feedback
         self.image_type = image_type
         self.pixel_size = pixel_size
         self.tex_layer = tex_layer
         self.utm_crs = utm_crs  # destination_crs
+        self.store_path = store_path
+        self.store_link = store_link
 
         self.filename = f"{name}_tex.{self.image_type}"
+        self.path = path
         self.filepath = os.path.join(path, self.filename)
         self.tex_extent = utm_extent
 
-        self._save()
+        self._image = None
+        self._future = None
+        self._render()
 
-    def _save(self):
-        self.feedback.pushInfo(f"Save terrain texture file: <{self.filepath}>")
+    # The texture is rendered in the main thread, then saved by save(),
+    # possibly in a worker thread by save_async()
+
+    def _render(self):
+        self.feedback.pushInfo(f"Render terrain texture...")
         # Calc tex_extent size in meters (it is in utm)
         tex_extent_xm = self.tex_extent.xMaximum() - self.tex_extent.xMinimum()
         tex_extent_ym = self.tex_extent.yMaximum() - self.tex_extent.yMinimum()
@@ -63,7 +74,7 @@ class Texture:
         settings.setExtent(self.tex_extent)  # in utm_crs
         settings.setOutputSize(QSize(tex_extent_xpix, tex_extent_ypix))
         settings.setLayers(layers)
-        # Render and save image
+        # Render image
         render = QgsMapRendererParallelJob(settings)
         render.start()
         t0 = time.time()
@@ -78,15 +89,79 @@ class Texture:
                 render.cancelWithoutBlocking()
                 self.feedback.reportError("Texture render timed out, no texture saved.")
                 return
-        image = render.renderedImage()
+        self._image = render.renderedImage()
+        self.feedback.pushInfo(f"Texture rendered in {dt:.2f} s")
+
+    def save(self):
+        """Save the rendered texture, if any."""
+        if self._image is None:
+            return
+        self.feedback.pushInfo(f"Save terrain texture file: <{self.filepath}>")
+        if self.store_path:
+            self._save_to_store(self._image)
+        else:
+            self._save_image(self._image, self.filepath)
+        self._image = None  # saved, release
+
+    def save_async(self, executor):
+        """!
+        Save the rendered texture in a worker thread.
+        @param executor: concurrent.futures executor
+        @return the future.
+        """
+        self._future = executor.submit(self.save)
+        return self._future
+
+    def _wait_saved(self):
+        """Wait for the texture saved by save_async, or save it now."""
+        if self._future:
+            future, self._future = self._future, None
+            utils.wait_futures((future,))
+        else:
+            self.save()
+
+    def _save_image(self, image, filepath):
         try:
-            os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
-            image.save(self.filepath, self.image_type)
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            image.save(filepath, self.image_type)
         except Exception as err:
             raise QgsProcessingException(
-                f"Texture file not writable to <{self.filepath}>.\n{err}"
+                f"Texture file not writable to <{filepath}>.\n{err}"
             )
-        self.feedback.pushInfo(f"Texture saved in {dt:.2f} s")
+
+    def _save_to_store(self, image):
+        """Save the image once in the shared store, keyed by its content."""
+        data = QByteArray()
+        buffer = QBuffer(data)
+        buffer.open(QIODevice.WriteOnly)
+        image.save(buffer, self.image_type)
+        buffer.close()
+        data = bytes(data)
+
+        def save(filepath):
+            try:
+                os.makedirs(os.path.dirname(filepath), exist_ok=True)
+                with open(filepath, "wb") as f:
+                    f.write(data)
+            except Exception as err:
+                raise QgsProcessingException(
+                    f"Texture file not writable to <{filepath}>.\n{err}"
+                )
+
+        store_filepath = utils.save_to_store(
+            feedback=self.feedback,
+            store_path=self.store_path,
+            filename=f"{utils.get_digest(data)}.{self.image_type}",
+            save=save,
+        )
+        self.filename = utils.link_from_store(
+            feedback=self.feedback,
+            store_filepath=store_filepath,
+            path=self.path,
+            filename=self.filename,
+            hard_link=self.store_link,
+        )
 
     def get_fds(self):
+        self._wait_saved()
         return f"TERRAIN_IMAGE='{self.filename}'"
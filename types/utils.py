@@ -7,9 +7,27 @@ __date__ = "2020-05-04"
 __copyright__ = "(C) 2020 by Emanuele Gissi"
 __revision__ = "$Format:%H$"  # replaced with git SHA1
 
-import os
+import os, configparser, hashlib, tempfile
 from qgis.core import QgsProcessingException
-from qgis.utils import iface
+from qgis.utils import iface, pluginMetadata
+
+
+# Plugin metadata
+
+
+def get_plugin_version():
+    """!
+    Get the plugin version, also when not loaded by the QGIS plugin manager.
+    @return the plugin version.
+    """
+    version = pluginMetadata("qgis2fds", "version")
+    if version == "__error__":  # headless, read the metadata file
+        parser = configparser.ConfigParser()
+        parser.read(
+            os.path.join(os.path.dirname(os.path.dirname(__file__)), "metadata.txt")
+        )
+        version = parser.get("general", "version", fallback="unknown")
+    return version
 
 
 # Text util
@@ -26,42 +44,181 @@ def write_file(feedback, filepath, content):
     """
     Write a text to filepath.
     """
+    write_file_chunks(feedback=feedback, filepath=filepath, chunks=(content,))
+
+
+def write_file_chunks(feedback, filepath, chunks):
+    """!
+    Write text chunks to filepath, through a buffered temporary file
+    atomically renamed at the end, so that a failed or canceled export
+    never leaves a truncated file.
+    @param feedback: pyqgis feedback
+    @param filepath: destination filepath
+    @param chunks: iterable of texts, eg. a generator
+    @return True if saved, False if canceled.
+    """
     feedback.pushInfo(f"Save file: <{filepath}>")
-    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    tmp_filepath = f"{filepath}.{os.getpid()}.tmp"
+    canceled = False
     try:
-        with open(filepath, "w") as f:
-            f.write(content)
-    except Exception as err:
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(tmp_filepath, "w", buffering=2**20) as f:
+            for chunk in chunks:
+                if feedback.isCanceled():
+                    canceled = True
+                    break
+                f.write(chunk)
+        if not canceled:
+            os.replace(tmp_filepath, filepath)
+    except OSError as err:
         raise QgsProcessingException(
             f"File not writable to <{filepath}>, cannot proceed.\n{err}"
         )
+    finally:
+        if os.path.exists(tmp_filepath):
+            os.remove(tmp_filepath)
+    if canceled:
+        feedback.reportError(f"Canceled, file not saved: <{filepath}>")
+    return not canceled
+
+
+# Artifact files are written concurrently by a thread pool,
+# their errors are raised when waiting for them
 
 
-# The FDS bingeom file is written from Fortran90 like this:
-#      WRITE(731) INTEGER_ONE
-#      WRITE(731) N_VERTS,N_FACES,N_SURF_ID,N_VOLUS
-#      WRITE(731) VERTS(1:3*N_VERTS)
-#      WRITE(731) FACES(1:3*N_FACES)
-#      WRITE(731) SURFS(1:N_FACES)
-#      WRITE(731) VOLUS(1:4*N_VOLUS)
+def wait_futures(futures):
+    """!
+    Wait for all futures, and raise the first error as QgsProcessingException.
+    @param futures: iterable of concurrent.futures futures
+    """
+    error = None
+    for future in futures:
+        try:
+            future.result()
+        except QgsProcessingException as err:
+            error = error or err
+        except Exception as err:
+            error = error or QgsProcessingException(
+                f"File not saved, cannot proceed.\n{err}"
+            )
+    if error:
+        raise error
+
+
+# The FDS bingeom file is written by core.bingeom
 
-import struct
 import numpy as np
+from .. import core
+
+
+def get_digest(*items):
+    """!
+    Get the content hash of bytes and numpy arrays, for the shared store.
+    @param items: bytes or numpy arrays
+    @return the hex digest.
+    """
+    h = hashlib.sha256()
+    for item in items:
+        if isinstance(item, np.ndarray):
+            h.update(f"{item.dtype.str}{item.shape}".encode())
+            item = np.ascontiguousarray(item).tobytes()
+        h.update(item)
+    return h.hexdigest()
 
 
-def _write_record(f, data):
+def _get_store_tmp_filepath(store_path, suffix):
+    """Get a new temporary filepath in the store, unique across processes and threads."""
+    try:
+        os.makedirs(store_path, exist_ok=True)
+        fd, tmp_filepath = tempfile.mkstemp(suffix=suffix, dir=store_path)
+        os.close(fd)
+    except OSError as err:
+        raise QgsProcessingException(f"Store not writable: <{store_path}>.\n{err}")
+    return tmp_filepath
+
+
+def save_to_store(feedback, store_path, filename, save):
+    """!
+    Save a file in the content-addressed shared store, if missing.
+    @param feedback: pyqgis feedback
+    @param store_path: store folder
+    @param filename: content-addressed filename, eg. <digest>.bingeom
+    @param save: function saving the file to a filepath
+    @return the stored filepath.
+    """
+    filepath = os.path.join(store_path, filename)
+    if os.path.isfile(filepath):
+        feedback.pushInfo(f"Reuse stored file: <{filepath}>")
+        return filepath
+    # Save to a temporary file, then atomically rename,
+    # as concurrent exports can share the store
+    tmp_filepath = _get_store_tmp_filepath(store_path, suffix=f".{filename}.tmp")
+    try:
+        save(tmp_filepath)
+        os.replace(tmp_filepath, filepath)
+    except OSError as err:
+        raise QgsProcessingException(
+            f"File not writable to <{filepath}>.\n{err}"
+        )
+    finally:
+        if os.path.exists(tmp_filepath):
+            os.remove(tmp_filepath)
+    return filepath
+
+
+def save_hashed_to_store(feedback, store_path, ext, save):
+    """!
+    Save a file in the content-addressed shared store, hashing it while saving.
+    Used when the content is streamed, and its digest is unknown in advance.
+    @param feedback: pyqgis feedback
+    @param store_path: store folder
+    @param ext: filename extension, eg. .bingeom
+    @param save: function saving the file to a filepath, and returning its digest
+    @return the stored filepath.
+    """
+    tmp_filepath = _get_store_tmp_filepath(store_path, suffix=f"{ext}.tmp")
+    filepath = None
+    try:
+        digest = save(tmp_filepath)
+        filepath = os.path.join(store_path, f"{digest}{ext}")
+        if os.path.isfile(filepath):
+            feedback.pushInfo(f"Reuse stored file: <{filepath}>")
+        else:
+            os.replace(tmp_filepath, filepath)
+    except OSError as err:
+        raise QgsProcessingException(
+            f"File not writable to <{filepath or tmp_filepath}>.\n{err}"
+        )
+    finally:
+        if os.path.exists(tmp_filepath):
+            os.remove(tmp_filepath)
+    return filepath
+
+
+def link_from_store(feedback, store_filepath, path, filename, hard_link=False):
     """!
-    Write a record to a binary unformatted sequential Fortran90 file.
-    @param f: open Python file object in 'wb' mode.
-    @param data: np.array() of data.
+    Reference a stored file from the FDS case folder.
+    @param feedback: pyqgis feedback
+    @param store_filepath: stored filepath
+    @param path: FDS case folder
+    @param filename: hard link filename in the FDS case folder
+    @param hard_link: hard link the stored file, or use a relative path
+    @return the reference for the FDS case.
     """
-    # Calc start and end record tag
-    tag = len(data) * data.dtype.itemsize
-    # print(f"Write: record tag: {tag} dlen: {len(data)}\ndata: {data}")  # TODO log debug
-    # Write start tag, data, and end tag
-    f.write(struct.pack("i", tag))
-    data.tofile(f)
-    f.write(struct.pack("i", tag))
+    if not hard_link:
+        return os.path.relpath(store_filepath, path).replace(os.sep, "/")
+    filepath = os.path.join(path, filename)
+    feedback.pushInfo(f"Link stored file: <{filepath}>")
+    try:
+        os.makedirs(path, exist_ok=True)
+        if os.path.lexists(filepath):
+            os.remove(filepath)
+        os.link(store_filepath, filepath)
+    except OSError as err:
+        raise QgsProcessingException(
+            f"Cannot link <{store_filepath}> to <{filepath}>.\n{err}"
+        )
+    return filename
 
 
 def write_bingeom(
@@ -69,43 +226,40 @@ def write_bingeom(
     filepath,
     geom_type,
     n_surf_id,
-    fds_verts,
-    fds_faces,
-    fds_surfs,
-    fds_volus,
+    n_verts,
+    n_faces,
+    verts_chunks,
+    faces_chunks,
+    surfs_chunks,
+    hashed=False,
 ):
     """!
-    Write FDS bingeom file.
+    Write FDS bingeom file from chunks of data.
     @param feedback: pyqgis feedback
     @param filepath: destination filepath
     @param geom_type: GEOM type (eg. 1 is manifold, 2 is terrain)
     @param n_surf_id: number of referred boundary conditions
-    @param fds_verts: vertices coordinates in FDS flat format, eg. (x0, y0, z0, x1, y1, ...)
-    @param fds_faces: faces connectivity in FDS flat format, eg. (i0, j0, k0, i1, ...)
-    @param fds_surfs: boundary condition indexes, eg. (i0, i1, ...)
-    @param fds_volus: volumes connectivity in FDS flat format, eg. (i0, j0, k0, w0, i1, ...)
+    @param n_verts: number of vertices
+    @param n_faces: number of faces
+    @param verts_chunks: iterable of vertices coordinates arrays, eg. ((x0, y0, z0), (x1, y1, ...
+    @param faces_chunks: iterable of faces connectivity arrays, eg. ((i0, j0, k0), (i1, ...
+    @param surfs_chunks: iterable of boundary condition indexes arrays, eg. (i0, i1, ...)
+    @param hashed: if True, return the sha256 hex digest of the file
+    @return the hex digest, or None.
     """
     feedback.pushInfo(f"Save bingeom file: <{filepath}>")
     try:
-        os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        with open(filepath, "wb") as f:
-            _write_record(f, np.array((geom_type,), dtype="int32"))  # was 1 only
-            _write_record(
-                f,
-                np.array(
-                    (
-                        len(fds_verts) // 3,
-                        len(fds_faces) // 3,
-                        n_surf_id,
-                        len(fds_volus) // 4,
-                    ),
-                    dtype="int32",
-                ),
-            )
-            _write_record(f, np.array(fds_verts, dtype="float64"))
-            _write_record(f, np.array(fds_faces, dtype="int32"))
-            _write_record(f, np.array(fds_surfs, dtype="int32"))
-            _write_record(f, np.array(fds_volus, dtype="int32"))
+        return core.bingeom.write_bingeom_chunks(
+            filepath=filepath,
+            geom_type=geom_type,
+            n_surf_id=n_surf_id,
+            n_verts=n_verts,
+            n_faces=n_faces,
+            verts_chunks=verts_chunks,
+            faces_chunks=faces_chunks,
+            surfs_chunks=surfs_chunks,
+            hashed=hashed,
+        )
     except Exception as err:
         raise QgsProcessingException(
             f"Bingeom file not writable to <{filepath}>, cannot proceed.\n{err}"
@@ -7,15 +7,27 @@ __date__ = "2020-05-04"
 __copyright__ = "(C) 2020 by Emanuele Gissi"
 __revision__ = "$Format:%H$"  # replaced with git SHA1
 
-import csv, os
+import os
+import numpy as np
 from qgis.core import QgsProcessingException
+from .. import core
+from . import utils
 
 
 class Wind:
-    def __init__(self, feedback, project_path, filepath) -> None:
+    def __init__(
+        self,
+        feedback,
+        project_path,
+        filepath,
+        speed_tolerance=None,
+        direction_tolerance=None,
+    ) -> None:
         self.feedback = feedback
         self.filepath = filepath and os.path.join(project_path, filepath) or str()
-        self._ws, self._wd = list(), list()
+        self._ws, self._wd = tuple(), tuple()  # (times, values)
+        self.max_speed = 20.0  # from the example ramps
+        self.directions = np.array((315.0, 270.0, 360.0))  # from the example ramps
 
         # Check
         if not filepath:
@@ -25,35 +37,149 @@ class Wind:
 
         # Import
         try:
-            with open(self.filepath) as csv_file:
-                # wind csv file has an header line and three columns:
-                # time in seconds, wind speed in m/s, and direction in degrees
-                csv_reader = csv.reader(csv_file, delimiter=",")
-                next(csv_reader)  # skip header line
-                for r in csv_reader:
-                    self._ws.append(
-                        f"&RAMP ID='ws', T={float(r[0]):.1f}, F={float(r[1]):.1f} /"
-                    )
-                    self._wd.append(
-                        f"&RAMP ID='wd', T={float(r[0]):.1f}, F={float(r[2]):.1f} /"
-                    )
+            t, ws, wd = core.wind.read_wind_csv(self.filepath)
         except Exception as err:
             raise QgsProcessingException(
                 f"Cannot import wind *.csv file: <{self.filepath}>:\n{err}"
             )
+        self.max_speed = len(ws) and float(ws.max()) or 0.0
+        self.directions = wd[ws > 0.0]  # where the wind comes from, when blowing
+        if not len(t):
+            return
+
+        # Simplify the ramps, on the unwrapped directions
+        wd = core.wind.unwrap_directions(wd)
+        iws = core.wind.get_simplified_ramp(t, ws, speed_tolerance)
+        iwd = core.wind.get_simplified_ramp(t, wd, direction_tolerance)
+        self._ws, self._wd = (t[iws], ws[iws]), (t[iwd], wd[iwd])
+        if len(iws) < len(t) or len(iwd) < len(t):
+            self.feedback.pushInfo(
+                f"Wind ramps simplified from {len(t)} to {len(iws)} speed and {len(iwd)} direction entries."
+            )
 
     def get_fds(self) -> str:
-        result = f"""
+        return "".join(self.get_fds_chunks())
+
+    def get_fds_chunks(self):
+        """Yield the FDS text by chunks, the ramps can be long."""
+        yield f"""
 Wind
 &WIND SPEED=1., RAMP_SPEED_T='ws', RAMP_DIRECTION_T='wd' /\n"""
         if self._ws:
-            result += "\n".join(("\n".join(self._ws), "\n".join(self._wd)))
+            i = 0
+            for ramp_id, (ts, fs) in (("ws", self._ws), ("wd", self._wd)):
+                for t, f in zip(ts.tolist(), fs.tolist()):
+                    ramp = f"&RAMP ID='{ramp_id}', T={t:.1f}, F={f:.1f} /"
+                    yield i and f"\n{ramp}" or ramp
+                    i += 1
         else:
-            result += f"""! Example ramps for wind speed and direction
+            yield f"""! Example ramps for wind speed and direction
 &RAMP ID='ws', T=   0, F= 10. /
 &RAMP ID='ws', T= 600, F= 10. /
 &RAMP ID='ws', T=1200, F= 20. /
 &RAMP ID='wd', T=   0, F=315. /
 &RAMP ID='wd', T= 600, F=270. /
 &RAMP ID='wd', T=1200, F=360. /"""
-        return result
+
+
+class WindField:
+    """!
+    Gridded initial wind field from U and V rasters in UTM,
+    written as an FDS UVW file for each MESH.
+    """
+
+    def __init__(
+        self, feedback, path, name, u_filepath, v_filepath, utm_origin
+    ) -> None:
+        """!
+        @param feedback: pyqgis feedback
+        @param path: FDS case folder
+        @param name: the name of the exported files, eg. the chid.
+        @param u_filepath: U wind raster filepath, in UTM
+        @param v_filepath: V wind raster filepath, in UTM
+        @param utm_origin: domain origin, in UTM
+        """
+        self.feedback = feedback
+        self._path = path
+        self.set_name(name)
+        self._origin = utm_origin.x(), utm_origin.y()
+        self.feedback.pushInfo("Import U and V wind rasters...")
+        try:
+            self._u, self._gt = core.wind.read_raster(u_filepath)
+            self._v, v_gt = core.wind.read_raster(v_filepath)
+        except ImportError as err:
+            raise QgsProcessingException(
+                f"GDAL not available, cannot import the wind rasters.\n{err}"
+            )
+        except (OSError, ValueError) as err:
+            raise QgsProcessingException(
+                f"Cannot import the wind rasters, cannot proceed.\n{err}"
+            )
+        if self._u.shape != self._v.shape or not np.allclose(self._gt, v_gt):
+            raise QgsProcessingException(
+                "U and V wind rasters are not on the same grid, cannot proceed."
+            )
+
+    def set_name(self, name) -> None:
+        """!
+        Set a new name of the exported files.
+        @param name: the new name, eg. the chid.
+        """
+        self._name = name
+
+    def get_fds(self, domain) -> str:
+        return "".join(self.get_fds_chunks(domain=domain))
+
+    def get_fds_chunks(self, domain):
+        """!
+        Yield the FDS text by chunks, and save the UVW files.
+        @param domain: the Domain
+        """
+        csvf_strs = list()
+        for im, (ijk, xb) in enumerate(domain.fds_meshes):
+            mesh_u, mesh_v = core.wind.get_mesh_uv(
+                ijk=ijk,
+                xb=xb,
+                origin=self._origin,
+                u=self._u,
+                v=self._v,
+                geotransform=self._gt,
+            )
+            nodata = np.isnan(mesh_u) | np.isnan(mesh_v)
+            if nodata.any():
+                self.feedback.reportError(
+                    f"Mesh{im:03d}: {int(nodata.sum())} wind nodata columns, set to zero."
+                )
+                mesh_u, mesh_v = np.nan_to_num(mesh_u), np.nan_to_num(mesh_v)
+            filename = f"{self._name}_uvw_{im:03d}.csv"
+            utils.write_file_chunks(
+                feedback=self.feedback,
+                filepath=os.path.join(self._path, filename),
+                chunks=self._get_uvw_chunks(ijk, mesh_u, mesh_v),
+            )
+            csvf_strs.append(f"&CSVF UVWFILE='{filename}' /")
+        self.feedback.pushInfo(f"Wind field ready, in {len(csvf_strs)} files.")
+        csvf_str = "\n".join(csvf_strs)
+        yield f"""
+Initial wind field, a UVW file for each MESH in order
+{csvf_str}
+"""
+
+    # FDS UVW file: the IMIN,IMAX,JMIN,JMAX,KMIN,KMAX header line,
+    # then a U,V,W line for each I, J, and K, with K varying fastest.
+    # The field is uniform along z, so each line is repeated KBAR + 1 times.
+
+    def _get_uvw_chunks(self, ijk, mesh_u, mesh_v):
+        """Yield the UVW file text by chunks, an I slab each."""
+        ibar, jbar, kbar = ijk
+        yield f"0,{ibar:d},0,{jbar:d},0,{kbar:d}\n"
+        nlines = (jbar + 1) * (kbar + 1)
+        line_fmt = "%.5E,%.5E,0.00000E+00\n" * nlines
+        for i in range(ibar + 1):
+            uv = np.column_stack(
+                (
+                    np.repeat(mesh_u[i], kbar + 1),
+                    np.repeat(mesh_v[i], kbar + 1),
+                )
+            )
+            yield line_fmt % tuple(uv.ravel().tolist())